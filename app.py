@@ -1,36 +1,310 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from datetime import datetime
-import hashlib
+import logging
 import os
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime
 from dotenv import load_dotenv
-from config.database import get_db_connection, init_database
+from config.circuit_breaker import db_unavailable, get_breaker
+from config import statements
+from config.database import (current_site, get_db_connection, get_sites, get_users_connection, init_database,
+                             use_site)
+from config.db_replay import install_request_recording
+from config.logging_config import setup_logging
+from config.tracing import install_tracing, tracer, waterfall
+from config.users import hash_password, insert_user, user_site, validate_new_user
+from timesheet import queries, schemas
+from timesheet.hm_store import SiteHmStores, readings_from_step3
+from timesheet.prefetch import Prefetcher
+from timesheet.schemas import SchemaError
+from timesheet.shared_cache import LastGoodStore, SharedCache
+from timesheet.wire import encode_table, requested_orient
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
 
+setup_logging(app)
+install_tracing(app)
+install_request_recording(app)
+logger = logging.getLogger(__name__)
+
 init_database()
 
+read_cache = SharedCache.from_env()
+# A write in any worker invalidates the shared cache, and with it every worker's prefetches
+prefetcher = Prefetcher.from_env(read_cache.generation if read_cache is not None else None)
+READ_CACHE_TTL = float(os.getenv('SHARED_CACHE_TTL_SECONDS', '30'))
+# Every timesheet write can change all three kinds of read result
+READ_CACHE_TAGS = ('step3', 'trips', 'login')
+last_good = LastGoodStore()
+hm_stores = SiteHmStores.from_env()
+BOOTSTRAP_STEP_DATA = os.getenv('BOOTSTRAP_STEP_DATA', 'no').lower() == 'yes'
+BOOTSTRAP_ROWS = int(os.getenv('BOOTSTRAP_ROWS', '500'))
+HM_STORE_HISTORY_MAX_AGE = float(os.getenv('HM_STORE_HISTORY_MAX_AGE_SECONDS', '30'))
+TRACE_PAGE_MAX = 200
+
 
 @app.route('/api/timesheet/historical-login')
 def api_historical_login():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     mobileid = request.args.get('mobileid')
     if not mobileid:
         return jsonify({'success': False, 'error': 'Missing mobileid'})
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("exec dbo.miosphere_dtv_get_latest_login_data @mobileid=?", mobileid)
-        columns = [col[0] for col in cursor.description]
-        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        return jsonify({'success': True, 'rows': rows})
+        rows, stale_since = stored_login_history(mobileid), None
+        if rows is None:
+            rows, stale_since = load_latest_login(mobileid)
+        return table_response({'success': True, 'rows': rows, **freshness(stale_since)}, 'rows')
     except Exception as e:
+        if db_unavailable(e):
+            return database_unavailable(e)
         return jsonify({'success': False, 'error': str(e)})
 
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+def prefetch_session_key() -> str:
+    """Return the key that scopes prefetched results to the current browser session."""
+    if 'prefetch_key' not in session:
+        session['prefetch_key'] = uuid.uuid4().hex
+    return session['prefetch_key']
+
+
+def trips_query_key(equipment: str, operator: str, date: str, shifts) -> tuple:
+    return ('trips', equipment, operator, date, tuple(queries.normalize_shifts(shifts)))
+
+
+def read_cache_key(key: tuple) -> str:
+    # Sites share the cache but not their data
+    return repr((current_site(),) + key)
+
+
+def cached_read(tag: str, key: tuple, fn, *args):
+    """
+    Run a read query through the cache shared by all workers, if it is enabled.
+    Returns (result, stale_since): stale_since is None for a fresh result, or the
+    time the last good result was read if the database is unavailable.
+    """
+    cache_key = read_cache_key(key)
+
+    def compute():
+        result = fn(*args)
+        if result is not None:
+            last_good.put(cache_key, result)
+        return result
+
+    try:
+        if read_cache is None:
+            return compute(), None
+        return read_cache.get_or_compute(cache_key, compute, ttl=READ_CACHE_TTL, tag=tag), None
+    except Exception as e:
+        saved = last_good.get(cache_key) if db_unavailable(e) else None
+        if saved is None:
+            raise
+        logger.warning("Database unavailable (%s), serving %s result from %.0fs ago",
+                       e, tag, time.time() - saved[0])
+        return saved[1], saved[0]
+
+
+def freshness(stale_since) -> dict:
+    """Response fields telling the client whether a read result is stale, and how old it is."""
+    if stale_since is None:
+        return {'stale': False}
+    return {'stale': True, 'stale_age_seconds': round(time.time() - stale_since, 1)}
+
+
+def table_response(body: dict, key: str, columns=None):
+    """Respond with body, sending body[key] as a compact table if the client asked for one."""
+    orient = requested_orient(request.args, request.headers.get('Accept', ''))
+    if orient is not None:
+        body[key] = encode_table(body[key], columns, orient)
+    response = jsonify(body)
+    response.vary.add('Accept')
+    return response
+
+
+def database_unavailable(e):
+    """503 response for a read that failed because the database is down and nothing was cached."""
+    retry_after = getattr(e, 'retry_after', None) or get_breaker(current_site()).open_seconds
+    response = jsonify({'success': False, 'message': 'Database is temporarily unavailable, please try again shortly.'})
+    response.headers['Retry-After'] = str(max(1, int(round(retry_after))))
+    return response, 503
+
+
+def store_hm_readings(convert, rows) -> None:
+    """Queue HM readings fetched from SQL Server for the local HM store."""
+    if hm_stores is not None:
+        hm_stores.writer(current_site()).append(convert, rows)
+
+
+def correct_stored_hm(row_id, new_hm) -> None:
+    """Queue an HM correction for the local HM store, behind any readings already queued."""
+    if hm_stores is not None:
+        hm_stores.writer(current_site()).correct_hm(row_id, new_hm)
+
+
+def fetch_step3():
+    result = queries.fetch_realtime_hm_validation()
+    if result is not None:
+        store_hm_readings(readings_from_step3, result['rows'])
+    return result
+
+
+def fetch_latest_login(mobileid: str):
+    fetched_at = time.time()
+    rows = queries.fetch_latest_login(mobileid)
+    if hm_stores is not None:
+        hm_stores.writer(current_site()).append_history(mobileid, rows, fetched_at)
+    return rows
+
+
+def stored_login_history(mobileid: str):
+    """The unit's login history from the local HM store, or None if SQL Server has to be asked."""
+    if hm_stores is None or HM_STORE_HISTORY_MAX_AGE <= 0:
+        return None
+    try:
+        return hm_stores.store(current_site()).login_history(mobileid, HM_STORE_HISTORY_MAX_AGE)
+    except Exception as e:
+        logger.warning("Could not read login history from the HM store: %s", e, exc_info=True)
+        return None
+
+
+def load_step3():
+    return cached_read('step3', ('step3',), fetch_step3)
+
+
+def load_trips(equipment: str, operator: str, date: str, shifts):
+    return cached_read('trips', trips_query_key(equipment, operator, date, shifts),
+                       queries.fetch_trips, equipment, operator, date, shifts)
+
+
+def load_latest_login(mobileid: str):
+    return cached_read('login', ('login', mobileid), fetch_latest_login, mobileid)
+
+
+def invalidate_reads() -> None:
+    """Drop read results made stale by a write, here and in every other worker."""
+    prefetcher.invalidate()
+    if hm_stores is not None:
+        try:
+            hm_stores.store(current_site()).clear_history(time.time())
+        except OSError as e:
+            logger.warning("Could not mark stored login histories stale: %s", e)
+    if read_cache is not None:
+        read_cache.invalidate_tags(READ_CACHE_TAGS)
+
+
+def prefetch_trips(step1: dict, step2: dict) -> None:
+    """
+    Start loading the step 2 trip list if both the date/shifts and the unit are known.
+    A prefetch is only an optimisation, so it never fails the request that triggers it.
+    """
+    try:
+        equipment = (step2.get('equipmentNumber') or '').strip()
+        operator = (step2.get('operatorId') or '').strip()
+        date = (step1.get('selectedDate') or '').strip()
+        shifts = step1.get('selectedShifts') or []
+        if equipment and date and shifts:
+            prefetcher.schedule(prefetch_session_key(), trips_query_key(equipment, operator, date, shifts),
+                                load_trips, equipment, operator, date, shifts)
+    except Exception as e:
+        logger.warning("Not prefetching trips: %s", e, exc_info=True)
+
+
+def cached_step3():
+    """
+    Step 3 result this session already has without querying: its finished prefetch,
+    or the shared read cache. Returns (result, stale_since, seconds it stays fresh) or None.
+    """
+    prefetched = prefetcher.peek(prefetch_session_key(), ('step3',))
+    if prefetched is not None:
+        (result, stale_since), age = prefetched
+        return result, stale_since, READ_CACHE_TTL - age
+    cached = read_cache.peek(read_cache_key(('step3',))) if read_cache is not None else None
+    if cached is not None:
+        result, expires_in = cached
+        return result, None, READ_CACHE_TTL if expires_in is None else min(expires_in, READ_CACHE_TTL)
+    return None
+
+
+def wizard_bootstrap() -> dict:
+    """
+    Wizard state embedded in the dashboard page so the wizard steps can open
+    without API calls: the saved step 1 and 2 data and, once step 2 has been
+    saved and the step 3 result is already cached, the first BOOTSTRAP_ROWS rows
+    of its validation table. The wizard still starts at step 1; each step uses
+    its part once. The page never runs the step 3 query itself.
+    """
+    step1 = session.get('timesheet_step1', {})
+    step2 = session.get('timesheet_step2', {})
+    bootstrap = {'step1': step1, 'step2': step2}
+    if step2 and BOOTSTRAP_STEP_DATA:
+        cached = cached_step3()
+        # The wizard fetches step 3 itself if it is not in the page
+        if cached is not None and cached[0] is not None and cached[2] > 0:
+            result, stale_since, max_age = cached
+            bootstrap['step3'] = {
+                'columns': result['columns'],
+                'rows': encode_table(result['rows'][:BOOTSTRAP_ROWS], result['columns'], 'columns'),
+                'truncated': len(result['rows']) > BOOTSTRAP_ROWS,
+                'max_age_seconds': round(max_age, 1),
+                **freshness(stale_since),
+            }
+    return bootstrap
+
+
+# Where a request names the unit it is about: query string arguments, then JSON body fields
+SITE_ROUTING_ARGS = ('mobileid', 'equipment')
+SITE_ROUTING_FIELDS = ('mobileid', 'equipmentNo', 'equipmentNumber')
+
+
+@app.before_request
+def route_database_site():
+    """
+    Send this request's database calls to the site of the unit it is about, or of
+    the user; a signed-in user gets a 403 for units of any other site. Requests
+    without a session are not routed by the units they name: they stay on the
+    default site, and the routes that read unit data turn them away.
+    """
+    sites = get_sites()
+    if not sites.multi_site:
+        return
+    if 'user_id' in session and session.get('site') not in sites.sites:
+        # Signed in without a known site (e.g. before DB_SITES was set); logging in again looks it up
+        session.clear()
+    if 'user_id' not in session:
+        return
+    mobileids = [request.args.get(name) for name in SITE_ROUTING_ARGS]
+    body = request.get_json(silent=True) if request.is_json else None
+    if isinstance(body, dict):
+        mobileids += [body.get(name) for name in SITE_ROUTING_FIELDS]
+    if not any(mobileids):
+        # Trip and HM edits carry only row ids; they belong to the unit picked in the wizard
+        mobileids.append((session.get('timesheet_step2') or {}).get('equipmentNumber'))
+    # No unit named anywhere in the request may reach into another site's database
+    foreign = {sites.site_for_mobileid(mobileid) for mobileid in mobileids} - {None, session['site']}
+    if foreign:
+        logger.warning("User %s of site %s asked for a unit of site %s",
+                       session.get('username'), session['site'], ', '.join(sorted(foreign)))
+        return jsonify({'success': False, 'message': 'This unit belongs to another site'}), 403
+    use_site(sites.route(*mobileids, user_site=session['site']))
+
+
+@app.teardown_request
+def reset_database_site(exc=None):
+    use_site(None)
+
+
+def decode_request(schema):
+    """Decode the JSON body of the current request, raising SchemaError if it is invalid."""
+    return schema.decode(request.get_json(silent=True))
+
+
+@app.errorhandler(SchemaError)
+def handle_schema_error(e):
+    return jsonify(e.to_dict()), 400
 
 
 @app.route('/')
@@ -49,28 +323,35 @@ def login():
             return render_template('login.html')
         
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
             hashed_password = hash_password(password)
-            cursor.execute(
-                "SELECT id, username, fullname FROM miosphere_users WHERE username = ? AND password = ?",
-                (username, hashed_password)
-            )
-            user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            # The site column only exists once a deployment serves more than one site
+            site_column = ', site' if get_sites().multi_site else ''
+            with closing(get_users_connection()) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT id, username, fullname{site_column} FROM miosphere_users WHERE username = ? AND password = ?",
+                    (username, hashed_password)
+                )
+                user = cursor.fetchone()
+                cursor.close()
             
-            if user:
+            site = user_site(user[3]) if user and site_column else None
+            if user and site_column and site not in get_sites().sites:
+                # Routing and the site check depend on it, so never guess a user's site
+                logger.error("User %s has no valid site (%r); set miosphere_users.site", user[1], user[3])
+                flash('Your account is not assigned to a site. Please contact an administrator.', 'error')
+            elif user:
                 session['user_id'] = user[0]
                 session['username'] = user[1]
                 session['fullname'] = user[2]
+                session['site'] = site
                 flash('Login successful!', 'success')
                 return redirect(url_for('dashboard'))
             else:
                 flash('Invalid username or password', 'error')
         except Exception as e:
             flash(f'Database error: {str(e)}', 'error')
-            print(f"Login error: {e}")
+            logger.error("Login error: %s", e, exc_info=True)
         
         return render_template('login.html')
     
@@ -82,7 +363,32 @@ def dashboard():
     if 'user_id' not in session:
         flash('Please login to access the dashboard', 'error')
         return redirect(url_for('login'))
-    return render_template('dashboard.html', fullname=session.get('fullname'))
+    return render_template('dashboard.html', fullname=session.get('fullname'),
+                           bootstrap=wizard_bootstrap())
+
+
+@app.route('/admin/traces')
+def admin_traces():
+    if 'user_id' not in session:
+        flash('Please login to access the dashboard', 'error')
+        return redirect(url_for('login'))
+    # Traces hold raw SQL text: only the users named in TRACE_ADMIN_USERS may see them
+    admins = [u.strip() for u in os.getenv('TRACE_ADMIN_USERS', '').split(',') if u.strip()]
+    if session.get('username') not in admins:
+        return 'Forbidden', 403
+    limit = min(max(request.args.get('limit', 20, type=int), 1), TRACE_PAGE_MAX)
+    traces = tracer.slowest(limit)
+    for trace in traces:
+        trace['waterfall'] = waterfall(trace)
+        trace['started_label'] = datetime.fromtimestamp(trace['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+    return render_template('traces.html', traces=traces, kept=len(tracer.recent()),
+                           sample_rate=tracer.sample_rate, slow_ms=tracer.slow_ms, pid=os.getpid())
+
+
+def render_register():
+    # With several sites every account must say which one it belongs to
+    sites = get_sites()
+    return render_template('register.html', sites=list(sites.sites) if sites.multi_site else None)
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -92,63 +398,51 @@ def register():
         password = request.form.get('password', '').strip()
         confirm_password = request.form.get('confirm_password', '').strip()
         fullname = request.form.get('fullname', '').strip()
+        site = user_site(request.form.get('site'))
         
         if not username or not password or not confirm_password or not fullname:
             flash('All fields are required', 'error')
-            return render_template('register.html')
+            return render_register()
         
         if password != confirm_password:
             flash('Passwords do not match', 'error')
-            return render_template('register.html')
-        
-        if len(password) < 4:
-            flash('Password must be at least 4 characters long', 'error')
-            return render_template('register.html')
+            return render_register()
         
-        if len(username) < 3:
-            flash('Username must be at least 3 characters long', 'error')
-            return render_template('register.html')
+        error = validate_new_user(username, password, fullname, site)
+        if error:
+            flash(error, 'error')
+            return render_register()
         
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id FROM miosphere_users WHERE username = ?",
-                (username,)
-            )
-            existing_user = cursor.fetchone()
-            
-            if existing_user:
+            with closing(get_users_connection()) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT id FROM miosphere_users WHERE username = ?",
+                    (username,)
+                )
+                existing_user = cursor.fetchone()
+
+                if existing_user:
+                    cursor.close()
+                    flash('Username already exists. Please choose a different username.', 'error')
+                    return render_register()
+
+                hashed_password = hash_password(password)
+                fullname_upper = fullname.upper()
+                insert_user(cursor, username, hashed_password, fullname_upper, site)
+                conn.commit()
                 cursor.close()
-                conn.close()
-                flash('Username already exists. Please choose a different username.', 'error')
-                return render_template('register.html')
-            
-            hashed_password = hash_password(password)
-            fullname_upper = fullname.upper()
-            cursor.execute(
-                "INSERT INTO miosphere_users (username, password, fullname) VALUES (?, ?, ?)",
-                (username, hashed_password, fullname_upper)
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
             
             flash('Registration successful! You can now login.', 'success')
             return redirect(url_for('login'))
         except Exception as e:
+            # Closing hands the connection back to the pool, which rolls back anything uncommitted
             flash(f'Database error: {str(e)}', 'error')
-            print(f"Registration error: {e}")
-            try:
-                conn.rollback()
-                cursor.close()
-                conn.close()
-            except:
-                pass
+            logger.error("Registration error: %s", e, exc_info=True)
         
-        return render_template('register.html')
+        return render_register()
     
-    return render_template('register.html')
+    return render_register()
 
 
 @app.route('/logout')
@@ -164,16 +458,9 @@ def timesheet_step1():
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
     if request.method == 'POST':
-        try:
-            data = request.get_json()
-            session['timesheet_step1'] = {
-                'selectedDate': data.get('selectedDate', ''),
-                'selectedShifts': data.get('selectedShifts', []),
-                'unitType': data.get('unitType', '3 Shift')
-            }
-            return jsonify({'success': True, 'message': 'Step 1 data saved'})
-        except Exception as e:
-            return jsonify({'success': False, 'message': str(e)}), 400
+        session['timesheet_step1'] = decode_request(schemas.STEP1)
+        prefetch_trips(session['timesheet_step1'], session.get('timesheet_step2', {}))
+        return jsonify({'success': True, 'message': 'Step 1 data saved'})
     
     step1_data = session.get('timesheet_step1', {})
     return jsonify({'success': True, 'data': step1_data})
@@ -185,17 +472,11 @@ def timesheet_step2():
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
     if request.method == 'POST':
-        try:
-            data = request.get_json()
-            session['timesheet_step2'] = {
-                'equipmentNumber': data.get('equipmentNumber', ''),
-                'operatorId': data.get('operatorId', ''),
-                'trips': data.get('trips', []),
-                'history': []
-            }
-            return jsonify({'success': True, 'message': 'Step 2 data saved'})
-        except Exception as e:
-            return jsonify({'success': False, 'message': str(e)}), 400
+        data = decode_request(schemas.STEP2)
+        data['history'] = []
+        session['timesheet_step2'] = data
+        prefetcher.schedule(prefetch_session_key(), ('step3',), load_step3)
+        return jsonify({'success': True, 'message': 'Step 2 data saved'})
     
     step2_data = session.get('timesheet_step2', {})
     return jsonify({'success': True, 'data': step2_data})
@@ -207,44 +488,17 @@ def timesheet_step3():
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SET NOCOUNT ON; EXEC [dbo].[miosphere_dtv_get_realtime_hm_validation]")
-
-        max_sets = 10
-        sets_checked = 0
-        while cursor.description is None and sets_checked < max_sets:
-            if not cursor.nextset():
-                break
-            sets_checked += 1
-
-        if cursor.description is None:
-            cursor.close()
-            conn.close()
+        result, stale_since = prefetcher.get_or_run(prefetch_session_key(), ('step3',),
+                                                    load_step3)
+        if result is None:
             return jsonify({'success': False, 'message': 'No results. Previous SQL was not a query.'}), 400
-
-        col_names = [col[0] for col in cursor.description]
-        rows = cursor.fetchall()
-
-        result = []
-        for row in rows:
-            item = {}
-            for idx, col in enumerate(col_names):
-                val = row[idx] if idx < len(row) else None
-                try:
-                    if hasattr(val, 'isoformat'):
-                        val = val.isoformat()
-                except Exception:
-                    pass
-                item[col] = val
-            result.append(item)
-
-        cursor.close()
-        conn.close()
-        return jsonify({'success': True, 'columns': col_names, 'rows': result})
+        return table_response({'success': True, 'columns': result['columns'], 'rows': result['rows'],
+                               **freshness(stale_since)}, 'rows', result['columns'])
 
     except Exception as e:
-        print(f"Error fetching realtime HM validation: {e}")
+        if db_unavailable(e):
+            return database_unavailable(e)
+        logger.error("Error fetching realtime HM validation: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -266,55 +520,15 @@ def fetch_trips():
         return jsonify({'success': False, 'message': 'At least one shift required'}), 400
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        all_trips = []
-        seen_ids = set()
-        
-        for shift_code in shifts:
-            shift_code_upper = shift_code.upper().strip()
-            if shift_code_upper not in ['S01', 'S02', 'S03', 'S08', 'S09']:
-                continue
-            
-            if operator:
-                query = "EXECUTE dbo.miosphere_dtv_get_trip_by_unit_nrp @date = ?, @shift_code = ?, @mobileid = ?, @opr_nrp = ?"
-                cursor.execute(query, (date, shift_code_upper, equipment, operator))
-            else:
-                query = "EXECUTE dbo.miosphere_dtv_get_trip_by_unit @date = ?, @shift_code = ?, @mobileid = ?"
-                cursor.execute(query, (date, shift_code_upper, equipment))
-            
-            rows = cursor.fetchall()
-            
-            for row in rows:
-                trip = {
-                    'id': str(row[0]) if row[0] else None,
-                    'reportTime': row[1].isoformat() if row[1] else None,
-                    'equipmentNo': row[2] if row[2] else '',
-                    'operatorId': row[3] if row[3] else '',
-                    'operatorName': row[4] if row[4] else '',
-                    'oprShift': row[5] if (len(row) > 5 and row[5] is not None) else '',
-                    'loaderId': row[6] if (len(row) > 6 and row[6]) else '',
-                    'posName': row[7] if (len(row) > 7 and row[7]) else '',
-                    'distance': row[8] if (len(row) > 8 and row[8] is not None) else '',
-                    'note': 'deleted' if (len(row) > 9 and row[9] == 1 and (len(row) > 10 and row[10] == 'trip')) else '',
-                    'recordType': row[10] if len(row) > 10 else 'trip'
-                }
-                
-                trip_id = trip.get('id')
-                if trip_id:
-                    if trip_id in seen_ids:
-                        continue
-                    seen_ids.add(trip_id)
-
-                all_trips.append(trip)
-        
-        cursor.close()
-        conn.close()
-        all_trips.sort(key=lambda x: x['reportTime'] if x['reportTime'] else '')
-        return jsonify({'success': True, 'trips': all_trips})
+        all_trips, stale_since = prefetcher.get_or_run(prefetch_session_key(),
+                                                       trips_query_key(equipment, operator, date, shifts),
+                                                       load_trips, equipment, operator, date, shifts)
+        return table_response({'success': True, 'trips': all_trips, **freshness(stale_since)}, 'trips')
         
     except Exception as e:
-        print(f"Error fetching trips: {e}")
+        if db_unavailable(e):
+            return database_unavailable(e)
+        logger.error("Error fetching trips: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -323,9 +537,8 @@ def timesheet_sort():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    trips = decode_request(schemas.SORT_TRIPS)['trips']
     try:
-        data = request.get_json()
-        trips = data.get('trips', [])
         trips.sort(key=lambda x: x.get('reportTime', '') or '')
         return jsonify({'success': True, 'trips': trips})
     except Exception as e:
@@ -337,70 +550,33 @@ def add_trip():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    data = decode_request(schemas.ADD_TRIP)
+    report_time_dt = data['reportTime']
+    report_time_str = report_time_dt.isoformat(sep=' ')
+    mobile_id = data['equipmentNo']
+    opr_nrp = data['operatorId']
+    
     try:
-        data = request.get_json()
-        report_time = data.get('reportTime', '')
-        mobile_id = data.get('equipmentNo', '')
-        opr_nrp = data.get('operatorId', '')
-        opr_shift = data.get('oprShift', '')
-        act_loaderid = data.get('loaderId', '')
-        pos_name = data.get('posName', '')
-        act_hauldistance = data.get('distance', '')
-        
-        if not report_time or not mobile_id or not opr_nrp:
-            return jsonify({'success': False, 'message': 'Missing required fields'}), 400
-        
-        try:
-            if 'T' in report_time:
-                report_time_dt = datetime.strptime(report_time.split('.')[0], '%Y-%m-%dT%H:%M:%S')
-            else:
-                report_time_dt = datetime.strptime(report_time, '%Y-%m-%d %H:%M:%S')
-            report_time_str = report_time_dt.strftime('%Y-%m-%d %H:%M:%S')
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Invalid date format: {str(e)}'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        EXEC dbo.miosphere_dtv_insert_trip
-            @rep = ?,
-            @mobileid = ?,
-            @opr_nrp = ?,
-            @opr_shift = ?,
-            @act_loaderid = ?,
-            @pos_name = ?,
-            @act_hauldistance = ?
-        """
-        
-        cursor.execute(query, (
-            report_time_str,
-            mobile_id,
-            opr_nrp,
-            opr_shift if opr_shift else None,
-            act_loaderid if act_loaderid else None,
-            pos_name if pos_name else None,
-            act_hauldistance if act_hauldistance else None
-        ))
-        
-        conn.commit()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'insert_trip',
+                            report_time_str,
+                            mobile_id,
+                            opr_nrp,
+                            data['oprShift'],
+                            data['loaderId'],
+                            data['posName'],
+                            data['distance'])
+            conn.commit()
         
-        id_query = """
-        SELECT TOP 1 id 
-        FROM db_web.dbo.opr_dump 
-        WHERE reporttime = ? AND mobileid = ? AND opr_nrp = ?
-        ORDER BY id DESC
-        """
-        cursor.execute(id_query, (report_time_dt, mobile_id, opr_nrp))
-        row = cursor.fetchone()
-        generated_id = str(row[0]) if row and row[0] else None
-        cursor.close()
-        conn.close()
+            with statements.run(conn, 'inserted_trip_id', report_time_dt, mobile_id, opr_nrp) as cursor:
+                row = cursor.fetchone()
+            generated_id = str(row[0]) if row and row[0] else None
+        invalidate_reads()
         
         return jsonify({'success': True, 'message': 'Trip added successfully', 'id': generated_id})
         
     except Exception as e:
-        print(f"Error adding trip: {e}")
+        logger.error("Error adding trip: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -409,24 +585,17 @@ def delete_trip():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    trip_id = decode_request(schemas.TRIP_ID)['id']
+    
     try:
-        data = request.get_json()
-        trip_id = data.get('id')
-        
-        if not trip_id:
-            return jsonify({'success': False, 'message': 'Missing trip ID'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        query = "EXECUTE dbo.miosphere_dtv_delete_trip @id = ?"
-        cursor.execute(query, (trip_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'delete_trip', trip_id)
+            conn.commit()
+        invalidate_reads()
         
         return jsonify({'success': True, 'message': 'Trip deleted successfully'})
     except Exception as e:
-        print(f"Error deleting trip: {e}")
+        logger.error("Error deleting trip: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -435,24 +604,17 @@ def restore_trip():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    trip_id = decode_request(schemas.TRIP_ID)['id']
+    
     try:
-        data = request.get_json()
-        trip_id = data.get('id')
-        
-        if not trip_id:
-            return jsonify({'success': False, 'message': 'Missing trip ID'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        query = "EXECUTE dbo.miosphere_dtv_restore_trip @id = ?"
-        cursor.execute(query, (trip_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'restore_trip', trip_id)
+            conn.commit()
+        invalidate_reads()
         
         return jsonify({'success': True, 'message': 'Trip restored successfully'})
     except Exception as e:
-        print(f"Error restoring trip: {e}")
+        logger.error("Error restoring trip: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -461,55 +623,23 @@ def update_trip():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    data = decode_request(schemas.UPDATE_TRIP)
+    report_time_str = data['reportTime'].isoformat(sep=' ') if data['reportTime'] else None
+    
     try:
-        data = request.get_json()
-        trip_id = data.get('id')
-        report_time = data.get('reportTime', '')
-        loader_id = data.get('loaderId', '')
-        pos_name = data.get('posName', '')
-        distance = data.get('distance', '')
-        
-        if not trip_id:
-            return jsonify({'success': False, 'message': 'Missing trip ID'}), 400
-        
-        report_time_str = None
-        if report_time:
-            try:
-                if 'T' in report_time:
-                    report_time_dt = datetime.strptime(report_time.split('.')[0], '%Y-%m-%dT%H:%M:%S')
-                else:
-                    report_time_dt = datetime.strptime(report_time, '%Y-%m-%d %H:%M:%S')
-                report_time_str = report_time_dt.strftime('%Y-%m-%d %H:%M:%S')
-            except Exception as e:
-                return jsonify({'success': False, 'message': f'Invalid date format: {str(e)}'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        EXECUTE dbo.miosphere_dtv_modify_trip
-            @id = ?,
-            @reporttime = ?,
-            @act_loaderid = ?,
-            @pos_name = ?,
-            @act_hauldistance = ?
-        """
-        
-        cursor.execute(query, (
-            trip_id,
-            report_time_str if report_time_str else None,
-            loader_id if loader_id else None,
-            pos_name if pos_name else None,
-            distance if distance else None
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'modify_trip',
+                            data['id'],
+                            report_time_str,
+                            data['loaderId'],
+                            data['posName'],
+                            data['distance'])
+            conn.commit()
+        invalidate_reads()
         
         return jsonify({'success': True, 'message': 'Trip updated successfully'})
     except Exception as e:
-        print(f"Error updating trip: {e}")
+        logger.error("Error updating trip: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -518,95 +648,27 @@ def update_shift():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    data = decode_request(schemas.UPDATE_SHIFT)
+    
     try:
-        data = request.get_json()
-        record_id = data.get('id')
-        next_id = data.get('next_id')
-        reporttime = data.get('reporttime')
-        next_reporttime = data.get('next_reporttime')
-        mobileid = data.get('mobileid')
-        opr_nrp = data.get('opr_nrp')
-        hm = data.get('hm')
-        next_hm = data.get('next_hm')
-        opr_shift = data.get('opr_shift')
-        new_shift = data.get('new_shift', '').strip()
-        
-        if not record_id:
-            return jsonify({'success': False, 'message': 'Missing ID'}), 400
-        
-        if not new_shift:
-            return jsonify({'success': False, 'message': 'Missing shift value'}), 400
-        
-        valid_shifts = ['6', '7', '1', '2', '3']
-        if new_shift not in valid_shifts:
-            return jsonify({'success': False, 'message': 'Invalid shift value'}), 400
-        
-        # Convert datetime strings to datetime objects if they exist
-        # Original datetime values come as ISO strings from step3 endpoint
-        reporttime_dt = None
-        if reporttime:
-            try:
-                if isinstance(reporttime, str):
-                    # Handle ISO format strings from step3
-                    if 'T' in reporttime:
-                        reporttime_dt = datetime.strptime(reporttime.split('.')[0], '%Y-%m-%dT%H:%M:%S')
-                    else:
-                        reporttime_dt = datetime.strptime(reporttime, '%Y-%m-%d %H:%M:%S')
-                else:
-                    reporttime_dt = reporttime
-            except Exception:
-                reporttime_dt = None
-        
-        next_reporttime_dt = None
-        if next_reporttime:
-            try:
-                if isinstance(next_reporttime, str):
-                    # Handle ISO format strings from step3
-                    if 'T' in next_reporttime:
-                        next_reporttime_dt = datetime.strptime(next_reporttime.split('.')[0], '%Y-%m-%dT%H:%M:%S')
-                    else:
-                        next_reporttime_dt = datetime.strptime(next_reporttime, '%Y-%m-%d %H:%M:%S')
-                else:
-                    next_reporttime_dt = next_reporttime
-            except Exception:
-                next_reporttime_dt = None
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        EXECUTE dbo.miosphere_dtv_update_shift
-            @id = ?,
-            @next_id = ?,
-            @reporttime = ?,
-            @next_reporttime = ?,
-            @mobileid = ?,
-            @opr_nrp = ?,
-            @hm = ?,
-            @next_hm = ?,
-            @opr_shift = ?,
-            @new_shift = ?
-        """
-        cursor.execute(query, (
-            record_id,
-            next_id,
-            reporttime_dt,
-            next_reporttime_dt,
-            mobileid,
-            opr_nrp,
-            hm,
-            next_hm,
-            opr_shift,
-            new_shift
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'update_shift',
+                            data['id'],
+                            data['next_id'],
+                            data['reporttime'],
+                            data['next_reporttime'],
+                            data['mobileid'],
+                            data['opr_nrp'],
+                            data['hm'],
+                            data['next_hm'],
+                            data['opr_shift'],
+                            data['new_shift'])
+            conn.commit()
+        invalidate_reads()
         
         return jsonify({'success': True, 'message': 'Shift updated successfully'})
     except Exception as e:
-        print(f"Error updating shift: {e}")
+        logger.error("Error updating shift: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -615,60 +677,27 @@ def update_hm():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    data = decode_request(schemas.UPDATE_HM)
+    
     try:
-        data = request.get_json()
-        record_id = data.get('id')
-        opr_nrp = data.get('opr_nrp')
-        hm = data.get('hm')
-        new_hm = data.get('new_hm')
-        opr_shift = data.get('opr_shift')
-        
-        if not record_id:
-            return jsonify({'success': False, 'message': 'Missing ID'}), 400
-        
-        if not opr_nrp:
-            return jsonify({'success': False, 'message': 'Missing opr_nrp'}), 400
-        
-        if new_hm is None:
-            return jsonify({'success': False, 'message': 'Missing new_hm value'}), 400
-        
-        try:
-            new_hm = float(new_hm)
-        except (ValueError, TypeError):
-            return jsonify({'success': False, 'message': 'Invalid HM value'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        EXEC dbo.miosphere_dtv_insert_login_update
-            @id = ?,
-            @b_nrp = ?,
-            @a_nrp = ?,
-            @b_hm = ?,
-            @a_hm = ?,
-            @b_shift = ?,
-            @a_shift = ?,
-            @remark = 'hm_update',
-            @updated_by = 'dispatcher'
-        """
-        cursor.execute(query, (
-            record_id,
-            opr_nrp,
-            opr_nrp,
-            hm,
-            new_hm,
-            opr_shift,
-            opr_shift
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'login_update',
+                            data['id'],
+                            data['opr_nrp'],
+                            data['opr_nrp'],
+                            data['hm'],
+                            data['new_hm'],
+                            data['opr_shift'],
+                            data['opr_shift'],
+                            'hm_update',
+                            'dispatcher')
+            conn.commit()
+        invalidate_reads()
+        correct_stored_hm(data['id'], data['new_hm'])
         
         return jsonify({'success': True, 'message': 'HM Login updated successfully'})
     except Exception as e:
-        print(f"Error updating HM Login: {e}")
+        logger.error("Error updating HM Login: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -677,60 +706,27 @@ def validate_data():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    data = decode_request(schemas.UPDATE_HM)
+    
     try:
-        data = request.get_json()
-        record_id = data.get('id')
-        opr_nrp = data.get('opr_nrp')
-        hm = data.get('hm')
-        new_hm = data.get('new_hm')
-        opr_shift = data.get('opr_shift')
-        
-        if not record_id:
-            return jsonify({'success': False, 'message': 'Missing ID'}), 400
-        
-        if not opr_nrp:
-            return jsonify({'success': False, 'message': 'Missing opr_nrp'}), 400
-        
-        if new_hm is None:
-            return jsonify({'success': False, 'message': 'Missing new_hm value'}), 400
-        
-        try:
-            new_hm = float(new_hm)
-        except (ValueError, TypeError):
-            return jsonify({'success': False, 'message': 'Invalid HM value'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        EXEC dbo.miosphere_dtv_insert_login_update
-            @id = ?,
-            @b_nrp = ?,
-            @a_nrp = ?,
-            @b_hm = ?,
-            @a_hm = ?,
-            @b_shift = ?,
-            @a_shift = ?,
-            @remark = 'valid',
-            @updated_by = 'dispatcher'
-        """
-        cursor.execute(query, (
-            record_id,
-            opr_nrp,
-            opr_nrp,
-            hm,
-            new_hm,
-            opr_shift,
-            opr_shift
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'login_update',
+                            data['id'],
+                            data['opr_nrp'],
+                            data['opr_nrp'],
+                            data['hm'],
+                            data['new_hm'],
+                            data['opr_shift'],
+                            data['opr_shift'],
+                            'valid',
+                            'dispatcher')
+            conn.commit()
+        invalidate_reads()
+        correct_stored_hm(data['id'], data['new_hm'])
         
         return jsonify({'success': True, 'message': 'Data validated successfully'})
     except Exception as e:
-        print(f"Error validating data: {e}")
+        logger.error("Error validating data: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -739,60 +735,27 @@ def update_next_hm():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    data = decode_request(schemas.UPDATE_NEXT_HM)
+    
     try:
-        data = request.get_json()
-        next_id = data.get('next_id')
-        opr_nrp = data.get('opr_nrp')
-        next_hm = data.get('next_hm')
-        new_hm = data.get('new_hm')
-        opr_shift = data.get('opr_shift')
-        
-        if not next_id:
-            return jsonify({'success': False, 'message': 'Missing next_id'}), 400
-        
-        if not opr_nrp:
-            return jsonify({'success': False, 'message': 'Missing opr_nrp'}), 400
-        
-        if new_hm is None:
-            return jsonify({'success': False, 'message': 'Missing new_hm value'}), 400
-        
-        try:
-            new_hm = float(new_hm)
-        except (ValueError, TypeError):
-            return jsonify({'success': False, 'message': 'Invalid HM value'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        EXEC dbo.miosphere_dtv_insert_login_update
-            @id = ?,
-            @b_nrp = ?,
-            @a_nrp = ?,
-            @b_hm = ?,
-            @a_hm = ?,
-            @b_shift = ?,
-            @a_shift = ?,
-            @remark = 'next_hm_update',
-            @updated_by = 'dispatcher'
-        """
-        cursor.execute(query, (
-            next_id,
-            opr_nrp,
-            opr_nrp,
-            next_hm,
-            new_hm,
-            opr_shift,
-            opr_shift
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'login_update',
+                            data['next_id'],
+                            data['opr_nrp'],
+                            data['opr_nrp'],
+                            data['next_hm'],
+                            data['new_hm'],
+                            data['opr_shift'],
+                            data['opr_shift'],
+                            'next_hm_update',
+                            'dispatcher')
+            conn.commit()
+        invalidate_reads()
+        correct_stored_hm(data['next_id'], data['new_hm'])
         
         return jsonify({'success': True, 'message': 'HM Logout updated successfully'})
     except Exception as e:
-        print(f"Error updating HM Logout: {e}")
+        logger.error("Error updating HM Logout: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -801,63 +764,74 @@ def update_prev_hm():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
+    data = decode_request(schemas.UPDATE_PREV_HM)
+    
     try:
-        data = request.get_json()
-        prev_id = data.get('prev_id')
-        opr_nrp = data.get('opr_nrp')
-        prev_hm = data.get('prev_hm')
-        new_hm = data.get('new_hm')
-        opr_shift = data.get('opr_shift')
-        
-        if not prev_id:
-            return jsonify({'success': False, 'message': 'Missing prev_id'}), 400
-        
-        if not opr_nrp:
-            return jsonify({'success': False, 'message': 'Missing opr_nrp'}), 400
-        
-        if new_hm is None:
-            return jsonify({'success': False, 'message': 'Missing new_hm value'}), 400
-        
-        try:
-            new_hm = float(new_hm)
-        except (ValueError, TypeError):
-            return jsonify({'success': False, 'message': 'Invalid HM value'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        EXEC dbo.miosphere_dtv_insert_login_update
-            @id = ?,
-            @b_nrp = ?,
-            @a_nrp = ?,
-            @b_hm = ?,
-            @a_hm = ?,
-            @b_shift = ?,
-            @a_shift = ?,
-            @remark = 'prev_hm_update',
-            @updated_by = 'dispatcher'
-        """
-        cursor.execute(query, (
-            prev_id,
-            opr_nrp,
-            opr_nrp,
-            prev_hm,
-            new_hm,
-            opr_shift,
-            opr_shift
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with closing(get_db_connection()) as conn:
+            statements.call(conn, 'login_update',
+                            data['prev_id'],
+                            data['opr_nrp'],
+                            data['opr_nrp'],
+                            data['prev_hm'],
+                            data['new_hm'],
+                            data['opr_shift'],
+                            data['opr_shift'],
+                            'prev_hm_update',
+                            'dispatcher')
+            conn.commit()
+        invalidate_reads()
+        correct_stored_hm(data['prev_id'], data['new_hm'])
         
         return jsonify({'success': True, 'message': 'Previous HM updated successfully'})
     except Exception as e:
-        print(f"Error updating previous HM: {e}")
+        logger.error("Error updating previous HM: %s", e, exc_info=True)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+def parse_optional_datetime(name: str):
+    value = request.args.get(name, '').strip()
+    return schemas.parse_datetime(value) if value else None
+
+
+@app.route('/api/timesheet/hm-history', methods=['GET'])
+def hm_history():
+    """Serve HM readings of a unit from the local HM store."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    if hm_stores is None:
+        return jsonify({'success': False, 'message': 'HM store is disabled'}), 404
+
+    mobileid = request.args.get('mobileid', '').strip()
+    if not mobileid:
+        return jsonify({'success': False, 'message': 'Missing mobileid'}), 400
+    try:
+        start, end = parse_optional_datetime('start'), parse_optional_datetime('end')
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({'success': False, 'message': 'limit must be a positive number'}), 400
+
+    # The request was routed to the site of this unit
+    hm_store = hm_stores.store(current_site())
+    view = request.args.get('view', 'range')
+    if view == 'latest':
+        return jsonify({'success': True, 'row': hm_store.latest(mobileid, request.args.get('status', 'login'))})
+    if view == 'trend':
+        return jsonify({'success': True, 'days': hm_store.trend(mobileid, start, end)})
+    return jsonify({'success': True, 'rows': hm_store.range(mobileid, start, end, limit)})
+
+
+@app.route('/api/timesheet/prefetch-stats', methods=['GET'])
+def timesheet_prefetch_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    return jsonify({'success': True, 'stats': prefetcher.stats(),
+                    'shared_cache': read_cache.stats() if read_cache is not None else None,
+                    'db_sites': get_sites().stats(),
+                    'statements': statements.stats()})
+
+
 @app.route('/api/timesheet/clear', methods=['POST'])
 def timesheet_clear():
     if 'user_id' not in session:
@@ -0,0 +1,219 @@
+"""
+Circuit breakers for the SQL Server connections, one per site.
+Tracks the outcome and latency of recent database calls. When too many of them
+fail or are too slow the circuit opens and new calls fail at once instead of
+waiting for ODBC timeouts; after a cool-down a few probe calls are let through
+(half-open) and their outcome decides whether the circuit closes again. Only
+the first outcome reported in the context that was let through as the probe
+counts: statements that were already running when the circuit opened report
+late, and must not close it.
+Each statement is one call: fetches and nextset() only count when they fail, so
+they do not dilute the failure and slow rates of the statements themselves.
+"""
+import collections
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import pyodbc
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# The breaker and token of the probe let through in this context, until it reports
+_admitted_probe: contextvars.ContextVar[Optional[Tuple['CircuitBreaker', int]]] = \
+    contextvars.ContextVar('admitted_probe', default=None)
+_probe_tokens = itertools.count(1)
+
+
+class CircuitOpenError(pyodbc.Error):
+    """Raised instead of calling the database while the circuit is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'Database circuit is open; retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+def is_outage(error: BaseException) -> bool:
+    """Errors that say the server is unreachable or overloaded, not that the SQL is wrong."""
+    return isinstance(error, (pyodbc.OperationalError, pyodbc.InterfaceError)) and \
+        not isinstance(error, CircuitOpenError)
+
+
+def db_unavailable(error: BaseException) -> bool:
+    """True if a call failed because the database is down or the circuit is open."""
+    return isinstance(error, CircuitOpenError) or is_outage(error)
+
+
+class CircuitBreaker:
+    """Failure-rate and latency circuit breaker with half-open probing."""
+
+    def __init__(self, failure_rate: float = 0.5, slow_rate: float = 0.8, slow_ms: float = 10000.0,
+                 min_calls: int = 5, window_seconds: float = 30.0, open_seconds: float = 15.0,
+                 half_open_probes: int = 1, enabled: bool = True, site: str = 'default'):
+        self.site = site
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls = collections.deque()  # (finished at, failed, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+        self._live_probes = set()
+        self._stats = collections.Counter()
+
+    @classmethod
+    def from_env(cls, site: str = 'default') -> 'CircuitBreaker':
+        return cls(
+            site=site,
+            failure_rate=float(os.getenv('DB_BREAKER_FAILURE_RATE', '0.5')),
+            slow_rate=float(os.getenv('DB_BREAKER_SLOW_RATE', '0.8')),
+            slow_ms=float(os.getenv('DB_BREAKER_SLOW_MS', '10000')),
+            min_calls=int(os.getenv('DB_BREAKER_MIN_CALLS', '5')),
+            window_seconds=float(os.getenv('DB_BREAKER_WINDOW_SECONDS', '30')),
+            open_seconds=float(os.getenv('DB_BREAKER_OPEN_SECONDS', '15')),
+            half_open_probes=int(os.getenv('DB_BREAKER_HALF_OPEN_PROBES', '1')),
+            enabled=os.getenv('DB_BREAKER_ENABLED', 'yes').lower() == 'yes',
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        now = time.monotonic()
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._live_probes.clear()
+            logger.info("Database circuit for site %s half-open, probing", self.site)
+        elif self._state == HALF_OPEN and self._probes and now - self._probe_started >= self.slow_ms / 1000:
+            # A probe that never reported back would count as slow anyway; let another one through
+            self._probes = 0
+            self._live_probes.clear()
+            self._stats['probes_expired'] += 1
+
+    def _open(self, reason: str) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self._live_probes.clear()
+        self._stats['opened'] += 1
+        logger.error("Database circuit for site %s opened: %s", self.site, reason)
+
+    def before_call(self) -> Optional[int]:
+        """
+        Raise CircuitOpenError if the call must not reach the database. A call
+        let through as a half-open probe gets a token, returned and remembered in
+        the current context for the record() that reports its outcome.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return None
+            if self._state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                self._probe_started = time.monotonic()
+                token = next(_probe_tokens)
+                self._live_probes.add(token)
+                _admitted_probe.set((self, token))
+                return token
+            self._stats['rejected'] += 1
+            retry_after = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(retry_after)
+
+    def cancel_call(self) -> None:
+        """Give back the probe slot of a call that failed before it reached the database."""
+        if not self.enabled:
+            return
+        token = self._take_probe()
+        with self._lock:
+            if token in self._live_probes:
+                self._live_probes.discard(token)
+                self._probes -= 1
+
+    def _take_probe(self) -> Optional[int]:
+        """Forget and return the token of this breaker's probe admitted in the current context."""
+        admitted = _admitted_probe.get()
+        if admitted is None or admitted[0] is not self:
+            return None
+        _admitted_probe.set(None)
+        return admitted[1]
+
+    def record(self, duration_ms: float, error: Optional[BaseException] = None) -> None:
+        """
+        Report the outcome of a database call let through by before_call().
+        While half-open only the outcome of the probe admitted in this context counts.
+        """
+        if not self.enabled:
+            return
+        failed = error is not None and is_outage(error)
+        slow = duration_ms >= self.slow_ms
+        now = time.monotonic()
+        token = self._take_probe()
+        with self._lock:
+            self._stats['failed' if failed else 'ok'] += 1
+            if slow:
+                self._stats['slow'] += 1
+            if self._state == HALF_OPEN:
+                if token not in self._live_probes:
+                    # Started before the circuit opened, or a probe that already expired
+                    self._stats['ignored_half_open'] += 1
+                    return
+                self._live_probes.discard(token)
+                if failed or slow:
+                    self._open('probe failed' if failed else f'probe took {duration_ms:.0f} ms')
+                else:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    logger.info("Database circuit for site %s closed", self.site)
+                return
+            if self._state == OPEN:
+                return
+            self._calls.append((now, failed, slow))
+            while self._calls and self._calls[0][0] < now - self.window_seconds:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for c in self._calls if c[1])
+            slow_calls = sum(1 for c in self._calls if c[2])
+            if failures / total >= self.failure_rate:
+                self._open(f'{failures}/{total} calls failed in {self.window_seconds:.0f}s')
+            elif slow_calls / total >= self.slow_rate:
+                self._open(f'{slow_calls}/{total} calls slower than {self.slow_ms:.0f} ms')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._maybe_half_open()
+            return dict(self._stats, state=self._state, window_calls=len(self._calls))
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breaker_lock = threading.Lock()
+
+
+def get_breaker(site: str = 'default') -> CircuitBreaker:
+    """Return the breaker for a site's server, configured from DB_BREAKER_* on first use."""
+    with _breaker_lock:
+        breaker = _breakers.get(site)
+        if breaker is None:
+            breaker = _breakers[site] = CircuitBreaker.from_env(site)
+    return breaker
@@ -1,60 +1,520 @@
 """
 Database configuration and connection utilities for SQL Server.
-This module handles all database connections and provides connection pooling.
+This module handles all database connections, routes them to the right mine
+site's server and keeps a connection pool per site.
 """
+import collections
+import contextvars
+import logging
+import threading
+import time
 import pyodbc
-from typing import Optional
+from typing import Dict, Optional, Sequence
 import os
+import re
+from config.circuit_breaker import get_breaker, is_outage
+from config.db_replay import RecordingConnection, ReplayConnection, get_recorder, get_replay_store
+from config.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+# Per-request accumulator of time spent in the database, set by the request logging hooks
+_db_timing = contextvars.ContextVar('db_timing', default=None)
+
+# The only site of a deployment without DB_SITES
+DEFAULT_SITE = 'default'
+
+
+def start_db_timing() -> dict:
+    """Start accumulating database time for the current request/context."""
+    timing = {'calls': 0, 'ms': 0.0, 'connect_ms': 0.0}
+    _db_timing.set(timing)
+    return timing
+
+
+def stop_db_timing() -> None:
+    """Stop accumulating database time in the current context."""
+    _db_timing.set(None)
+
+
+def get_db_timing() -> Optional[dict]:
+    """Return the database time accumulated in the current context, if any."""
+    return _db_timing.get()
+
+
+def _record_db_time(started: float, key: str = 'ms') -> None:
+    timing = _db_timing.get()
+    if timing is not None:
+        timing[key] += (time.perf_counter() - started) * 1000
+        if key == 'ms':
+            timing['calls'] += 1
+
+
+class TimedCursor:
+    """pyodbc cursor wrapper that adds the time spent in each call to the request's DB timing."""
+
+    _TIMED = frozenset(('execute', 'executemany', 'fetchone', 'fetchall', 'fetchmany', 'nextset'))
+
+    def __init__(self, cursor, breaker=None):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_breaker', breaker or get_breaker())
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name not in self._TIMED:
+            return attr
+
+        def timed(*args, **kwargs):
+            attrs = {'sql': ' '.join(str(args[0]).split())[:200]} if args and name.startswith('exec') else {}
+            with span('db.' + name, **attrs) as current:
+                started = time.perf_counter()
+                error = None
+                try:
+                    result = attr(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _record_db_time(started)
+                    # One breaker outcome per statement; a fetch only adds one when the server fails
+                    if name.startswith('exec') or (error is not None and is_outage(error)):
+                        self._breaker.record((time.perf_counter() - started) * 1000, error)
+                if current is not None and isinstance(result, list):
+                    current.set(rows=len(result))
+            # execute() returns the raw cursor; keep callers on the wrapper
+            return self if result is self._cursor else result
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class TimedConnection:
+    """pyodbc connection wrapper whose cursors report their time to the request's DB timing."""
+
+    def __init__(self, conn, breaker=None):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_breaker', breaker or get_breaker())
+        # Cursors of registered statements prepared on this connection (see config.statements)
+        object.__setattr__(self, 'statements', {})
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor(), self._breaker)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+def _site_setting(site: str, name: str, default: Optional[str] = None) -> Optional[str]:
+    """DB_SITE_<SITE>_<NAME> if it is set, else the deployment-wide DB_<NAME>."""
+    value = os.getenv(f"DB_SITE_{re.sub(r'[^A-Z0-9]', '_', site.upper())}_{name}")
+    return value if value is not None else os.getenv(f'DB_{name}', default)
 
 
 class DatabaseConfig:
     """Database configuration class for SQL Server connections."""
     
-    def __init__(self):
+    def __init__(self, site: str = DEFAULT_SITE):
         # Read configuration only from environment variables to avoid
-        # hard-coded defaults and accidental secret leakage.
-        self.server = os.getenv('DB_SERVER')
-        self.database = os.getenv('DB_NAME')
-        self.username = os.getenv('DB_USER')
-        self.password = os.getenv('DB_PASSWORD')
-        self.driver = os.getenv('DB_DRIVER')
+        # hard-coded defaults and accidental secret leakage. Each setting can be
+        # overridden per site as DB_SITE_<SITE>_SERVER, DB_SITE_<SITE>_NAME, ...
+        self.site = site
+        self.dsn = _site_setting(site, 'DSN')
+        self.server = _site_setting(site, 'SERVER')
+        self.database = _site_setting(site, 'NAME')
+        self.username = _site_setting(site, 'USER')
+        self.password = _site_setting(site, 'PASSWORD')
+        self.driver = _site_setting(site, 'DRIVER')
         # DB_TRUSTED_CONNECTION may be unset; treat only explicit 'yes' (case-insensitive) as True
-        trusted = os.getenv('DB_TRUSTED_CONNECTION')
+        trusted = _site_setting(site, 'TRUSTED_CONNECTION')
         self.trusted_connection = True if trusted and trusted.lower() == 'yes' else False
     
     def get_connection_string(self) -> str:
         """Generate connection string for SQL Server."""
+        # A named ODBC data source carries the driver and server itself
+        target = f"DSN={self.dsn};" if self.dsn else f"DRIVER={self.driver};SERVER={self.server};"
+        if self.database:
+            target += f"DATABASE={self.database};"
         if self.trusted_connection:
-            return (
-                f"DRIVER={self.driver};"
-                f"SERVER={self.server};"
-                f"DATABASE={self.database};"
-                f"Trusted_Connection=yes;"
-            )
-        else:
-            return (
-                f"DRIVER={self.driver};"
-                f"SERVER={self.server};"
-                f"DATABASE={self.database};"
-                f"UID={self.username};"
-                f"PWD={self.password};"
-            )
+            return target + "Trusted_Connection=yes;"
+        return target + f"UID={self.username};PWD={self.password};"
 
 
-def get_db_connection():
-    """Get a database connection using the configuration."""
-    config = DatabaseConfig()
-    try:
-        conn = pyodbc.connect(config.get_connection_string())
+class PooledConnection:
+    """A connection on loan from the pool; close() hands it back instead of closing it."""
+
+    def __init__(self, pool: 'ConnectionPool', conn: TimedConnection):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_returned', False)
+
+    def close(self):
+        if not self._returned:
+            object.__setattr__(self, '_returned', True)
+            self._pool.release(self._conn)
+
+    def discard(self):
+        """Close the connection for good instead of returning it, e.g. after it failed mid-call."""
+        if not self._returned:
+            object.__setattr__(self, '_returned', True)
+            self._pool.release(self._conn, keep=False)
+
+    def __del__(self):
+        # A borrower that never called close() must not hold one of the site's slots forever
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+class PoolTimeout(pyodbc.OperationalError):
+    """Raised when every connection a site may open is in use for longer than the pool's wait."""
+
+    def __init__(self, site: str, waited: float):
+        super().__init__(f'No connection to site {site} free within {waited:.0f}s')
+        self.site = site
+
+
+class ConnectionPool:
+    """
+    Idle connections kept open between requests, most recently used first, so
+    that the statements prepared on them can be reused. At most max_idle are
+    kept when they are handed back. If max_connections is set, no more than
+    that many are open or on loan at once: further borrowers wait up to
+    wait_seconds and then get PoolTimeout, so one slow site uses up only its
+    own connections and worker threads stop queueing on it.
+    """
+
+    def __init__(self, connect, max_idle: int = 8, max_idle_seconds: float = 300.0,
+                 max_connections: int = 0, wait_seconds: float = 5.0, site: str = DEFAULT_SITE):
+        self._connect = connect
+        self.max_idle = max_idle
+        self.max_idle_seconds = max_idle_seconds
+        self.max_connections = max_connections
+        self.wait_seconds = wait_seconds
+        self.site = site
+        self._lock = threading.Lock()
+        self._idle = collections.deque()  # (connection, returned at)
+        self._slots = threading.BoundedSemaphore(max_connections) if max_connections > 0 else None
+        self._in_use = 0
+        self._pid = os.getpid()
+        self._stats = collections.Counter()
+
+    @classmethod
+    def from_env(cls, connect, site: str = DEFAULT_SITE) -> 'ConnectionPool':
+        return cls(connect,
+                   max_idle=max(0, int(_site_setting(site, 'POOL_SIZE', '0'))),
+                   max_idle_seconds=float(_site_setting(site, 'POOL_MAX_IDLE_SECONDS', '300')),
+                   max_connections=int(_site_setting(site, 'POOL_MAX_CONNECTIONS', '0')),
+                   wait_seconds=float(_site_setting(site, 'POOL_WAIT_SECONDS', '5')),
+                   site=site)
+
+    def _check_fork(self) -> None:
+        # Connections opened before a fork belong to the parent process. Called with the lock held.
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._in_use = 0
+            if self._slots is not None:
+                self._slots = threading.BoundedSemaphore(self.max_connections)
+            self._pid = os.getpid()
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            self._check_fork()
+            slots = self._slots
+        if slots is not None:
+            with span('db.pool_wait', site=self.site) as s:
+                started = time.perf_counter()
+                acquired = slots.acquire(blocking=False)
+                waited = not acquired
+                if waited:
+                    acquired = slots.acquire(timeout=self.wait_seconds)
+                if s is not None:
+                    s.set(acquired=acquired, waited=waited)
+            if waited:
+                wait_ms = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    self._stats['waits'] += 1
+                    self._stats['wait_ms'] += wait_ms
+                    self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+                    if not acquired:
+                        self._stats['timeouts'] += 1
+            if not acquired:
+                raise PoolTimeout(self.site, self.wait_seconds)
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = self._connect()
+                with self._lock:
+                    self._stats['opened'] += 1
+        except BaseException:
+            if slots is not None:
+                slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return PooledConnection(self, conn)
+
+    def _take_idle(self) -> Optional[TimedConnection]:
+        expired = []
+        conn = None
+        with self._lock:
+            now = time.monotonic()
+            while self._idle:
+                candidate, returned_at = self._idle.pop()
+                if now - returned_at > self.max_idle_seconds:
+                    expired.append(candidate)
+                    continue
+                conn = candidate
+                self._stats['reused'] += 1
+                break
+        for old in expired:
+            self._close(old, 'expired')
         return conn
+
+    def release(self, conn: TimedConnection, keep: bool = True) -> None:
+        """Take back a loaned connection; keep=False closes it instead of keeping it idle."""
+        with self._lock:
+            same_process = self._pid == os.getpid()
+            slots = self._slots
+            if same_process:
+                self._in_use -= 1
+        try:
+            if keep:
+                self._keep_or_close(conn, same_process)
+            else:
+                self._close(conn, 'discarded')
+        finally:
+            if same_process and slots is not None:
+                slots.release()
+
+    def _keep_or_close(self, conn: TimedConnection, same_process: bool) -> None:
+        try:
+            # Never hand an open transaction to the next borrower
+            conn.rollback()
+        except pyodbc.Error:
+            self._close(conn, 'broken')
+            return
+        with self._lock:
+            if same_process and len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+        self._close(conn, 'surplus')
+
+    def _close(self, conn: TimedConnection, reason: str) -> None:
+        with self._lock:
+            self._stats['closed_' + reason] += 1
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    def clear(self) -> None:
+        with self._lock:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._close(conn, 'cleared')
+
+    def stats(self) -> dict:
+        """Pool counters; waits, wait_ms and max_wait_ms cover borrowers that found every slot taken."""
+        with self._lock:
+            stats = dict(self._stats, idle=len(self._idle), in_use=self._in_use, max_idle=self.max_idle,
+                         max_connections=self.max_connections or None)
+        for key in ('wait_ms', 'max_wait_ms'):
+            if key in stats:
+                stats[key] = round(stats[key], 1)
+        return stats
+
+
+class Site:
+    """One mine site's SQL Server: its settings, connection pool and circuit breaker."""
+
+    def __init__(self, name: str, mobileid_prefixes: Sequence[str] = ()):
+        self.name = name
+        self.config = DatabaseConfig(name)
+        self.mobileid_prefixes = [p.upper() for p in mobileid_prefixes]
+        self.breaker = get_breaker(name)
+        self.pool = ConnectionPool.from_env(lambda: open_connection(name), name)
+
+    @classmethod
+    def from_env(cls, name: str) -> 'Site':
+        prefixes = _site_setting(name, 'MOBILEID_PREFIXES', '') if name != DEFAULT_SITE else ''
+        return cls(name, [p.strip() for p in prefixes.split(',') if p.strip()])
+
+    def stats(self) -> dict:
+        return {'server': self.config.dsn or self.config.server, 'database': self.config.database,
+                'pool': self.pool.stats(), 'breaker': self.breaker.stats()}
+
+
+class SiteRegistry:
+    """
+    The sites this deployment serves, from DB_SITES (e.g. `north,south`). A
+    request goes to the site whose MOBILEID prefix rule matches the unit it is
+    about, else to the user's own site, else to DB_DEFAULT_SITE. Without
+    DB_SITES there is one site, `default`, configured by the plain DB_* settings.
+    """
+
+    def __init__(self, sites: Sequence[Site], default: str, users_site: str):
+        self.sites: Dict[str, Site] = {site.name: site for site in sites}
+        if default not in self.sites or users_site not in self.sites:
+            raise ValueError(f'DB_DEFAULT_SITE and DB_USERS_SITE must be one of {", ".join(self.sites)}')
+        self.default = default
+        self.users_site = users_site
+        # Longest prefix first so that DT1 beats DT for DT101
+        self._rules = sorted(((prefix, site.name) for site in sites for prefix in site.mobileid_prefixes),
+                             key=lambda rule: len(rule[0]), reverse=True)
+        self._unknown_logged = set()
+
+    @classmethod
+    def from_env(cls) -> 'SiteRegistry':
+        names = [name.strip().lower() for name in os.getenv('DB_SITES', '').split(',') if name.strip()]
+        if not names:
+            return cls([Site.from_env(DEFAULT_SITE)], DEFAULT_SITE, DEFAULT_SITE)
+        default = os.getenv('DB_DEFAULT_SITE', names[0]).strip().lower()
+        users_site = os.getenv('DB_USERS_SITE', default).strip().lower()
+        return cls([Site.from_env(name) for name in names], default, users_site)
+
+    @property
+    def multi_site(self) -> bool:
+        return len(self.sites) > 1
+
+    def site_for_mobileid(self, mobileid) -> Optional[str]:
+        """The site whose MOBILEID prefix rule matches, if any."""
+        if not mobileid:
+            return None
+        mobileid = str(mobileid).strip().upper()
+        for prefix, name in self._rules:
+            if mobileid.startswith(prefix):
+                return name
+        return None
+
+    def route(self, *mobileids, user_site: Optional[str] = None) -> str:
+        """Pick the site for a request about the given units (first match wins) made by a user of user_site."""
+        for mobileid in mobileids:
+            name = self.site_for_mobileid(mobileid)
+            if name:
+                return name
+        if user_site:
+            name = user_site.strip().lower()
+            if name in self.sites:
+                return name
+            if name not in self._unknown_logged:
+                self._unknown_logged.add(name)
+                logger.warning("Users of unknown site %r are routed to %s", user_site, self.default)
+        return self.default
+
+    def get(self, name: Optional[str] = None) -> Site:
+        return self.sites[name or self.default]
+
+    def stats(self) -> dict:
+        return {name: site.stats() for name, site in self.sites.items()}
+
+
+_sites: Optional[SiteRegistry] = None
+_sites_lock = threading.Lock()
+
+# The site the current request's database calls go to; set by the app's routing hook
+_current_site = contextvars.ContextVar('db_site', default=None)
+
+
+def get_sites() -> SiteRegistry:
+    """Return the process-wide site registry, configured from the environment on first use."""
+    global _sites
+    with _sites_lock:
+        if _sites is None:
+            _sites = SiteRegistry.from_env()
+    return _sites
+
+
+def use_site(name: Optional[str]) -> contextvars.Token:
+    """Send database calls in the current context to the named site (None: the default site)."""
+    if name is not None and name not in get_sites().sites:
+        raise KeyError(f'Unknown database site {name!r}')
+    return _current_site.set(name)
+
+
+def current_site() -> str:
+    """The site database calls in the current context go to."""
+    return _current_site.get() or get_sites().default
+
+
+def site_context() -> contextvars.Context:
+    """
+    A fresh context that carries only the current site, for background work
+    started by a request: it must not add to that request's trace or DB timing.
+    """
+    context = contextvars.Context()
+    context.run(_current_site.set, _current_site.get())
+    return context
+
+
+def get_pool(site: Optional[str] = None) -> ConnectionPool:
+    """Return the connection pool of a site, by default the current one."""
+    return get_sites().get(site or current_site()).pool
+
+
+def get_db_connection(site: Optional[str] = None):
+    """Get a pooled connection to a site's database, by default the current one. close() returns it."""
+    replay_store = get_replay_store()
+    if replay_store is not None:
+        return TimedConnection(ReplayConnection(replay_store))
+    site = get_sites().get(site or current_site())
+    # Fail fast while the server is known to be down instead of waiting for the login timeout
+    site.breaker.before_call()
+    try:
+        return site.pool.acquire()
+    except BaseException:
+        # A pool timeout never reaches the server; do not let it hold the half-open probe
+        site.breaker.cancel_call()
+        raise
+
+
+def get_users_connection():
+    """Get a connection to the database holding miosphere_users (DB_USERS_SITE)."""
+    return get_db_connection(get_sites().users_site)
+
+
+def open_connection(site: Optional[str] = None) -> TimedConnection:
+    """Open a new connection to a site's SQL Server, by default the current site's."""
+    site = get_sites().get(site or current_site())
+    breaker = site.breaker
+    config = site.config
+    started = time.perf_counter()
+    try:
+        with span('db.connect', site=site.name, server=config.dsn or config.server, database=config.database):
+            conn = pyodbc.connect(config.get_connection_string(),
+                                  timeout=int(os.getenv('DB_LOGIN_TIMEOUT', '10')))
+        breaker.record((time.perf_counter() - started) * 1000)
+        recorder = get_recorder()
+        if recorder is not None:
+            conn = RecordingConnection(conn, recorder)
+        return TimedConnection(conn, breaker)
     except pyodbc.Error as e:
-        print(f"Database connection error: {e}")
+        # Any connect failure means the server is unreachable, whatever its error class
+        breaker.record((time.perf_counter() - started) * 1000, pyodbc.OperationalError(*e.args))
+        logger.error("Database connection error (site %s): %s", site.name, e)
         raise
+    finally:
+        _record_db_time(started, 'connect_ms')
 
 
 def init_database():
     """Initialize database with required tables if they don't exist."""
-    conn = get_db_connection()
+    conn = get_users_connection()
     cursor = conn.cursor()
     
     try:
@@ -71,9 +531,16 @@ def init_database():
             )
         """)
         conn.commit()
-        print("Database initialized successfully")
+        if get_sites().multi_site:
+            # Users are routed to the database of their own site
+            cursor.execute("""
+                IF COL_LENGTH('miosphere_users', 'site') IS NULL
+                ALTER TABLE miosphere_users ADD site NVARCHAR(50) NULL
+            """)
+            conn.commit()
+        logger.info("Database initialized successfully")
     except pyodbc.Error as e:
-        print(f"Error initializing database: {e}")
+        logger.error("Error initializing database: %s", e)
         conn.rollback()
     finally:
         cursor.close()
@@ -0,0 +1,537 @@
+"""
+Record and replay of database traffic.
+In recording mode every statement run through get_db_connection is written to a
+gzip JSON-lines file together with its parameters, result sets and timings, and
+the /api requests that issued them. Each worker process writes its own file
+(see recording_path); replay merges them. In replay mode the same file backs a fake
+pyodbc connection, so the app can be driven offline with the original latencies.
+"""
+import atexit
+import base64
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import weakref
+from datetime import date, datetime, time as dtime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import pyodbc
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REDACT_KEYS = (
+    'opr_nrp', 'b_nrp', 'a_nrp', 'operatorid', 'operator', 'opr_username', 'operatorname',
+    'username', 'fullname', 'password',
+)
+
+_PARAM_NAME = re.compile(r'@(\w+)\s*=\s*\?')
+_REDACTED = re.compile(r'^R[0-9a-f]{10}$')
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace so that the same statement always has the same text."""
+    return ' '.join(str(sql).split())
+
+
+def flatten_params(params: tuple) -> list:
+    """pyodbc accepts execute(sql, a, b) and execute(sql, (a, b)); normalize to a list."""
+    if len(params) == 1 and isinstance(params[0], (list, tuple)):
+        return list(params[0])
+    return list(params)
+
+
+def encode_value(value: Any) -> Any:
+    """Make a database value JSON-serializable without losing its Python type."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'$d': value.isoformat()}
+    if isinstance(value, dtime):
+        return {'$t': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'$dec': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$b': base64.b64encode(bytes(value)).decode('ascii')}
+    return str(value)
+
+
+def decode_value(value: Any) -> Any:
+    if not isinstance(value, dict):
+        return value
+    if '$dt' in value:
+        return datetime.fromisoformat(value['$dt'])
+    if '$d' in value:
+        return date.fromisoformat(value['$d'])
+    if '$t' in value:
+        return dtime.fromisoformat(value['$t'])
+    if '$dec' in value:
+        return Decimal(value['$dec'])
+    if '$b' in value:
+        return base64.b64decode(value['$b'])
+    return value
+
+
+class Redactor:
+    """Replace sensitive string values with stable tokens, keyed by column/parameter name.
+
+    Tokens are deterministic and redacting a token is a no-op, so a replayed request
+    carrying a token produces the same statement parameters as the recording.
+    """
+
+    def __init__(self, keys=DEFAULT_REDACT_KEYS, enabled: bool = True):
+        self.keys = frozenset(k.lower() for k in keys)
+        self.enabled = enabled
+
+    def token(self, value: Any) -> Any:
+        if not isinstance(value, str) or not value or _REDACTED.match(value):
+            return value
+        return 'R' + hashlib.sha1(value.encode('utf-8')).hexdigest()[:10]
+
+    def params(self, sql: str, params: list) -> list:
+        if not self.enabled:
+            return params
+        names = _PARAM_NAME.findall(sql)
+        if len(names) != len(params):
+            # Positional statement (e.g. SELECT ... WHERE username = ?): redact every string
+            return [self.token(p) for p in params]
+        return [self.token(p) if n.lower() in self.keys else p for n, p in zip(names, params)]
+
+    def row(self, columns: List[str], row: list) -> list:
+        if not self.enabled:
+            return row
+        return [self.token(v) if c.lower() in self.keys else v for c, v in zip(columns, row)] + row[len(columns):]
+
+    def mapping(self, data: Any) -> Any:
+        if not self.enabled or not isinstance(data, dict):
+            return data
+        return {k: self.token(v) if k.lower() in self.keys else v for k, v in data.items()}
+
+
+def recording_path(path: str, pid: Optional[int] = None) -> str:
+    """
+    The file one process records to: DB_RECORD_FILE with the pid before the .gz
+    suffix. Appending gzip members to one file from several processes would
+    interleave them and corrupt it.
+    """
+    base = path[:-3] if path.endswith('.gz') else path
+    return f'{base}.{os.getpid() if pid is None else pid}.gz'
+
+
+def recording_files(path: str) -> List[str]:
+    """The file at path if it exists, else every per-process file recorded for it."""
+    if os.path.isfile(path):
+        return [path]
+    base = path[:-3] if path.endswith('.gz') else path
+    return sorted(f for f in glob.glob(glob.escape(base) + '.*.gz')
+                  if f[len(base) + 1:-3].isdigit())
+
+
+class Recorder:
+    """Appends recorded entries to this process's gzip JSON-lines file from a background thread."""
+
+    def __init__(self, path: str, redactor: Redactor):
+        self.path = recording_path(path)
+        self.pid = os.getpid()
+        self.redactor = redactor
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._write, name='db-recorder', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, entry: Dict) -> None:
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning("DB recording queue full, dropping entry")
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _write(self) -> None:
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                if self._queue.empty():
+                    f.flush()
+
+
+class RecordingCursor:
+    """Cursor wrapper that records each statement, its result sets and timings."""
+
+    def __init__(self, cursor, recorder: Recorder):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_recorder', recorder)
+        object.__setattr__(self, '_call', None)
+
+    def _columns(self) -> Optional[List[str]]:
+        description = self._cursor.description
+        return [col[0] for col in description] if description else None
+
+    def _flush(self) -> None:
+        call = self._call
+        if call is not None:
+            object.__setattr__(self, '_call', None)
+            self._recorder.record(call)
+
+    def _start(self, sql: str, params: list, many: bool = False) -> None:
+        self._flush()
+        redactor = self._recorder.redactor
+        if many:
+            params = [[encode_value(v) for v in redactor.params(sql, list(p))] for p in params]
+        else:
+            params = [encode_value(v) for v in redactor.params(sql, params)]
+        object.__setattr__(self, '_call', {
+            't': 'call', 'ts': time.time(), 'sql': normalize_sql(sql), 'params': params, 'many': many,
+            'exec_ms': 0.0, 'fetch_ms': 0.0, 'rowcount': -1, 'sets': [],
+        })
+
+    def _open_set(self) -> None:
+        self._call['sets'].append({'cols': self._columns(), 'rows': []})
+
+    def _add_rows(self, rows: list) -> None:
+        current = self._call['sets'][-1] if self._call and self._call['sets'] else None
+        if current is None or current['cols'] is None:
+            return
+        redactor = self._recorder.redactor
+        for row in rows:
+            current['rows'].append([encode_value(v) for v in redactor.row(current['cols'], list(row))])
+
+    def execute(self, sql, *params):
+        self._start(sql, flatten_params(params))
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(sql, *params)
+        except pyodbc.Error as e:
+            self._call['exec_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._call['error'] = str(e)
+            self._flush()
+            raise
+        self._call['exec_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self._call['rowcount'] = self._cursor.rowcount
+        self._open_set()
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = [list(p) for p in seq_of_params]
+        self._start(sql, seq_of_params, many=True)
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._call['exec_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._flush()
+
+    def _fetch(self, method: str, *args):
+        started = time.perf_counter()
+        result = getattr(self._cursor, method)(*args)
+        if self._call is not None:
+            self._call['fetch_ms'] = round(self._call['fetch_ms'] + (time.perf_counter() - started) * 1000, 3)
+            if method == 'fetchone':
+                if result is not None:
+                    self._add_rows([result])
+            else:
+                self._add_rows(result)
+        return result
+
+    def fetchone(self):
+        return self._fetch('fetchone')
+
+    def fetchall(self):
+        return self._fetch('fetchall')
+
+    def fetchmany(self, size=None):
+        return self._fetch('fetchmany', size) if size is not None else self._fetch('fetchmany')
+
+    def nextset(self):
+        has_next = self._cursor.nextset()
+        if self._call is not None:
+            if has_next:
+                self._open_set()
+            else:
+                # Every result set has been read, so the call is complete
+                self._flush()
+        return has_next
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._add_rows([row])
+            yield row
+
+
+class RecordingConnection:
+    """Connection wrapper whose cursors record their traffic."""
+
+    def __init__(self, conn, recorder: Recorder):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_recorder', recorder)
+        # Weak, so a pooled connection does not keep every cursor it ever opened
+        object.__setattr__(self, '_cursors', weakref.WeakSet())
+
+    def cursor(self):
+        cursor = RecordingCursor(self._conn.cursor(), self._recorder)
+        self._cursors.add(cursor)
+        return cursor
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor._flush()
+        self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+class ReplayMiss(pyodbc.Error):
+    """Raised when a replayed statement has no matching recording."""
+
+
+def load_recording(path: str) -> List[Dict]:
+    """Load a recording, merging the per-process files of DB_RECORD_FILE in timestamp order."""
+    files = recording_files(path)
+    if not files:
+        raise FileNotFoundError(f'No recording found at {path}')
+    entries = []
+    for name in files:
+        with gzip.open(name, 'rt', encoding='utf-8') as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    if len(files) > 1:
+        # Stable, so each process's calls keep their order
+        entries.sort(key=lambda entry: entry.get('ts', 0))
+    return entries
+
+
+class ReplayStore:
+    """Recorded calls indexed by statement and parameters."""
+
+    def __init__(self, entries: List[Dict], redactor: Redactor, latency_scale: float = 1.0):
+        self.redactor = redactor
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._exact: Dict[tuple, List[Dict]] = {}
+        self._by_sql: Dict[str, List[Dict]] = {}
+        self._cursor_pos: Dict[tuple, int] = {}
+        self.requests = [e for e in entries if e.get('t') == 'req']
+        self.stats = {'calls': 0, 'exact': 0, 'fallback': 0, 'misses': 0}
+        for entry in entries:
+            if entry.get('t') != 'call':
+                continue
+            self._exact.setdefault(self._key(entry['sql'], entry['params']), []).append(entry)
+            self._by_sql.setdefault(entry['sql'], []).append(entry)
+
+    @staticmethod
+    def _key(sql: str, params: list) -> tuple:
+        return (sql, json.dumps(params, separators=(',', ':')))
+
+    def lookup(self, sql: str, params: list, many: bool = False) -> Dict:
+        sql = normalize_sql(sql)
+        if many:
+            params = [[encode_value(v) for v in self.redactor.params(sql, list(p))] for p in params]
+        else:
+            params = [encode_value(v) for v in self.redactor.params(sql, params)]
+        key = self._key(sql, params)
+        with self._lock:
+            self.stats['calls'] += 1
+            candidates = self._exact.get(key)
+            if candidates:
+                self.stats['exact'] += 1
+            else:
+                # Same statement with other parameters keeps the load shape realistic
+                candidates = self._by_sql.get(sql)
+                key = (sql,)
+                if not candidates:
+                    self.stats['misses'] += 1
+                    raise ReplayMiss(f"No recording for statement: {sql[:120]}")
+                self.stats['fallback'] += 1
+            # Cycle through repeated recordings of the same call in their original order
+            pos = self._cursor_pos.get(key, 0)
+            self._cursor_pos[key] = pos + 1
+            return candidates[pos % len(candidates)]
+
+    def sleep(self, ms: float) -> None:
+        if self.latency_scale > 0 and ms > 0:
+            time.sleep(ms * self.latency_scale / 1000)
+
+
+class ReplayCursor:
+    """Serves recorded result sets through the parts of the pyodbc cursor API the app uses."""
+
+    def __init__(self, store: ReplayStore):
+        self._store = store
+        self._sets: List[Dict] = []
+        self._set_index = 0
+        self._rows: List[tuple] = []
+        self._fetch_ms = 0.0
+        self.description = None
+        self.rowcount = -1
+        self.fast_executemany = False
+
+    def _load_set(self) -> None:
+        current = self._sets[self._set_index] if self._set_index < len(self._sets) else None
+        if current and current.get('cols') is not None:
+            self.description = [(c, None, None, None, None, None, True) for c in current['cols']]
+            self._rows = [tuple(decode_value(v) for v in row) for row in current['rows']]
+        else:
+            self.description = None
+            self._rows = []
+
+    def execute(self, sql, *params):
+        call = self._store.lookup(sql, flatten_params(params))
+        self._store.sleep(call.get('exec_ms', 0))
+        if call.get('error'):
+            raise pyodbc.Error(call['error'])
+        self._sets = call.get('sets') or []
+        self._set_index = 0
+        self._fetch_ms = call.get('fetch_ms', 0)
+        self.rowcount = call.get('rowcount', -1)
+        self._load_set()
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        call = self._store.lookup(sql, [list(p) for p in seq_of_params], many=True)
+        self._store.sleep(call.get('exec_ms', 0))
+
+    def _consume_fetch_time(self) -> None:
+        if self._fetch_ms:
+            self._store.sleep(self._fetch_ms)
+            self._fetch_ms = 0.0
+
+    def fetchone(self):
+        self._consume_fetch_time()
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        self._consume_fetch_time()
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size: int = 1):
+        self._consume_fetch_time()
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def nextset(self):
+        if self._set_index + 1 >= len(self._sets):
+            return False
+        self._set_index += 1
+        self._load_set()
+        return True
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayConnection:
+    def __init__(self, store: ReplayStore):
+        self._store = store
+
+    def cursor(self):
+        return ReplayCursor(self._store)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def redactor_from_env() -> Redactor:
+    """Build the redactor from DB_RECORD_REDACT and DB_RECORD_REDACT_KEYS."""
+    keys = os.getenv('DB_RECORD_REDACT_KEYS', ','.join(DEFAULT_REDACT_KEYS))
+    return Redactor(keys=[k.strip() for k in keys.split(',') if k.strip()],
+                    enabled=os.getenv('DB_RECORD_REDACT', 'yes').lower() == 'yes')
+
+
+_recorder: Optional[Recorder] = None
+_replay_store: Optional[ReplayStore] = None
+_mode_lock = threading.Lock()
+
+
+def get_recorder() -> Optional[Recorder]:
+    """Return the active recorder if DB_RECORD_FILE is set."""
+    global _recorder
+    path = os.getenv('DB_RECORD_FILE')
+    if not path:
+        return None
+    with _mode_lock:
+        # A recorder inherited over fork has no writer thread and the parent's file
+        if _recorder is None or _recorder.pid != os.getpid():
+            _recorder = Recorder(path, redactor_from_env())
+    return _recorder
+
+
+def get_replay_store() -> Optional[ReplayStore]:
+    """Return the replay store if DB_REPLAY_FILE is set."""
+    global _replay_store
+    path = os.getenv('DB_REPLAY_FILE')
+    if not path:
+        return None
+    with _mode_lock:
+        if _replay_store is None:
+            _replay_store = ReplayStore(load_recording(path), redactor_from_env(),
+                                        float(os.getenv('DB_REPLAY_LATENCY_SCALE', '1.0')))
+    return _replay_store
+
+
+def install_request_recording(app) -> None:
+    """Record the /api requests that drive the database traffic, so it can be replayed."""
+    from flask import g, request, session
+
+    if get_recorder() is None:
+        return
+
+    @app.before_request
+    def _mark_request_start():
+        g.record_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        recorder = get_recorder()
+        if recorder is not None and request.path.startswith('/api/'):
+            started = g.get('record_started', time.perf_counter())
+            recorder.record({
+                't': 'req', 'ts': time.time(), 'method': request.method, 'path': request.path,
+                'args': recorder.redactor.mapping(request.args.to_dict()),
+                'json': recorder.redactor.mapping(request.get_json(silent=True)),
+                'user_id': session.get('user_id'),
+                'username': recorder.redactor.token(session.get('username')),
+                'status': response.status_code,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+        return response
@@ -0,0 +1,234 @@
+"""
+Structured, non-blocking logging for the Flask app.
+Records are serialized to JSON on the request thread and handed to a queue;
+a background listener does the actual I/O. Each record carries the request's
+correlation ID, user, endpoint and database timing.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config.database import get_db_timing, start_db_timing, stop_db_timing
+
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Context of the request currently being handled on this thread
+_request_context = contextvars.ContextVar('request_context', default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_request_id() -> Optional[str]:
+    """Return the correlation ID of the current request, if any."""
+    context = _request_context.get()
+    return context['request_id'] if context else None
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request's correlation ID, user, endpoint and DB timing to each record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        if context:
+            record.request_id = context['request_id']
+            record.user = context.get('user')
+            record.endpoint = context.get('endpoint')
+            record.method = context.get('method')
+        timing = get_db_timing()
+        if timing:
+            record.db_ms = round(timing['ms'], 2)
+            record.db_calls = timing['calls']
+            record.db_connect_ms = round(timing['connect_ms'], 2)
+        return True
+
+
+class ErrorRateLimitFilter(logging.Filter):
+    """Let through at most `burst` identical warnings/errors per `window` seconds.
+
+    Records are identical when they share logger, message template and exception
+    type, which is what a database outage produces on every request. The first
+    record after a suppressed stretch reports how many were dropped.
+    """
+
+    def __init__(self, burst: int = 5, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        self._buckets: Dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        key = (record.name, record.msg, exc_type)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                suppressed = bucket[2] if bucket else 0
+                self._buckets[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                if len(self._buckets) > 1024:
+                    self._prune_locked(now)
+                return True
+            if bucket[1] < self.burst:
+                bucket[1] += 1
+                return True
+            bucket[2] += 1
+            return False
+
+    def _prune_locked(self, now: float) -> None:
+        for key in [k for k, b in self._buckets.items() if now - b[0] >= self.window and not b[2]]:
+            del self._buckets[key]
+
+
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class JsonQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues the finished JSON line, so the listener only does I/O.
+
+    Records that find the queue full are dropped and counted; once the queue has
+    room again a warning reports them, at most once per `report_interval` seconds.
+    """
+
+    def __init__(self, log_queue: queue.Queue, report_interval: float = 60.0):
+        super().__init__(log_queue)
+        self.report_interval = report_interval
+        self.dropped = 0
+        self._reported = 0
+        self._last_report = None
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Never block or raise on the request thread; a full queue means the writer is behind
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+        if self.dropped > self._reported:
+            self._report_dropped()
+
+    def _report_dropped(self) -> None:
+        now = time.monotonic()
+        with self._dropped_lock:
+            if self._last_report is not None and now - self._last_report < self.report_interval:
+                return
+            count = self.dropped - self._reported
+            self._reported = self.dropped
+            self._last_report = now
+        warning = logging.LogRecord('miosphere.logging', logging.WARNING, __file__, 0,
+                                    "Log queue was full, dropped %d records (%d since start)",
+                                    (count, self.dropped), None)
+        try:
+            self.queue.put_nowait(self.prepare(warning))
+        except queue.Full:
+            with self._dropped_lock:
+                self._reported -= count
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        line = self.format(record)
+        return logging.makeLogRecord({'msg': line, 'levelno': record.levelno,
+                                      'levelname': record.levelname, 'name': record.name})
+
+
+def setup_logging(app=None) -> None:
+    """Route all logging through the background writer and install the Flask request hooks."""
+    global _listener
+    if _listener is None:
+        log_file = os.getenv('LOG_FILE')
+        if log_file:
+            output = logging.handlers.WatchedFileHandler(log_file, encoding='utf-8')
+        else:
+            output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(logging.Formatter('%(message)s'))
+
+        log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+        handler = JsonQueueHandler(log_queue)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(RequestContextFilter())
+        handler.addFilter(ErrorRateLimitFilter(
+            burst=int(os.getenv('LOG_ERROR_BURST', '5')),
+            window=float(os.getenv('LOG_ERROR_WINDOW_SECONDS', '60')),
+        ))
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        # Werkzeug's own access log would duplicate the request records below
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+    if app is not None:
+        _install_request_hooks(app)
+
+
+def _install_request_hooks(app) -> None:
+    from flask import g, request, session
+
+    access_logger = logging.getLogger('miosphere.access')
+
+    @app.before_request
+    def _start_request_context():
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+        _request_context.set({
+            'request_id': request_id[:64],
+            'user': session.get('username'),
+            'endpoint': request.endpoint,
+            'method': request.method,
+        })
+        start_db_timing()
+
+    @app.after_request
+    def _finish_request_context(response):
+        request_id = get_request_id()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        started = g.get('request_started')
+        if started is not None and request.endpoint != 'static':
+            access_logger.info("%s %s %s", request.method, request.path, response.status_code,
+                               extra={'status': response.status_code,
+                                      'duration_ms': round((time.perf_counter() - started) * 1000, 2)})
+        return response
+
+    @app.teardown_request
+    def _clear_request_context(exc):
+        _request_context.set(None)
+        stop_db_timing()
@@ -0,0 +1,168 @@
+"""
+Registry of the stored-procedure calls (and other hot statements) the app runs.
+Each statement has a name, one canonical SQL text and named parameters.
+The first call on a connection opens a cursor for it; later calls on that
+connection reuse the cursor, so pyodbc skips re-preparing the identical text.
+With the connection pool this carries across requests. Parameter types are
+left to pyodbc: the procedures' declared types are not known here, and a
+guessed declaration can force conversions the procedure never asked for.
+"""
+import collections
+import contextlib
+import logging
+import threading
+from typing import Dict, Sequence
+
+import pyodbc
+
+
+logger = logging.getLogger(__name__)
+
+
+class Statement:
+    """A named SQL statement with one `?` per named parameter."""
+
+    def __init__(self, name: str, sql: str, params: Sequence[str]):
+        self.name = name
+        self.sql = sql
+        self.param_names = list(params)
+
+
+STATEMENTS: Dict[str, Statement] = {}
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+
+
+def register(name: str, sql: str, params: Sequence[str] = ()) -> Statement:
+    if name in STATEMENTS:
+        raise ValueError(f'Statement {name!r} is already registered')
+    if sql.count('?') != len(params):
+        raise ValueError(f'Statement {name!r} has {sql.count("?")} placeholders for {len(params)} parameters')
+    statement = Statement(name, sql, params)
+    STATEMENTS[name] = statement
+    return statement
+
+
+def register_procedure(name: str, procedure: str, params: Sequence[str] = (), prefix: str = '') -> Statement:
+    """Register `EXEC procedure @p1 = ?, @p2 = ?, ...` for the given parameter names."""
+    call = f'EXEC {procedure}'
+    if params:
+        call += ' ' + ', '.join(f'@{param} = ?' for param in params)
+    return register(name, prefix + call, params)
+
+
+@contextlib.contextmanager
+def run(conn, name: str, *params):
+    """
+    Run a registered statement on `conn` and yield its cursor for fetching.
+    The cursor belongs to the connection: don't close it. Result sets left
+    unread are discarded on exit, because on a connection without MARS they
+    would block every other cursor.
+    """
+    cursor = _execute(conn, name, params)
+    try:
+        yield cursor
+    finally:
+        _drain(conn, name, cursor)
+
+
+def call(conn, name: str, *params) -> None:
+    """Run a registered statement whose results are not needed, e.g. a write procedure."""
+    _drain(conn, name, _execute(conn, name, params))
+
+
+def _execute(conn, name: str, params: tuple):
+    statement = STATEMENTS[name]
+    if len(params) != len(statement.param_names):
+        raise TypeError(f'{name} takes {len(statement.param_names)} parameters '
+                        f'({", ".join(statement.param_names)}), got {len(params)}')
+    cursors = conn.statements
+    cursor = cursors.get(name)
+    if cursor is None:
+        cursor = conn.cursor()
+        cursors[name] = cursor
+        outcome = 'prepared'
+    else:
+        outcome = 'reused'
+    with _stats_lock:
+        _stats[name][outcome] += 1
+    try:
+        return cursor.execute(statement.sql, params) if params else cursor.execute(statement.sql)
+    except pyodbc.Error:
+        # The cursor may be unusable now; prepare afresh on the next call
+        cursors.pop(name, None)
+        raise
+
+
+def _drain(conn, name: str, cursor) -> None:
+    # Reading past the last result set frees the results but keeps the statement prepared
+    try:
+        while cursor.nextset():
+            pass
+    except pyodbc.Error as e:
+        # Closing the cursor used to discard these silently; prepare afresh next time instead
+        logger.warning("Discarding unread results of %s: %s", name, e)
+        conn.statements.pop(name, None)
+        try:
+            cursor.close()
+        except pyodbc.Error:
+            pass
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Prepare and reuse counts per statement, in this process."""
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in sorted(_stats.items())}
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+# Step 2 / step 3 reads
+register_procedure('trips_by_unit', 'dbo.miosphere_dtv_get_trip_by_unit', ['date', 'shift_code', 'mobileid'])
+register_procedure('trips_by_unit_nrp', 'dbo.miosphere_dtv_get_trip_by_unit_nrp',
+                   ['date', 'shift_code', 'mobileid', 'opr_nrp'])
+register_procedure('realtime_hm_validation', '[dbo].[miosphere_dtv_get_realtime_hm_validation]',
+                   prefix='SET NOCOUNT ON; ')
+register_procedure('latest_login', 'dbo.miosphere_dtv_get_latest_login_data', ['mobileid'])
+
+
+def register_login_range(procedure: str) -> Statement:
+    """
+    Register the site's login range procedure as 'login_range'. It takes @mobileid,
+    @start and @end and returns the unit's login records with reporttime in
+    [@start, @end), in the columns of miosphere_dtv_get_latest_login_data. The app
+    ships no such procedure, so its name comes from configuration.
+    """
+    existing = STATEMENTS.get('login_range')
+    if existing is not None and existing.sql.startswith(f'EXEC {procedure} '):
+        return existing
+    return register_procedure('login_range', procedure, ['mobileid', 'start', 'end'])
+
+
+# Trip writes
+register_procedure('insert_trip', 'dbo.miosphere_dtv_insert_trip', [
+    'rep', 'mobileid', 'opr_nrp', 'opr_shift', 'act_loaderid', 'pos_name', 'act_hauldistance',
+])
+register('inserted_trip_id',
+         'SELECT TOP 1 id FROM db_web.dbo.opr_dump WHERE reporttime = ? AND mobileid = ? AND opr_nrp = ? '
+         'ORDER BY id DESC',
+         ['reporttime', 'mobileid', 'opr_nrp'])
+register_procedure('delete_trip', 'dbo.miosphere_dtv_delete_trip', ['id'])
+register_procedure('restore_trip', 'dbo.miosphere_dtv_restore_trip', ['id'])
+register_procedure('modify_trip', 'dbo.miosphere_dtv_modify_trip', [
+    'id', 'reporttime', 'act_loaderid', 'pos_name', 'act_hauldistance',
+])
+
+# HM and shift corrections
+register_procedure('update_shift', 'dbo.miosphere_dtv_update_shift', [
+    'id', 'next_id', 'reporttime', 'next_reporttime', 'mobileid', 'opr_nrp', 'hm', 'next_hm',
+    'opr_shift', 'new_shift',
+])
+# One statement for every login correction; the kind of change goes in @remark
+register_procedure('login_update', 'dbo.miosphere_dtv_insert_login_update', [
+    'id', 'b_nrp', 'a_nrp', 'b_hm', 'a_hm', 'b_shift', 'a_shift', 'remark', 'updated_by',
+])
@@ -0,0 +1,246 @@
+"""
+Lightweight in-process request tracing.
+Nested spans are timed with perf_counter and kept per request; finished traces
+are sampled into an in-memory ring buffer and optionally appended to a local
+JSON-lines file by a background writer. Nothing leaves the host. The buffer is
+per process, so each trace records the pid of the worker that served it.
+"""
+import atexit
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed phase of a trace."""
+
+    __slots__ = ('span_id', 'parent_id', 'name', 'attrs', 'start', 'end', 'error')
+
+    def __init__(self, name: str, parent_id: Optional[int], span_id: int, attrs: Dict):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+
+class Trace:
+    """All spans recorded for one request."""
+
+    def __init__(self, name: str, attrs: Dict):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self.root = self.new_span(name, None, attrs)
+
+    def new_span(self, name: str, parent_id: Optional[int], attrs: Dict) -> Span:
+        span = Span(name, parent_id, len(self.spans), attrs)
+        self.spans.append(span)
+        return span
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return (end - self.root.start) * 1000
+
+    def to_dict(self) -> Dict:
+        origin = self.root.start
+        return {
+            'trace_id': self.trace_id,
+            'pid': os.getpid(),
+            'name': self.root.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration_ms, 3),
+            'attrs': self.root.attrs,
+            'spans': [
+                {
+                    'id': s.span_id,
+                    'parent_id': s.parent_id,
+                    'name': s.name,
+                    'offset_ms': round((s.start - origin) * 1000, 3),
+                    'duration_ms': round(((s.end or s.start) - s.start) * 1000, 3),
+                    'attrs': s.attrs,
+                    'error': s.error,
+                }
+                for s in self.spans
+            ],
+        }
+
+
+class Tracer:
+    """Decides which finished traces to keep and hands them to the exporters."""
+
+    def __init__(self, sample_rate: float = 0.1, slow_ms: float = 1000.0, buffer_size: int = 200,
+                 export_file: Optional[str] = None, max_spans: int = 500):
+        self._buffer_lock = threading.Lock()
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._file_queue = None
+        self.configure(sample_rate, slow_ms, buffer_size, export_file, max_spans)
+
+    def configure(self, sample_rate: float, slow_ms: float, buffer_size: int,
+                  export_file: Optional[str] = None, max_spans: int = 500) -> None:
+        """Set the sampling policy and exporters."""
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_spans = max_spans
+        with self._buffer_lock:
+            self._buffer = collections.deque(self._buffer, maxlen=buffer_size)
+        if export_file and self._file_queue is None:
+            self._file_queue = queue.Queue(maxsize=1000)
+            threading.Thread(target=self._write_file, args=(export_file,), name='trace-exporter',
+                             daemon=True).start()
+            atexit.register(self._file_queue.put, None)
+
+    def configure_from_env(self) -> None:
+        """Apply the TRACE_* environment variables."""
+        self.configure(
+            sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '0.1')),
+            slow_ms=float(os.getenv('TRACE_SLOW_MS', '1000')),
+            buffer_size=int(os.getenv('TRACE_BUFFER_SIZE', '200')),
+            export_file=os.getenv('TRACE_FILE') or None,
+        )
+
+    def start_trace(self, name: str, **attrs) -> Trace:
+        trace = Trace(name, attrs)
+        _current_trace.set(trace)
+        _current_span.set(trace.root)
+        return trace
+
+    def finish_trace(self, error: Optional[BaseException] = None) -> Optional[Trace]:
+        """Close the current trace and keep it if it is sampled, slow or failed."""
+        trace = _current_trace.get()
+        if trace is None:
+            return None
+        _current_trace.set(None)
+        _current_span.set(None)
+        trace.root.end = time.perf_counter()
+        if error is not None:
+            trace.root.error = repr(error)
+        keep = (
+            trace.duration_ms >= self.slow_ms
+            or trace.root.error is not None
+            or trace.root.attrs.get('status', 200) >= 500
+            or random.random() < self.sample_rate
+        )
+        if keep:
+            record = trace.to_dict()
+            with self._buffer_lock:
+                self._buffer.append(record)
+            if self._file_queue is not None:
+                try:
+                    self._file_queue.put_nowait(record)
+                except queue.Full:
+                    pass
+        return trace
+
+    def recent(self) -> List[Dict]:
+        with self._buffer_lock:
+            return list(self._buffer)
+
+    def slowest(self, limit: int = 20) -> List[Dict]:
+        return sorted(self.recent(), key=lambda t: t['duration_ms'], reverse=True)[:limit]
+
+    def _write_file(self, path: str) -> None:
+        while True:
+            record = self._file_queue.get()
+            if record is None:
+                return
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+            except OSError:
+                pass
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child of the current span; does nothing outside a trace."""
+    trace = _current_trace.get()
+    if trace is None or len(trace.spans) >= tracer.max_spans:
+        yield None
+        return
+    parent = _current_span.get()
+    current = trace.new_span(name, parent.span_id if parent else None, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def waterfall(record: Dict) -> List[Dict]:
+    """Lay out the spans of an exported trace for display: depth plus offset/width in percent."""
+    total = record['duration_ms'] or 1.0
+    depths = {}
+    rows = []
+    for s in record['spans']:
+        depth = depths.get(s['parent_id'], -1) + 1
+        depths[s['id']] = depth
+        rows.append(dict(s, depth=depth,
+                         left_pct=round(100 * s['offset_ms'] / total, 2),
+                         width_pct=max(round(100 * s['duration_ms'] / total, 2), 0.2)))
+    return rows
+
+
+tracer = Tracer()
+
+
+def install_tracing(app) -> None:
+    """Trace every Flask request, including JSON encoding of the response."""
+    from flask import request
+    from flask.json.provider import DefaultJSONProvider
+
+    tracer.configure_from_env()
+
+    class TracedJSONProvider(DefaultJSONProvider):
+        # Only response bodies are traced; the session cookie also goes through dumps()
+        def response(self, *args: Any, **kwargs: Any):
+            with span('json.encode') as s:
+                response = super().response(*args, **kwargs)
+                if s is not None:
+                    s.set(bytes=response.content_length)
+                return response
+
+    app.json = TracedJSONProvider(app)
+
+    @app.before_request
+    def _start_trace():
+        if request.endpoint != 'static':
+            tracer.start_trace('request', method=request.method, path=request.path,
+                               endpoint=request.endpoint)
+
+    @app.after_request
+    def _record_status(response):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.root.set(status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _finish_trace(exc):
+        tracer.finish_trace(exc)
@@ -0,0 +1,169 @@
+"""
+User account helpers shared by the /register route and the bulk import command.
+"""
+import hashlib
+import json
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+import pyodbc
+
+from config.database import get_sites, get_users_connection
+
+
+logger = logging.getLogger(__name__)
+
+USERNAME_MIN = 3
+USERNAME_MAX = 50      # miosphere_users.username NVARCHAR(50)
+PASSWORD_MIN = 4
+FULLNAME_MAX = 100     # miosphere_users.fullname NVARCHAR(100)
+
+INSERT_USER = "INSERT INTO miosphere_users (username, password, fullname) VALUES (?, ?, ?)"
+# With several sites every account must name its own; see config.database.SiteRegistry
+INSERT_USER_WITH_SITE = "INSERT INTO miosphere_users (username, password, fullname, site) VALUES (?, ?, ?, ?)"
+SITE_MAX = 50          # miosphere_users.site NVARCHAR(50)
+
+
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def user_site(site) -> Optional[str]:
+    """The site to store for a new account: its normalized name with several sites, else None."""
+    if not get_sites().multi_site:
+        return None
+    return str(site or '').strip().lower() or None
+
+
+def validate_new_user(username: str, password: str, fullname: str, site: Optional[str] = None) -> Optional[str]:
+    """Return why a new account cannot be created, or None if it is valid. site is from user_site()."""
+    if not username or not password or not fullname:
+        return 'All fields are required'
+    if len(password) < PASSWORD_MIN:
+        return f'Password must be at least {PASSWORD_MIN} characters long'
+    if len(username) < USERNAME_MIN:
+        return f'Username must be at least {USERNAME_MIN} characters long'
+    if len(username) > USERNAME_MAX:
+        return f'Username must be at most {USERNAME_MAX} characters long'
+    if len(fullname) > FULLNAME_MAX:
+        return f'Full name must be at most {FULLNAME_MAX} characters long'
+    sites = get_sites()
+    if sites.multi_site:
+        if not site:
+            return 'Site is required'
+        if site not in sites.sites:
+            return f'Site must be one of {", ".join(sites.sites)}'
+    return None
+
+
+def insert_user(cursor, username: str, password_hash: str, fullname: str, site: Optional[str] = None) -> None:
+    """Insert one account; site must be given (and validated) when there are several sites."""
+    if get_sites().multi_site:
+        cursor.execute(INSERT_USER_WITH_SITE, (username, password_hash, fullname, site))
+    else:
+        cursor.execute(INSERT_USER, (username, password_hash, fullname))
+
+
+def _insert_params(row: Dict, multi_site: bool) -> tuple:
+    params = (row['username'], row['password_hash'], row['fullname'])
+    return params + (row['site'],) if multi_site else params
+
+
+def existing_usernames(cursor, usernames: Iterable[str]) -> Set[str]:
+    """Usernames that already exist, found with one query whatever the number of names."""
+    names = list(usernames)
+    if not names:
+        return set()
+    cursor.execute(
+        "SELECT u.username FROM miosphere_users u "
+        "WHERE u.username IN (SELECT value FROM OPENJSON(?))",
+        (json.dumps(names),)
+    )
+    # Compare case-insensitively, like the default SQL Server collation
+    return {row[0].casefold() for row in cursor.fetchall()}
+
+
+def _insert_rows_one_by_one(conn, cursor, rows: List[Dict], results: Dict[int, Dict]) -> None:
+    """Fallback for a failed chunk: insert row by row so each failure is reported on its own row."""
+    multi_site = get_sites().multi_site
+    for row in rows:
+        try:
+            cursor.execute(INSERT_USER_WITH_SITE if multi_site else INSERT_USER, _insert_params(row, multi_site))
+            conn.commit()
+            results[row['line']].update(status='created', message='')
+        except pyodbc.Error as e:
+            conn.rollback()
+            results[row['line']].update(status='failed', message=str(e))
+
+
+def bulk_create_users(users: List[Dict], chunk_size: int = 500,
+                      dry_run: bool = False, site: Optional[str] = None) -> List[Dict]:
+    """
+    Create many accounts at once. Each user dict needs username, password and
+    fullname, plus an optional line number and, with several sites, a site
+    unless `site` gives one for every row. Returns one result per user with
+    status created, exists, duplicate, invalid, failed or (dry run) ready.
+    """
+    results = {}
+    candidates = []
+    seen = set()
+    for idx, user in enumerate(users, 1):
+        line = user.get('line', idx)
+        username = str(user.get('username') or '').strip()
+        password = str(user.get('password') or '').strip()
+        fullname = str(user.get('fullname') or '').strip()
+        account_site = user_site(user.get('site') or site)
+        result = {'line': line, 'username': username, 'status': 'invalid', 'message': ''}
+        results[line] = result
+        error = validate_new_user(username, password, fullname, account_site)
+        if error:
+            result['message'] = error
+        elif username.casefold() in seen:
+            result.update(status='duplicate', message='Username appears earlier in the file')
+        else:
+            seen.add(username.casefold())
+            candidates.append({'line': line, 'username': username, 'password': password,
+                               'fullname': fullname.upper(), 'site': account_site})
+
+    conn = get_users_connection()
+    cursor = conn.cursor()
+    try:
+        taken = existing_usernames(cursor, [c['username'] for c in candidates])
+        to_insert = []
+        for candidate in candidates:
+            if candidate['username'].casefold() in taken:
+                results[candidate['line']].update(status='exists', message='Username already exists')
+            else:
+                to_insert.append(candidate)
+
+        for candidate in to_insert:
+            candidate['password_hash'] = hash_password(candidate.pop('password'))
+
+        if dry_run:
+            for candidate in to_insert:
+                results[candidate['line']]['status'] = 'ready'
+        else:
+            multi_site = get_sites().multi_site
+            cursor.fast_executemany = True
+            for start in range(0, len(to_insert), chunk_size):
+                chunk = to_insert[start:start + chunk_size]
+                # Fixed sizes let the driver bind the whole chunk as one parameter array
+                sizes = [(pyodbc.SQL_WVARCHAR, USERNAME_MAX, 0),
+                         (pyodbc.SQL_WVARCHAR, 255, 0),
+                         (pyodbc.SQL_WVARCHAR, FULLNAME_MAX, 0)]
+                cursor.setinputsizes(sizes + [(pyodbc.SQL_WVARCHAR, SITE_MAX, 0)] if multi_site else sizes)
+                try:
+                    cursor.executemany(INSERT_USER_WITH_SITE if multi_site else INSERT_USER,
+                                       [_insert_params(c, multi_site) for c in chunk])
+                    conn.commit()
+                    for candidate in chunk:
+                        results[candidate['line']].update(status='created')
+                except pyodbc.Error as e:
+                    conn.rollback()
+                    logger.warning("Bulk insert of %d users failed, retrying one by one: %s", len(chunk), e)
+                    _insert_rows_one_by_one(conn, cursor, chunk, results)
+    finally:
+        cursor.close()
+        conn.close()
+
+    return [results[key] for key in sorted(results)]
@@ -0,0 +1,323 @@
+"""
+Validate HM continuity and trips for the whole fleet over a date range.
+Each unit is handled by a worker process with its own database connection:
+its login history is paired and run through the step 3 checks, and its trips
+are fetched for every date and shift in the range.
+
+The login history of the range comes from the procedure named by
+--login-procedure (HM_LOGIN_RANGE_PROCEDURE). Without one the script falls back
+to miosphere_dtv_get_latest_login_data, which only returns a unit's latest
+logins; units whose history does not reach back to --start are reported as
+'history truncated' rather than silently checked in part. Finished units are appended
+to a checkpoint file, so an interrupted run picks up where it stopped.
+
+Usage:
+    python scripts/batch_validate.py --start 2024-01-01 --end 2024-01-31
+        [--shifts S01,S02,S03] [--units DT101,DT102] [--workers 8] [--out audit-2024-01]
+        [--site north] [--login-procedure dbo.login_data_by_range]
+
+Writes <out>/problems.csv and <out>/summary.json.
+"""
+import sys
+import os
+import argparse
+import csv
+import json
+import multiprocessing
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+# Add parent directory to path so we can import config and timesheet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+
+# Logins are fetched this far beyond the range, so that the first login has the
+# logout before it and the last one the logout after it
+HISTORY_MARGIN = timedelta(days=1)
+
+CSV_FIELDS = ['unit', 'source', 'date', 'shift', 'id', 'reporttime', 'operator', 'problem', 'detail']
+
+# Worker process state: one connection per worker, opened by init_worker
+_conn = None
+
+
+def init_worker(site=None, login_procedure=None):
+    global _conn
+    load_dotenv()
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from config.database import get_db_connection, use_site
+    if login_procedure:
+        from config.statements import register_login_range
+        register_login_range(login_procedure)
+    # Tasks run in this thread, so reconnects go to the same site
+    use_site(site)
+    _conn = get_db_connection()
+
+
+def reconnect():
+    global _conn
+    from config.database import get_db_connection
+    try:
+        # The connection just failed; returning it to the pool would hand it to the next task
+        discard = getattr(_conn, 'discard', None)
+        (discard or _conn.close)()
+    except Exception:
+        pass
+    _conn = get_db_connection()
+
+
+def hm_problems(unit, history, start, end):
+    """Step 3 checks over the unit's logins whose report time falls in [start, end)."""
+    from timesheet.hm_validation import FLAG_COLUMNS, HmBatch, rows_from_login_history, validate_batch
+    rows = [r for r in rows_from_login_history(history)
+            if start <= _as_datetime(r['reporttime']) < end]
+    if not rows:
+        return 0, []
+    result = validate_batch(HmBatch.from_rows(rows))
+    columns = {col: result[col].tolist() for col in FLAG_COLUMNS + ('TOTAL_HM', 'total_bad')}
+    problems = []
+    for idx, row in enumerate(rows):
+        flags = [columns[col][idx] for col in FLAG_COLUMNS if columns[col][idx]]
+        if columns['total_bad'][idx]:
+            flags.append('total hm')
+        total = columns['TOTAL_HM'][idx]
+        total = None if total != total else total
+        for flag in flags:
+            problems.append({
+                'unit': unit, 'source': 'hm', 'date': _as_datetime(row['reporttime']).date().isoformat(),
+                'shift': row.get('opr_shift') or '', 'id': row.get('id'),
+                'reporttime': _as_datetime(row['reporttime']).isoformat(),
+                'operator': row.get('opr_nrp') or '', 'problem': flag,
+                'detail': f"prev_hm={row.get('prev_hm')} hm={row.get('hm')} next_hm={row.get('next_hm')} "
+                          f"total_hm={total}",
+            })
+    return len(rows), problems
+
+
+def truncation_problem(unit, history, start):
+    """A 'history truncated' problem if the unit's latest logins do not reach back to start."""
+    times = [_as_datetime(r['reporttime']) for r in history if r.get('reporttime') is not None]
+    if not times or min(times) <= start:
+        return None
+    earliest = min(times)
+    return {
+        'unit': unit, 'source': 'hm', 'date': earliest.date().isoformat(), 'shift': '', 'id': None,
+        'reporttime': earliest.isoformat(), 'operator': '', 'problem': 'history truncated',
+        'detail': f"latest login data starts at {earliest.isoformat()}; set HM_LOGIN_RANGE_PROCEDURE "
+                  f"to check the whole range",
+    }
+
+
+def trip_problems(unit, day, shift, trips):
+    """Data-quality checks on the trips of one unit, date and shift."""
+    problems = []
+    seen_times = set()
+    for trip in trips:
+        if trip.get('note') == 'deleted' or trip.get('recordType', 'trip') != 'trip':
+            continue
+        found = []
+        if not trip.get('operatorId'):
+            found.append('no operator')
+        if not trip.get('loaderId'):
+            found.append('no loader')
+        if trip.get('reportTime') in seen_times:
+            found.append('duplicate report time')
+        seen_times.add(trip.get('reportTime'))
+        for problem in found:
+            problems.append({
+                'unit': unit, 'source': 'trip', 'date': day, 'shift': shift, 'id': trip.get('id'),
+                'reporttime': trip.get('reportTime') or '', 'operator': trip.get('operatorId') or '',
+                'problem': problem, 'detail': f"loader={trip.get('loaderId')} pos={trip.get('posName')}",
+            })
+    return problems
+
+
+def validate_unit(task):
+    """Worker entry point: validate one unit, retrying once on a fresh connection."""
+    unit, start, end, shifts, use_range = task
+    from timesheet import queries
+    range_start = datetime.fromisoformat(start)
+    range_end = datetime.fromisoformat(end) + timedelta(days=1)
+    started = time.perf_counter()
+    for attempt in (1, 2):
+        try:
+            if use_range:
+                history = queries.fetch_login_range(unit, range_start - HISTORY_MARGIN,
+                                                    range_end + HISTORY_MARGIN, conn=_conn)
+            else:
+                history = queries.fetch_latest_login(unit, conn=_conn)
+            logins, problems = hm_problems(unit, history, range_start, range_end)
+            truncated = None if use_range else truncation_problem(unit, history, range_start)
+            if truncated:
+                problems.insert(0, truncated)
+            trips = 0
+            for day in _days(start, end):
+                for shift in shifts:
+                    day_trips = queries.fetch_trips(unit, '', day, [shift], conn=_conn)
+                    trips += len(day_trips)
+                    problems.extend(trip_problems(unit, day, shift, day_trips))
+            return {'unit': unit, 'ok': True, 'logins': logins, 'trips': trips, 'problems': problems,
+                    'seconds': round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            if attempt == 2:
+                return {'unit': unit, 'ok': False, 'error': str(e)}
+            reconnect()
+
+
+def _days(start, end):
+    day = date.fromisoformat(start)
+    while day <= date.fromisoformat(end):
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def load_checkpoint(path):
+    """Results of units finished by earlier runs with the same checkpoint file."""
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of an interrupted run
+                if result.get('ok'):
+                    done[result['unit']] = result
+        # Start the next record on its own line after a torn one
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+    return done
+
+
+def fleet_units():
+    from timesheet import queries
+    result = queries.fetch_realtime_hm_validation()
+    return sorted({row['MOBILEID'] for row in (result['rows'] if result else []) if row.get('MOBILEID')})
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Batch HM and trip validation for a date range')
+    parser.add_argument('--start', required=True, help='First date, YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='Last date (inclusive), YYYY-MM-DD')
+    parser.add_argument('--shifts', default='S01,S02,S03', help='Comma-separated trip shift codes')
+    parser.add_argument('--units', help='Comma-separated MOBILEIDs (default: every unit in step 3)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes, each with its own DB connection (default: CPU count)')
+    parser.add_argument('--out', default='batch-validation', help='Directory for checkpoint and report')
+    parser.add_argument('--site', help='Database site to validate (see DB_SITES; default: DB_DEFAULT_SITE)')
+    parser.add_argument('--login-procedure', default=os.getenv('HM_LOGIN_RANGE_PROCEDURE') or None,
+                        help='Procedure returning the login history of @mobileid between @start and @end '
+                             '(default: HM_LOGIN_RANGE_PROCEDURE; without one only the latest logins are read)')
+    args = parser.parse_args()
+
+    from timesheet.queries import normalize_shifts
+    shifts = normalize_shifts(args.shifts.split(','))
+    if not shifts:
+        parser.error('no valid shift codes given')
+    if date.fromisoformat(args.end) < date.fromisoformat(args.start):
+        parser.error('--end is before --start')
+    if args.site:
+        from config.database import use_site
+        try:
+            use_site(args.site.strip().lower())
+        except (KeyError, ValueError) as e:
+            parser.error(str(e))
+
+    os.makedirs(args.out, exist_ok=True)
+    run = {'start': args.start, 'end': args.end, 'shifts': shifts}
+    if args.site:
+        run['site'] = args.site.strip().lower()
+    if args.login_procedure:
+        run['login_procedure'] = args.login_procedure
+    run_file = os.path.join(args.out, 'run.json')
+    if os.path.exists(run_file):
+        with open(run_file, encoding='utf-8') as f:
+            if json.load(f) != run:
+                parser.error(f'{args.out} holds a run with other dates, shifts, site or login procedure; '
+                             f'use another --out')
+    else:
+        with open(run_file, 'w', encoding='utf-8') as f:
+            json.dump(run, f)
+    checkpoint = os.path.join(args.out, 'checkpoint.jsonl')
+    done = load_checkpoint(checkpoint)
+    units = [u.strip() for u in args.units.split(',') if u.strip()] if args.units else fleet_units()
+    pending = [u for u in units if u not in done]
+    from timesheet.hm_validation import get_shift_windows
+    if not get_shift_windows():
+        print("HM_SHIFT_WINDOWS is not set; logins are not checked for salah shift")
+    if not args.login_procedure:
+        print("HM_LOGIN_RANGE_PROCEDURE is not set; reading the latest login data, "
+              "units whose history ends before --start are reported as truncated")
+    print(f"{len(units)} units, {len(units) - len(pending)} already done, {len(pending)} to validate "
+          f"with {args.workers} workers")
+
+    failed = {}
+    started = time.perf_counter()
+    if pending:
+        tasks = [(unit, args.start, args.end, shifts, bool(args.login_procedure)) for unit in pending]
+        with multiprocessing.Pool(args.workers, initializer=init_worker,
+                                  initargs=(run.get('site'), args.login_procedure)) as pool, \
+                open(checkpoint, 'a', encoding='utf-8') as out:
+            for count, result in enumerate(pool.imap_unordered(validate_unit, tasks), 1):
+                if result['ok']:
+                    out.write(json.dumps(result, default=str) + '\n')
+                    out.flush()
+                    os.fsync(out.fileno())
+                    done[result['unit']] = result
+                else:
+                    failed[result['unit']] = result['error']
+                elapsed = time.perf_counter() - started
+                print(f"\r{count}/{len(pending)} units, {count / elapsed:.2f} units/s, "
+                      f"{len(failed)} failed", end='', flush=True)
+        print()
+    elapsed = time.perf_counter() - started
+
+    results = [done[u] for u in units if u in done]
+    problems = [p for r in results for p in r['problems']]
+    with open(os.path.join(args.out, 'problems.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(problems, key=lambda p: (p['unit'], p['reporttime'])))
+
+    by_unit = Counter(p['unit'] for p in problems)
+    summary = {
+        'start': args.start,
+        'end': args.end,
+        'shifts': shifts,
+        'units': len(units),
+        'units_validated': len(results),
+        'units_failed': failed,
+        'logins_checked': sum(r['logins'] for r in results),
+        'trips_checked': sum(r['trips'] for r in results),
+        'problem_rows': len(problems),
+        'problems_by_type': dict(Counter(f"{p['source']}: {p['problem']}" for p in problems).most_common()),
+        'units_with_most_problems': dict(by_unit.most_common(10)),
+        'run_seconds': round(elapsed, 2),
+        'workers': args.workers,
+    }
+    with open(os.path.join(args.out, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"{summary['logins_checked']} logins and {summary['trips_checked']} trips checked, "
+          f"{len(problems)} problem rows")
+    for name, count in summary['problems_by_type'].items():
+        print(f"  {name:<32}{count:>8}")
+    if failed:
+        print(f"{len(failed)} units failed; run again with the same --out to retry them")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Benchmark for the vectorized HM validation engine.
+Generates a synthetic fleet, validates it with both the vectorized and the
+row-at-a-time implementation, and reports timings and any rows where the two
+disagree. Both share the flag definitions, so this is not a parity check with
+the procedure; that is tests/test_hm_validation.py against captured output.
+"""
+import sys
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+# Add parent directory to path so we can import timesheet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timesheet.hm_validation import HmBatch, parse_shift_windows, validate_batch, validate_row
+
+
+# Sample windows so the salah shift check does work; not the production shift table
+BENCH_WINDOWS = parse_shift_windows('1=05:00-14:00,2=13:00-22:00,3=21:00-06:00,6=05:00-18:00,7=17:00-06:00')
+
+
+def generate_rows(count: int, seed: int = 42):
+    """Generate synthetic login records with a mix of clean and problem rows."""
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1, 6, 0, 0)
+    rows = []
+    for idx in range(count):
+        reporttime = base + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        prev_hm = round(rng.uniform(1000, 20000), 2)
+        hm = prev_hm + rng.choice([0, 0, 0, 0.2, 1.5, -0.5])
+        next_hm = hm + rng.choice([0, 4.5, 8.0, 11.9, 13.0, -1.0])
+        logged_out = rng.random() > 0.05
+        rows.append({
+            'MOBILEID': f'DT{idx % 400:04d}',
+            'prev_hm': prev_hm if rng.random() > 0.02 else None,
+            'hm': hm,
+            'next_hm': next_hm if logged_out else None,
+            'reporttime': reporttime,
+            'next_reporttime': reporttime + timedelta(hours=11) if logged_out else None,
+            'opr_shift': rng.choice(['1', '2', '3', '6', '7']),
+        })
+    return rows
+
+
+def same(a, b) -> bool:
+    if isinstance(a, float) and isinstance(b, float):
+        return abs(a - b) < 1e-6 or (a != a and b != b)
+    if a is None and isinstance(b, float):
+        return b != b
+    return a == b
+
+
+def main(count: int = 100_000):
+    rows = generate_rows(count)
+
+    start = time.perf_counter()
+    batch = HmBatch.from_rows(rows)
+    loaded = time.perf_counter()
+    result = validate_batch(batch, BENCH_WINDOWS)
+    validated = time.perf_counter()
+
+    reference = [validate_row(r, BENCH_WINDOWS) for r in rows]
+    scalar_done = time.perf_counter()
+
+    mismatches = 0
+    for idx, expected in enumerate(reference):
+        for col, val in expected.items():
+            got = result[col][idx]
+            got = got.item() if hasattr(got, 'item') else got
+            if not same(val, got):
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"Mismatch row {idx} column {col}: vectorized={got!r} reference={val!r}")
+
+    print(f"Rows:               {count}")
+    print(f"Load into arrays:   {(loaded - start) * 1000:.1f} ms")
+    print(f"Vectorized checks:  {(validated - loaded) * 1000:.1f} ms")
+    print(f"Row-at-a-time:      {(scalar_done - validated) * 1000:.1f} ms")
+    print(f"Mismatches:         {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -0,0 +1,94 @@
+"""
+Benchmark the per-request decode cost of the compiled timesheet schemas
+against the hand-written parsing the endpoints used before.
+The legacy update_hm path checked three keys and nothing else, so the schema,
+which validates every field, costs a few microseconds more there.
+"""
+import sys
+import os
+import timeit
+from datetime import datetime
+
+# Add parent directory to path so we can import timesheet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timesheet import schemas
+
+
+ADD_TRIP_PAYLOAD = {
+    'reportTime': '2024-01-15T10:30:00.000',
+    'equipmentNo': 'DT1234',
+    'operatorId': '12345',
+    'oprShift': '1',
+    'loaderId': 'EX001',
+    'posName': 'PIT A',
+    'distance': '2.5',
+}
+
+UPDATE_SHIFT_PAYLOAD = {
+    'id': 101,
+    'next_id': 102,
+    'reporttime': '2024-01-15T06:02:11',
+    'next_reporttime': '2024-01-15T17:55:40',
+    'mobileid': 'DT1234',
+    'opr_nrp': '12345',
+    'hm': 1200.5,
+    'next_hm': 1211.2,
+    'opr_shift': '6',
+    'new_shift': '1',
+}
+
+UPDATE_HM_PAYLOAD = {'id': 101, 'opr_nrp': '12345', 'hm': 1200.5, 'new_hm': '1200.7', 'opr_shift': '6'}
+
+
+def legacy_parse(value):
+    if 'T' in value:
+        return datetime.strptime(value.split('.')[0], '%Y-%m-%dT%H:%M:%S')
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+def legacy_add_trip(data):
+    report_time = data.get('reportTime', '')
+    mobile_id = data.get('equipmentNo', '')
+    opr_nrp = data.get('operatorId', '')
+    if not report_time or not mobile_id or not opr_nrp:
+        return None
+    report_time_dt = legacy_parse(report_time)
+    return (report_time_dt.strftime('%Y-%m-%d %H:%M:%S'), mobile_id, opr_nrp,
+            data.get('oprShift') or None, data.get('loaderId') or None,
+            data.get('posName') or None, data.get('distance') or None)
+
+
+def legacy_update_shift(data):
+    new_shift = data.get('new_shift', '').strip()
+    if not data.get('id') or new_shift not in ['6', '7', '1', '2', '3']:
+        return None
+    return (legacy_parse(data['reporttime']), legacy_parse(data['next_reporttime']), new_shift)
+
+
+def legacy_update_hm(data):
+    if not data.get('id') or not data.get('opr_nrp') or data.get('new_hm') is None:
+        return None
+    return float(data['new_hm'])
+
+
+def new_add_trip(data):
+    values = schemas.ADD_TRIP.decode(data)
+    return values['reportTime'].isoformat(sep=' ')
+
+
+def main(number: int = 50_000):
+    cases = [
+        ('add_trip', legacy_add_trip, new_add_trip, ADD_TRIP_PAYLOAD),
+        ('update_shift', legacy_update_shift, schemas.UPDATE_SHIFT.decode, UPDATE_SHIFT_PAYLOAD),
+        ('update_hm', legacy_update_hm, schemas.UPDATE_HM.decode, UPDATE_HM_PAYLOAD),
+    ]
+    print(f"{'endpoint':<14}{'legacy us/req':>16}{'schema us/req':>16}")
+    for name, legacy, compiled, payload in cases:
+        legacy_us = timeit.timeit(lambda: legacy(payload), number=number) / number * 1e6
+        schema_us = timeit.timeit(lambda: compiled(payload), number=number) / number * 1e6
+        print(f"{name:<14}{legacy_us:>16.2f}{schema_us:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
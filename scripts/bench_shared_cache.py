@@ -0,0 +1,168 @@
+"""
+Benchmark the shared cross-worker cache against a per-process LRU cache.
+Several worker processes replay the same skewed stream of step 3 / trip reads
+with occasional HM writes. Reports database calls, hit latency, stale reads
+served after a write in another worker, and memory held by the cache.
+
+Usage:
+    python scripts/bench_shared_cache.py [--workers 4] [--requests 500] [--db-ms 50]
+"""
+import sys
+import os
+import argparse
+import multiprocessing
+import pickle
+import random
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Add parent directory to path so we can import timesheet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timesheet.shared_cache import SharedCache, serialize
+
+
+COLUMNS = ['MOBILEID', 'opr_username', 'opr_shift', 'reporttime', 'prev_hm', 'hm', 'next_hm',
+           'next_reporttime', 'TOTAL_HM', 'HM_LONCAT', 'is_logout', 'is_salah_shift']
+
+
+def make_result(key: str, version: int, rows: int) -> dict:
+    """Build a step 3 style result; `version` is embedded so stale reads can be detected."""
+    rng = random.Random(key)
+    base = datetime(2024, 1, 1, 6, 0, 0)
+    result_rows = []
+    for idx in range(rows):
+        reporttime = base + timedelta(minutes=rng.randint(0, 60 * 24))
+        hm = round(rng.uniform(1000, 20000), 2)
+        result_rows.append(dict(zip(COLUMNS, [
+            f'DT{idx % 300:04d}', f'OPR{rng.randint(1, 500):05d}', rng.choice('12367'),
+            reporttime.isoformat(), hm - 0.1, hm, hm + 10.5,
+            (reporttime + timedelta(hours=11)).isoformat(), 10.5, 0.1, 1, 0,
+        ])))
+    return {'version': version, 'columns': COLUMNS, 'rows': result_rows}
+
+
+class LocalLRU:
+    """The per-process alternative: an OrderedDict LRU under the same byte budget."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key, value, ttl=None, tag=None):
+        size = len(serialize(value))
+        self.entries[key] = (value, size, tag)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, old_size, _) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+
+    def get_or_compute(self, key, compute, ttl=None, tag=None):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, tag=tag)
+        return value
+
+    def invalidate_tags(self, tags):
+        for key in [k for k, v in self.entries.items() if v[2] in tags]:
+            self.bytes -= self.entries.pop(key)[1]
+
+
+def worker(kind, cache_path, budget, seed, args, version, queue):
+    """Replay the request stream against one cache implementation and report counters."""
+    rng = random.Random(seed)
+    cache = SharedCache(cache_path, size_bytes=budget) if kind == 'shared' else LocalLRU(budget)
+    keys = [f'trips:DT{i:04d}' for i in range(args.keys)] + ['step3']
+    weights = [1.0 / (i + 1) for i in range(args.keys)] + [args.keys / 4]
+    db_calls = stale = 0
+    hit_times = []
+
+    def query(key, current):
+        nonlocal db_calls
+        time.sleep(args.db_ms / 1000)
+        db_calls += 1
+        return make_result(key, current, args.rows if key == 'step3' else args.rows // 10)
+
+    for _ in range(args.requests):
+        if rng.random() < args.write_ratio:
+            with version.get_lock():
+                version.value += 1
+            cache.invalidate_tags(('step3', 'trips'))
+            continue
+        key = rng.choices(keys, weights)[0]
+        current = version.value
+        calls = db_calls
+        started = time.perf_counter()
+        value = cache.get_or_compute(key, lambda: query(key, current), tag=key.split(':')[0])
+        if db_calls == calls:
+            hit_times.append(time.perf_counter() - started)
+            if value['version'] < current:
+                stale += 1
+    held = cache.stats()['live_bytes'] if kind == 'shared' else cache.bytes
+    queue.put((db_calls, stale, hit_times, held))
+
+
+def run(kind, args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench-cache.bin')
+    version = multiprocessing.Value('q', 0)
+    queue = multiprocessing.Queue()
+    budget = args.budget_mb * 1024 * 1024
+    if kind == 'shared':
+        SharedCache(path, size_bytes=budget).close()
+    started = time.perf_counter()
+    procs = [multiprocessing.Process(target=worker, args=(kind, path, budget, seed, args, version, queue))
+             for seed in range(args.workers)]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    wall = time.perf_counter() - started
+    hits = sorted(t for r in results for t in r[2])
+    held = max(r[3] for r in results) if kind == 'shared' else sum(r[3] for r in results)
+    return {
+        'wall_s': wall,
+        'db_calls': sum(r[0] for r in results),
+        'stale': sum(r[1] for r in results),
+        'hits': len(hits),
+        'hit_p50_us': hits[len(hits) // 2] * 1e6 if hits else 0.0,
+        'hit_p99_us': hits[int(len(hits) * 0.99)] * 1e6 if hits else 0.0,
+        'held_mb': held / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared cache vs per-process cache benchmark')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per worker')
+    parser.add_argument('--keys', type=int, default=200, help='Distinct trip queries')
+    parser.add_argument('--rows', type=int, default=2000, help='Rows in a step 3 result')
+    parser.add_argument('--db-ms', type=float, default=50.0, help='Simulated database latency')
+    parser.add_argument('--write-ratio', type=float, default=0.01)
+    parser.add_argument('--budget-mb', type=int, default=16)
+    args = parser.parse_args()
+
+    sample = make_result('step3', 0, args.rows)
+    print(f"step 3 result with {args.rows} rows: pickle {len(pickle.dumps(sample)) / 1024:.0f} KB, "
+          f"cache format {len(serialize(sample)) / 1024:.0f} KB")
+    print(f"{'cache':<10}{'wall s':>8}{'db calls':>10}{'stale':>8}{'hits':>8}"
+          f"{'hit p50 us':>12}{'hit p99 us':>12}{'held MB':>10}")
+    for kind in ('local', 'shared'):
+        r = run(kind, args)
+        print(f"{kind:<10}{r['wall_s']:>8.2f}{r['db_calls']:>10}{r['stale']:>8}{r['hits']:>8}"
+              f"{r['hit_p50_us']:>12.1f}{r['hit_p99_us']:>12.1f}{r['held_mb']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Measure the per-call cost of the trip read and HM update procedures three ways:
+  connect per call   a new connection and cursor per call with the inline SQL
+                     text the routes used to build (the old behavior)
+  pooled, inline     one pooled connection, a new cursor per call, inline SQL
+  pooled, prepared   one pooled connection and the registered statement,
+                     prepared once and reused (config/statements.py)
+
+Runs against the database configured in .env (--site picks one of DB_SITES). The HM path writes, so it only
+runs when --hm-id is given, and every HM call is rolled back.
+
+Usage:
+    python scripts/bench_statements.py --unit DT101 --date 2024-01-15 [--shift S01]
+        [--hm-id 123456 --nrp 12345 --hm 10234.5] [--calls 200] [--site north]
+"""
+import sys
+import os
+import argparse
+import statistics
+import time
+
+# Add parent directory to path so we can import config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+
+# The statement texts as the routes wrote them before the registry
+INLINE_TRIPS = "EXECUTE dbo.miosphere_dtv_get_trip_by_unit @date = ?, @shift_code = ?, @mobileid = ?"
+INLINE_HM_UPDATE = """
+        EXEC dbo.miosphere_dtv_insert_login_update
+            @id = ?,
+            @b_nrp = ?,
+            @a_nrp = ?,
+            @b_hm = ?,
+            @a_hm = ?,
+            @b_shift = ?,
+            @a_shift = ?,
+            @remark = 'hm_update',
+            @updated_by = 'dispatcher'
+        """
+
+
+def measure(fn, calls: int) -> list:
+    fn()  # warm-up, not counted
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(path: str, results: dict) -> None:
+    baseline = statistics.mean(results['connect per call'])
+    print(f"\n{path}")
+    print(f"  {'mode':<20}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'saved':>9}")
+    for mode, timings in results.items():
+        timings = sorted(timings)
+        mean = statistics.mean(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"  {mode:<20}{mean:>9.2f}{statistics.median(timings):>9.2f}{p95:>9.2f}"
+              f"{(baseline - mean) / baseline * 100:>8.0f}%")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Per-call cost of inline vs prepared procedure calls')
+    parser.add_argument('--unit', required=True, help='MOBILEID for the trip read')
+    parser.add_argument('--date', required=True, help='Trip date, YYYY-MM-DD')
+    parser.add_argument('--shift', default='S01')
+    parser.add_argument('--hm-id', help='Login row id for the HM update path (rolled back)')
+    parser.add_argument('--nrp', default='', help='Operator NRP of that login row')
+    parser.add_argument('--hm', type=float, default=0.0, help='Current HM of that login row')
+    parser.add_argument('--shift-code', default='1', help='opr_shift of that login row')
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--site', help='Database site (default: DB_DEFAULT_SITE)')
+    args = parser.parse_args()
+
+    # The benchmark borrows a single connection from the pool
+    os.environ.setdefault('DB_POOL_SIZE', '1')
+    from config import statements
+    from config.database import get_db_connection, open_connection, use_site
+    if args.site:
+        use_site(args.site.strip().lower())
+
+    trip_params = (args.date, args.shift, args.unit)
+    hm_params = (args.hm_id, args.nrp, args.nrp, args.hm, args.hm, args.shift_code, args.shift_code)
+
+    def inline_fresh_connection(sql, params, rollback):
+        conn = open_connection()
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        if cursor.description:
+            cursor.fetchall()
+        if rollback:
+            conn.rollback()
+        cursor.close()
+        conn.close()
+
+    pooled = get_db_connection()
+
+    def inline_pooled(sql, params, rollback):
+        cursor = pooled.cursor()
+        cursor.execute(sql, params)
+        if cursor.description:
+            cursor.fetchall()
+        if rollback:
+            pooled.rollback()
+        cursor.close()
+
+    def prepared(name, params, rollback):
+        with statements.run(pooled, name, *params) as cursor:
+            if cursor.description:
+                cursor.fetchall()
+        if rollback:
+            pooled.rollback()
+
+    paths = [('Trip read (miosphere_dtv_get_trip_by_unit)', INLINE_TRIPS, 'trips_by_unit', trip_params, False)]
+    if args.hm_id:
+        paths.append(('HM update (miosphere_dtv_insert_login_update, rolled back)', INLINE_HM_UPDATE,
+                      'login_update', hm_params + ('hm_update', 'dispatcher'), True))
+    else:
+        print("No --hm-id given; skipping the HM update path")
+
+    try:
+        for title, inline_sql, name, params, rollback in paths:
+            inline_args = params[:7] if name == 'login_update' else params
+            results = {
+                'connect per call': measure(lambda: inline_fresh_connection(inline_sql, inline_args, rollback),
+                                            args.calls),
+                'pooled, inline': measure(lambda: inline_pooled(inline_sql, inline_args, rollback), args.calls),
+                'pooled, prepared': measure(lambda: prepared(name, params, rollback), args.calls),
+            }
+            report(title, results)
+    finally:
+        pooled.rollback()
+        pooled.close()
+
+    print("\nStatement prepare/reuse counts:")
+    for name, counts in statements.stats().items():
+        print(f"  {name:<20}prepared {counts.get('prepared', 0):>5}  reused {counts.get('reused', 0):>6}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Compare the size and parse time of the current row-dict responses with the
+compact table format, for synthetic step 3 and trip results.
+Reports raw and gzip payload bytes, and the time to parse and decode the
+payload back into row objects in Python and, if `node` is on the PATH, with
+the decodeTable() the wizard itself uses.
+
+Usage:
+    python scripts/bench_wire_format.py [--rows 2000] [--repeat 20]
+"""
+import sys
+import os
+import argparse
+import gzip
+import json
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Add parent directory to path so we can import timesheet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timesheet.wire import decode_table, encode_table
+
+
+STEP3_COLUMNS = ['id', 'mig_type', 'MOBILEID', 'opr_nrp', 'opr_username', 'opr_shift', 'lgn_pattern',
+                 'prev_hm', 'hm', 'next_hm', 'TOTAL_HM', 'HM_LONCAT', 'reporttime', 'next_reporttime',
+                 'is_logout', 'is_salah_shift', 'is_loncat', 'is_sama', 'problem', 'data_valid']
+
+UTILS_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'static', 'js', 'timesheet_utils.js')
+
+# Loads timesheet_utils.js, then parses and decodes every payload file given on the command line
+NODE_BENCH = r"""
+const fs = require('fs'), vm = require('vm');
+vm.runInThisContext(fs.readFileSync(process.argv[2], 'utf8'));
+const repeat = Number(process.argv[3]);
+const out = {};
+for (const file of process.argv.slice(4)) {
+    const text = fs.readFileSync(file, 'utf8');
+    let best = Infinity;
+    for (let i = 0; i < repeat; i++) {
+        const t = process.hrtime.bigint();
+        const body = JSON.parse(text);
+        const rows = decodeTable(body.rows);
+        if (!rows.length) throw new Error('no rows');
+        best = Math.min(best, Number(process.hrtime.bigint() - t) / 1e6);
+    }
+    out[file] = best;
+}
+console.log(JSON.stringify(out));
+"""
+
+
+def step3_rows(count: int, rng: random.Random):
+    base = datetime(2024, 1, 1, 6, 0, 0)
+    operators = [(f'{rng.randint(10000, 99999)}', f'OPERATOR {i:03d}') for i in range(300)]
+    rows = []
+    for idx in range(count):
+        nrp, name = rng.choice(operators)
+        reporttime = base + timedelta(minutes=rng.randint(0, 60 * 24))
+        hm = round(rng.uniform(1000, 20000), 1)
+        rows.append(dict(zip(STEP3_COLUMNS, [
+            1_000_000 + idx, rng.choice(['HD785', 'HD465', 'PC2000']), f'DT{idx % 400:04d}', nrp, name,
+            rng.choice('12367'), rng.choice(['DS', 'NS']), round(hm - 0.1, 1), hm, round(hm + 10.5, 1),
+            10.5, 0.1, reporttime.isoformat(), (reporttime + timedelta(hours=11)).isoformat(),
+            None, None, None, None, None, rng.choice(['VALID', 'NOT VALID']),
+        ])))
+    return rows
+
+
+def trip_rows(count: int, rng: random.Random):
+    base = datetime(2024, 1, 1, 6, 0, 0)
+    operators = [(f'{rng.randint(10000, 99999)}', f'OPERATOR {i:03d}') for i in range(4)]
+    rows = []
+    for idx in range(count):
+        nrp, name = rng.choice(operators)
+        rows.append({
+            'id': str(5_000_000 + idx), 'reportTime': (base + timedelta(minutes=idx * 3)).isoformat(),
+            'equipmentNo': 'DT0101', 'operatorId': nrp, 'operatorName': name, 'oprShift': 'S01',
+            'loaderId': rng.choice(['EX201', 'EX202']), 'posName': rng.choice(['PIT A', 'PIT B', 'DUMP 3']),
+            'distance': round(rng.uniform(1, 5), 2), 'note': '', 'recordType': 'trip',
+        })
+    return rows
+
+
+def dumps(body) -> str:
+    # The same separators jsonify uses outside debug mode
+    return json.dumps(body, separators=(',', ':'))
+
+
+def python_parse_ms(text: str, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = decode_table(json.loads(text)['rows'])
+        best = min(best, time.perf_counter() - started)
+    assert rows
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Row-dict vs compact table payloads')
+    parser.add_argument('--rows', type=int, default=2000, help='Rows per step 3 result')
+    parser.add_argument('--trips', type=int, default=300, help='Trips per trip result')
+    parser.add_argument('--repeat', type=int, default=20, help='Parse timings keep the best of this many runs')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    datasets = [('step3', step3_rows(args.rows, rng), STEP3_COLUMNS), ('trips', trip_rows(args.trips, rng), None)]
+    node = shutil.which('node')
+    workdir = tempfile.mkdtemp(prefix='wire-bench-')
+    results = []
+    for name, rows, columns in datasets:
+        variants = {
+            'row dicts': {'success': True, 'rows': rows},
+            'compact rows': {'success': True, 'rows': encode_table(rows, columns, 'rows')},
+            'compact columns': {'success': True, 'rows': encode_table(rows, columns, 'columns')},
+        }
+        for variant, body in variants.items():
+            text = dumps(body)
+            assert decode_table(json.loads(text)['rows']) == json.loads(dumps(rows)), variant
+            path = os.path.join(workdir, f'{name}-{variant.replace(" ", "-")}.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            results.append({'dataset': name, 'variant': variant, 'path': path,
+                            'bytes': len(text.encode('utf-8')),
+                            'gzip': len(gzip.compress(text.encode('utf-8'), 6)),
+                            'python_ms': python_parse_ms(text, args.repeat)})
+
+    if node:
+        script = os.path.join(workdir, 'bench.js')
+        with open(script, 'w', encoding='utf-8') as f:
+            f.write(NODE_BENCH)
+        out = subprocess.run([node, script, UTILS_JS, str(args.repeat)] + [r['path'] for r in results],
+                             capture_output=True, text=True, check=True).stdout
+        timings = json.loads(out)
+        for result in results:
+            result['js_ms'] = timings[result['path']]
+    shutil.rmtree(workdir)
+
+    print(f"{'result':<8}{'format':<17}{'bytes':>10}{'gzip':>9}{'python ms':>11}{'js ms':>8}")
+    for result in results:
+        js = f"{result['js_ms']:.2f}" if 'js_ms' in result else 'n/a'
+        print(f"{result['dataset']:<8}{result['variant']:<17}{result['bytes']:>10}{result['gzip']:>9}"
+              f"{result['python_ms']:>11.2f}{js:>8}")
+    if not node:
+        print("node not found; JavaScript parse times skipped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Capture the output of dbo.miosphere_dtv_get_realtime_hm_validation as a
+fixture for the parity test in tests/test_hm_validation.py. Only the input
+columns of the validation engine and the flags the procedure computed are
+kept, so the fixture holds no operator names or NRPs.
+
+Usage:
+    python scripts/capture_hm_fixture.py [--limit 5000] [--out tests/fixtures/realtime_hm_validation.json]
+"""
+import sys
+import os
+import argparse
+import json
+
+# Add parent directory to path so we can import config and timesheet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+
+FIXTURE_COLUMNS = ['MOBILEID', 'opr_shift', 'lgn_pattern', 'prev_hm', 'hm', 'next_hm', 'reporttime',
+                   'next_reporttime', 'TOTAL_HM', 'HM_LONCAT', 'is_logout', 'is_salah_shift', 'is_ftw',
+                   'is_loncat', 'is_sama']
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Capture procedure HM validation output as a test fixture')
+    parser.add_argument('--limit', type=int, default=5000, help='Rows to keep (default: 5000)')
+    parser.add_argument('--out', default=os.path.join('tests', 'fixtures', 'realtime_hm_validation.json'))
+    args = parser.parse_args()
+
+    from timesheet import queries
+    result = queries.fetch_realtime_hm_validation()
+    if not result:
+        print("The procedure returned no result set")
+        return 1
+    missing = [col for col in FIXTURE_COLUMNS if col not in result['columns']]
+    if missing:
+        print(f"The procedure output lacks {', '.join(missing)}")
+        return 1
+    rows = [{col: row.get(col) for col in FIXTURE_COLUMNS} for row in result['rows'][:args.limit]]
+    fixture = {
+        'procedure': 'dbo.miosphere_dtv_get_realtime_hm_validation',
+        # The windows the engine must be configured with for is_salah_shift to match
+        'shift_windows': os.getenv('HM_SHIFT_WINDOWS', ''),
+        'rows': rows,
+    }
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(fixture, f, default=str, indent=1)
+    print(f"Wrote {len(rows)} rows to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
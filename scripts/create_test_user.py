@@ -8,28 +8,29 @@ import os
 # Add parent directory to path so we can import config
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config.database import get_db_connection
-import hashlib
+from config.database import get_sites, get_users_connection
+from config.users import hash_password, insert_user, user_site, validate_new_user
 
 
-def create_user(username: str, password: str):
-    """Create a user in the database."""
+def create_user(username: str, password: str, site: str = None):
+    """Create a user in the database; with several sites the user belongs to `site`."""
+    site = user_site(site)
+    # The full name is required; use the username, upper-cased like /register does
+    fullname = username.upper()
+    error = validate_new_user(username, password, fullname, site)
+    if error:
+        print(f"Error creating user: {error}")
+        return
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        
-        cursor.execute(
-            "INSERT INTO miosphere_users (username, password) VALUES (?, ?)",
-            (username, hashed_password)
-        )
-        conn.commit()
+        conn = get_users_connection()
+        try:
+            cursor = conn.cursor()
+            insert_user(cursor, username, hash_password(password), fullname, site)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
         print(f"User '{username}' created successfully!")
-        
-        cursor.close()
-        conn.close()
-        
     except Exception as e:
         print(f"Error creating user: {e}")
 
@@ -39,9 +40,11 @@ if __name__ == '__main__':
     print("=" * 30)
     username = input("Enter username: ").strip()
     password = input("Enter password: ").strip()
+    sites = get_sites()
+    site = input(f"Enter site ({', '.join(sites.sites)}): ").strip() if sites.multi_site else None
     
     if username and password:
-        create_user(username, password)
+        create_user(username, password, site)
     else:
         print("Username and password are required!")
 
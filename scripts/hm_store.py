@@ -0,0 +1,73 @@
+"""
+Maintain the local HM history store.
+
+Usage:
+    python scripts/hm_store.py stats [--site north]
+    python scripts/hm_store.py compact [--site north]
+    python scripts/hm_store.py rebuild [--site north] [--units DT101,DT102]
+
+`rebuild` replaces the store with readings fetched fresh from SQL Server: the
+current step 3 validation rows plus the login history of every unit in them
+(or of the units given with --units). Each database site has its own store;
+--site picks one of DB_SITES (default: DB_DEFAULT_SITE).
+"""
+import sys
+import os
+import argparse
+import json
+
+# Add parent directory to path so we can import config and timesheet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+
+def rebuild(store, units_arg):
+    from timesheet import queries
+    from timesheet.hm_store import readings_from_logins, readings_from_step3
+
+    readings = []
+    result = queries.fetch_realtime_hm_validation()
+    step3_rows = result['rows'] if result else []
+    readings.extend(readings_from_step3(step3_rows))
+
+    if units_arg:
+        units = [u.strip() for u in units_arg.split(',') if u.strip()]
+    else:
+        units = sorted({row.get('MOBILEID') for row in step3_rows if row.get('MOBILEID')})
+    for count, mobileid in enumerate(units, 1):
+        readings.extend(readings_from_logins(queries.fetch_latest_login(mobileid)))
+        print(f"\r{count}/{len(units)} units fetched, {len(readings)} readings", end='', flush=True)
+    print()
+    return store.rebuild(readings)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Maintain the local HM history store')
+    parser.add_argument('command', choices=['stats', 'compact', 'rebuild'])
+    parser.add_argument('--units', help='Comma-separated MOBILEIDs to rebuild (default: units in step 3)')
+    parser.add_argument('--site', help='Database site whose store to maintain (default: DB_DEFAULT_SITE)')
+    args = parser.parse_args()
+
+    from config.database import current_site, use_site
+    from timesheet.hm_store import HmStore
+    # rebuild reads from this site's database
+    use_site(args.site.strip().lower() if args.site else None)
+    store = HmStore.from_env(current_site())
+    if store is None:
+        print("HM store is disabled (HM_STORE_ENABLED).")
+        return 1
+
+    if args.command == 'compact':
+        stats = store.compact()
+    elif args.command == 'rebuild':
+        stats = rebuild(store, args.units)
+    else:
+        stats = store.stats()
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
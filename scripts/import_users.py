@@ -0,0 +1,84 @@
+"""
+Create many user accounts at once from a CSV or JSON file.
+Existing usernames are looked up with a single query and new accounts are
+inserted in chunks with fast_executemany; nothing is inserted for rows that
+fail validation. A result line is written for every input row.
+
+Usage:
+    python scripts/import_users.py users.csv [--report results.csv]
+        [--chunk-size 500] [--dry-run] [--site north]
+
+CSV files need a header with username, password and fullname columns; JSON
+files hold a list of objects with the same keys. With several sites (DB_SITES)
+every account needs a site: a site column in the file, or --site for the rows
+without one. Rows with no site or an unknown one are reported as invalid.
+"""
+import sys
+import os
+import argparse
+import csv
+import json
+import time
+from collections import Counter
+
+# Add parent directory to path so we can import config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+
+def read_users(path):
+    """Read user rows, numbering them by their line (CSV) or position (JSON) in the file."""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise ValueError('JSON input must be a list of user objects')
+        return [dict(user, line=idx) for idx, user in enumerate(data, 1)]
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = {'username', 'password', 'fullname'} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(sorted(missing))}")
+        # Line 1 is the header
+        return [dict(row, line=idx) for idx, row in enumerate(reader, 2)]
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Bulk-create users from CSV or JSON')
+    parser.add_argument('input')
+    parser.add_argument('--report', help='Write per-row results to this CSV (default: <input>.results.csv)')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Rows per INSERT transaction')
+    parser.add_argument('--dry-run', action='store_true', help='Validate and check usernames only')
+    parser.add_argument('--site', help='Site of rows without a site column (with several DB_SITES)')
+    args = parser.parse_args()
+
+    from config.users import bulk_create_users
+
+    try:
+        users = read_users(args.input)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read {args.input}: {e}")
+        return 1
+
+    started = time.perf_counter()
+    results = bulk_create_users(users, chunk_size=args.chunk_size,
+                                dry_run=args.dry_run, site=args.site)
+    elapsed = time.perf_counter() - started
+
+    report = args.report or os.path.splitext(args.input)[0] + '.results.csv'
+    with open(report, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['line', 'username', 'status', 'message'])
+        writer.writeheader()
+        writer.writerows(results)
+
+    counts = Counter(r['status'] for r in results)
+    print(f"{len(results)} rows in {elapsed:.2f}s: "
+          + ', '.join(f"{count} {status}" for status, count in counts.most_common()))
+    print(f"Results written to {report}")
+    return 0 if counts.get('failed', 0) == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Replay a recorded shift of traffic against the current code.
+The recording (made with DB_RECORD_FILE) supplies both the /api requests and the
+database responses, so no SQL Server is needed. Prints latency and throughput
+and can compare them with the report of an earlier build.
+
+Pass the DB_RECORD_FILE path: the files the worker processes recorded
+(recording.jsonl.<pid>.gz) are merged in timestamp order. --merge also writes
+the merged recording to one file.
+
+Usage:
+    python scripts/replay_traffic.py recording.jsonl.gz [--latency-scale 1.0]
+        [--concurrency 4] [--report out.json] [--baseline previous.json] [--merge merged.jsonl.gz]
+"""
+import sys
+import os
+import argparse
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict
+
+# Add parent directory to path so we can import the app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(max(latencies), 3) if latencies else 0.0,
+    }
+
+
+def replay_session(app, requests, results, lock):
+    """Replay one user's requests in their original order on a dedicated client."""
+    client = app.test_client()
+    first = requests[0]
+    with client.session_transaction() as sess:
+        sess['user_id'] = first.get('user_id') or 0
+        sess['username'] = first.get('username') or 'replay'
+        sess['fullname'] = 'REPLAY'
+    for req in requests:
+        started = time.perf_counter()
+        if req['method'] == 'GET':
+            response = client.get(req['path'], query_string=req.get('args') or {})
+        else:
+            response = client.open(req['path'], method=req['method'],
+                                   query_string=req.get('args') or {}, json=req.get('json'))
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            results.append((req['path'], response.status_code, elapsed, req.get('status'), req.get('ms')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded traffic against this build')
+    parser.add_argument('recording')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='Multiply recorded DB latencies (0 disables the delays)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of recorded sessions replayed at the same time')
+    parser.add_argument('--report', help='Write the JSON report to this file')
+    parser.add_argument('--baseline', help='Compare against a report from an earlier build')
+    parser.add_argument('--merge', help='Also write the merged recording to this gzip file')
+    args = parser.parse_args()
+
+    from config.db_replay import load_recording, recording_files
+    files = recording_files(args.recording)
+    if not files:
+        parser.error(f'no recording found at {args.recording}')
+    if len(files) > 1:
+        print(f"Merging {len(files)} per-process recordings")
+    if args.merge:
+        with gzip.open(args.merge, 'wt', encoding='utf-8') as f:
+            for entry in load_recording(args.recording):
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    os.environ.pop('DB_RECORD_FILE', None)
+    os.environ['DB_REPLAY_FILE'] = args.recording
+    os.environ['DB_REPLAY_LATENCY_SCALE'] = str(args.latency_scale)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('PREFETCH_ENABLED', 'no')
+    os.environ.setdefault('SHARED_CACHE_ENABLED', 'no')
+
+    from app import app
+    from config.db_replay import get_replay_store
+
+    store = get_replay_store()
+    sessions = defaultdict(list)
+    for req in store.requests:
+        sessions[req.get('user_id')].append(req)
+    if not sessions:
+        print("Recording contains no requests to replay.")
+        return 1
+
+    results = []
+    lock = threading.Lock()
+    pending = list(sessions.values())
+    started = time.perf_counter()
+    while pending:
+        batch, pending = pending[:args.concurrency], pending[args.concurrency:]
+        threads = [threading.Thread(target=replay_session, args=(app, reqs, results, lock)) for reqs in batch]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    wall = time.perf_counter() - started
+
+    by_path = defaultdict(list)
+    for path, status, elapsed, _, _ in results:
+        by_path[path].append(elapsed)
+    report = {
+        'recording': os.path.basename(args.recording),
+        'latency_scale': args.latency_scale,
+        'concurrency': args.concurrency,
+        'requests': len(results),
+        'errors': sum(1 for r in results if r[1] >= 500),
+        'status_changed': sum(1 for r in results if r[3] is not None and r[1] != r[3]),
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(results) / wall, 2) if wall else 0.0,
+        'overall': summarize([r[2] for r in results]),
+        'recorded': summarize([r[4] for r in results if r[4] is not None]),
+        'endpoints': {path: summarize(lat) for path, lat in sorted(by_path.items())},
+        'db': dict(store.stats),
+    }
+
+    print(f"Replayed {report['requests']} requests in {report['wall_s']}s "
+          f"({report['throughput_rps']} req/s), {report['errors']} errors, "
+          f"{report['status_changed']} status changes")
+    print(f"DB calls: {report['db']}")
+    print(f"{'endpoint':<40}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for path, stats in report['endpoints'].items():
+        print(f"{path:<40}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print("\nCompared with baseline:")
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = baseline['overall'][key], report['overall'][key]
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"  {key:<8} {old:>10.2f} -> {new:>10.2f} ({change:+.1f}%)")
+        old, new = baseline['throughput_rps'], report['throughput_rps']
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {'req/s':<8} {old:>10.2f} -> {new:>10.2f} ({change:+.1f}%)")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,8 +24,36 @@ let timesheetState = {
 // Used when adding new trips manually
 let manualIdCounter = 0;
 
+// Wizard state the server embedded in the dashboard page (step 1/2 data and possibly
+// the first rows of step 3); each step uses its part once instead of fetching it
+let timesheetBootstrap = readTimesheetBootstrap();
+const timesheetBootstrapLoadedAt = Date.now();
+
+function readTimesheetBootstrap() {
+    const el = document.getElementById('timesheet-bootstrap');
+    if (!el) return null;
+    try {
+        return JSON.parse(el.textContent);
+    } catch (e) {
+        return null;
+    }
+}
+
+// Return the embedded data of a step ('step1', 'step2' or 'step3') and forget it,
+// or null if there is none or, for step 3, it has outlived its cache age
+function takeBootstrapStep(key) {
+    if (!timesheetBootstrap || !timesheetBootstrap[key]) return null;
+    const data = timesheetBootstrap[key];
+    timesheetBootstrap[key] = null;
+    if (key === 'step3') {
+        const ageSeconds = (Date.now() - timesheetBootstrapLoadedAt) / 1000;
+        if (ageSeconds > data.max_age_seconds) return null;
+    }
+    return data;
+}
+
 // Initialize the wizard - called when user clicks "Start"
-// This loads Step 1
+// This loads Step 1, from the embedded state on the first start
 function initTimesheetWizard() {
     loadStep(1);
 }
@@ -47,9 +47,10 @@ function showHistoricalPanel(id, mobileid) {
     }, 100);
 
     // Fetch historical data from server
-    fetch(`/api/timesheet/historical-login?mobileid=${encodeURIComponent(mobileid)}`)
+    fetch(`/api/timesheet/historical-login?mobileid=${encodeURIComponent(mobileid)}&format=compact&orient=columns`)
         .then(r => r.json())
         .then(data => {
+            if (data.success) data.rows = decodeTable(data.rows);
             if (!data.success || !data.rows || !Array.isArray(data.rows)) {
                 panel.querySelector('.panel-content').innerHTML = '<div class="empty-message">No historical data found.</div>';
                 return;
@@ -6,6 +6,14 @@
 
 // Load Step 1 data from server and render
 function loadStep1() {
+    const embedded = takeBootstrapStep('step1');
+    if (embedded) {
+        timesheetState.selectedDate = embedded.selectedDate || '';
+        timesheetState.selectedShifts = embedded.selectedShifts || [];
+        timesheetState.unitType = embedded.unitType || '3 Shift';
+        renderStep1();
+        return;
+    }
     // Fetch saved Step 1 data from server
     fetch('/api/timesheet/step1', { method: 'GET', headers: {'Content-Type': 'application/json'} })
         .then(r => r.json())
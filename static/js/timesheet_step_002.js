@@ -6,6 +6,14 @@
 
 // Load Step 2 data from server and render
 function loadStep2() {
+    const embedded = takeBootstrapStep('step2');
+    if (embedded) {
+        timesheetState.step2.equipmentNumber = embedded.equipmentNumber || '';
+        timesheetState.step2.operatorId = embedded.operatorId || '';
+        timesheetState.step2.trips = embedded.trips || [];
+        renderStep2();
+        return;
+    }
     // Fetch saved Step 2 data from server
     fetch('/api/timesheet/step2', { method: 'GET', headers: {'Content-Type': 'application/json'} })
         .then(r => r.json())
@@ -210,7 +218,9 @@ function fetchTrips() {
     const params = new URLSearchParams({
         equipment: equipmentNumber,
         date: timesheetState.selectedDate,
-        shifts: timesheetState.selectedShifts.join(',')
+        shifts: timesheetState.selectedShifts.join(','),
+        format: 'compact',
+        orient: 'columns'
     });
     
     // Add operator if provided
@@ -223,11 +233,12 @@ function fetchTrips() {
         .then(r => r.json())
         .then(data => {
             if (data.success) {
-                timesheetState.step2.trips = data.trips || [];
+                timesheetState.step2.trips = decodeTable(data.trips) || [];
                 // Save operator name from first trip if available
                 const firstOp = timesheetState.step2.trips.find(t => t.operatorName && t.operatorName.trim() !== '');
                 if (firstOp) timesheetState.step2.operatorName = firstOp.operatorName;
                 renderStep2();
+                notifyIfStale(data);
             } else {
                 alert('Error fetching trips: ' + (data.message || 'Unknown error'));
             }
@@ -6,14 +6,24 @@
 
 // Load Step 3 data from server and render
 function loadStep3() {
+    const embedded = takeBootstrapStep('step3');
+    if (embedded) {
+        timesheetState.step3 = decodeTable(embedded.rows) || [];
+        timesheetState.step3_columns = embedded.columns || [];
+        renderStep3();
+        notifyIfStale(embedded);
+        // Only the first rows were embedded; fetch the full table behind them
+        if (!embedded.truncated) return;
+    }
     // Fetch realtime HM validation data from server
-    fetch('/api/timesheet/step3', { method: 'GET', headers: {'Content-Type': 'application/json'} })
+    fetch('/api/timesheet/step3?format=compact&orient=columns', { method: 'GET', headers: {'Content-Type': 'application/json'} })
         .then(r => r.json())
         .then(data => {
             if (data.success) {
                 // Store data in state
-                timesheetState.step3 = data.rows || [];
+                timesheetState.step3 = decodeTable(data.rows) || [];
                 timesheetState.step3_columns = data.columns || [];
+                notifyIfStale(data);
             } else {
                 // Set empty arrays if fetch failed
                 timesheetState.step3 = [];
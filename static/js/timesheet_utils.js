@@ -64,3 +64,33 @@ function addOneMinute(dateTimeStr) {
     return formatDateTimeForDB(date);
 }
 
+
+// Warn when the server answered from its last good copy because the database is down
+// Input: API response with stale / stale_age_seconds fields
+function notifyIfStale(data) {
+    if (!data || !data.stale) return;
+    const minutes = Math.max(1, Math.round((data.stale_age_seconds || 0) / 60));
+    showNotification(`Database unavailable - showing data from ${minutes} min ago`, 'error');
+}
+
+// Turn a compact table (sent for ?format=compact) back into an array of row objects
+// Input: {format: 'compact', orient: 'rows'|'columns', columns, dictionaries, data}
+// Plain arrays are returned unchanged
+function decodeTable(table) {
+    if (!table || table.format !== 'compact') return table;
+    const columns = table.columns;
+    const data = table.orient === 'columns' ? table.data : columns.map((_, c) => table.data.map(row => row[c]));
+    // Resolve dictionary indexes one column at a time
+    const values = columns.map((col, c) => {
+        const strings = table.dictionaries[col];
+        return strings ? data[c].map(v => (v === null ? null : strings[v])) : data[c];
+    });
+    const count = values.length ? values[0].length : 0;
+    const rows = new Array(count);
+    for (let r = 0; r < count; r++) {
+        const row = {};
+        for (let c = 0; c < columns.length; c++) row[columns[c]] = values[c][r];
+        rows[r] = row;
+    }
+    return rows;
+}
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# Make the application packages importable when pytest runs from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """The Flask app module, with the HM store and shared cache off so tests leave no files behind."""
+    pytest.importorskip('pyodbc', exc_type=ImportError)
+    os.environ.setdefault('HM_STORE_ENABLED', 'no')
+    os.environ.setdefault('SHARED_CACHE_ENABLED', 'no')
+    import app
+    app.app.config['TESTING'] = True
+    return app
@@ -0,0 +1,110 @@
+"""Tests for Flask routes that do not need a database."""
+import json
+import re
+
+import pytest
+
+from timesheet.hm_store import SiteHmStores
+from timesheet.wire import decode_table
+
+from test_hm_store import login_rows
+
+
+@pytest.fixture
+def client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as s:
+        s.update(user_id=1, username='dispatcher')
+    return client
+
+
+def test_historical_login_is_answered_from_the_hm_store(app_module, client, tmp_path, monkeypatch):
+    stores = SiteHmStores(str(tmp_path))
+    monkeypatch.setattr(app_module, 'hm_stores', stores)
+    monkeypatch.setattr(app_module, 'HM_STORE_HISTORY_MAX_AGE', 30.0)
+    calls = []
+    monkeypatch.setattr(app_module.queries, 'fetch_latest_login',
+                        lambda mobileid: calls.append(mobileid) or login_rows(0, 4, unit=mobileid))
+
+    from_sql = client.get('/api/timesheet/historical-login?mobileid=DT101').get_json()
+    stores.writer('default').flush()
+    from_store = client.get('/api/timesheet/historical-login?mobileid=DT101').get_json()
+    assert calls == ['DT101']
+    assert from_store == from_sql and len(from_store['rows']) == 4
+
+    with app_module.app.test_request_context():
+        app_module.invalidate_reads()
+    client.get('/api/timesheet/historical-login?mobileid=DT101')
+    assert calls == ['DT101', 'DT101']
+    stores.writer('default').close()
+
+
+@pytest.mark.parametrize('limit', ['0', '-5'])
+def test_hm_history_rejects_non_positive_limits(app_module, client, tmp_path, monkeypatch, limit):
+    monkeypatch.setattr(app_module, 'hm_stores', SiteHmStores(str(tmp_path)))
+    response = client.get(f'/api/timesheet/hm-history?mobileid=DT101&limit={limit}')
+    assert response.status_code == 400
+    assert client.get('/api/timesheet/hm-history?mobileid=DT101&limit=5').get_json() == {'success': True, 'rows': []}
+
+
+def page_bootstrap(client):
+    page = client.get('/dashboard').get_data(as_text=True)
+    match = re.search(r'<script id="timesheet-bootstrap" type="application/json">(.*?)</script>', page, re.S)
+    return json.loads(match.group(1))
+
+
+@pytest.fixture
+def step3_queries(app_module, monkeypatch):
+    from timesheet.prefetch import Prefetcher
+    calls = []
+    monkeypatch.setattr(app_module, 'prefetcher', Prefetcher(max_inflight=1))
+    monkeypatch.setattr(app_module, 'BOOTSTRAP_STEP_DATA', True)
+    monkeypatch.setattr(app_module, 'BOOTSTRAP_ROWS', 2)
+    monkeypatch.setattr(app_module.queries, 'fetch_realtime_hm_validation', lambda: calls.append(1))
+    return calls
+
+
+def test_bootstrap_embeds_the_saved_steps(client, step3_queries):
+    assert page_bootstrap(client) == {'step1': {}, 'step2': {}}
+    step1 = {'selectedDate': '2024-01-01', 'selectedShifts': ['S01'], 'unitType': '3 Shift'}
+    step2 = {'equipmentNumber': 'DT101', 'operatorId': '', 'trips': []}
+    with client.session_transaction() as s:
+        s.update(timesheet_step1=step1, timesheet_step2=step2)
+    # The wizard starts at step 1 whatever was saved; step 3 is not cached, and not queried for
+    assert page_bootstrap(client) == {'step1': step1, 'step2': step2}
+    assert step3_queries == []
+
+
+def test_bootstrap_embeds_a_cached_step3_once_step2_is_saved(app_module, client, step3_queries):
+    result = {'columns': ['MOBILEID', 'hm'], 'rows': [{'MOBILEID': 'DT101', 'hm': float(i)} for i in range(3)]}
+    with client.session_transaction() as s:
+        s.update(prefetch_key='session-1', timesheet_step1={'selectedDate': '2024-01-01'})
+    app_module.prefetcher.schedule('session-1', ('step3',), lambda: (result, None))
+    for future, *_ in list(app_module.prefetcher._entries.values()):
+        future.result(timeout=5)
+    assert 'step3' not in page_bootstrap(client)
+
+    with client.session_transaction() as s:
+        s['timesheet_step2'] = {'equipmentNumber': 'DT101'}
+    step3 = page_bootstrap(client)['step3']
+    assert step3['columns'] == ['MOBILEID', 'hm']
+    assert decode_table(step3['rows']) == result['rows'][:2]
+    assert step3['truncated'] is True and step3['stale'] is False
+    assert 0 < step3['max_age_seconds'] <= app_module.READ_CACHE_TTL
+    assert step3_queries == []
+
+
+def test_historical_login_needs_a_session_before_any_site_routing(app_module, monkeypatch):
+    monkeypatch.setenv('DB_SITES', 'north,south')
+    monkeypatch.setenv('DB_SITE_SOUTH_MOBILEID_PREFIXES', 'S')
+    monkeypatch.setattr('config.database._sites', None)
+    routed, fetched = [], []
+    monkeypatch.setattr(app_module, 'use_site', routed.append)
+    monkeypatch.setattr(app_module.queries, 'fetch_latest_login', fetched.append)
+    try:
+        response = app_module.app.test_client().get('/api/timesheet/historical-login?mobileid=S101')
+    finally:
+        monkeypatch.setattr('config.database._sites', None)
+    assert response.status_code == 401
+    # Only the teardown's reset; the unit's prefix chose nothing
+    assert routed == [None] and fetched == []
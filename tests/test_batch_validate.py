@@ -0,0 +1,147 @@
+"""Tests for scripts/batch_validate.py."""
+import json
+import sys
+from datetime import datetime
+
+import pytest
+
+from scripts import batch_validate
+
+
+START = datetime(2024, 1, 1)
+END = datetime(2024, 1, 3)
+
+
+def login(id, reporttime, hm, status='Login', shift='1'):
+    return {'id': id, 'mobileid': 'DT101', 'opr_nrp': 'N1', 'opr_shift': shift, 'status': status,
+            'reporttime': reporttime, 'lgn_hourmeter': hm}
+
+
+def history():
+    return [
+        login(1, datetime(2023, 12, 31, 14), 100.0, 'Logout'),
+        login(2, datetime(2024, 1, 1, 6), 100.0),
+        login(3, datetime(2024, 1, 1, 14), 108.0, 'Logout'),
+        login(4, datetime(2024, 1, 2, 6), 108.0),
+        login(5, datetime(2024, 1, 2, 14), 140.0, 'Logout'),
+        login(6, datetime(2024, 1, 3, 6), 140.0),
+    ]
+
+
+def test_hm_problems_uses_total_bad_and_keeps_the_range():
+    logins, problems = batch_validate.hm_problems('DT101', history(), START, datetime(2024, 1, 3))
+    assert logins == 2
+    assert [(p['id'], p['problem']) for p in problems] == [(4, 'total hm')]
+    assert problems[0]['detail'].endswith('total_hm=32.0')
+
+
+def test_hm_problems_flags_a_login_without_logout():
+    logins, problems = batch_validate.hm_problems('DT101', history(), START, END + (END - START))
+    assert logins == 3
+    assert (6, 'belum logout') in [(p['id'], p['problem']) for p in problems]
+    assert [p['detail'] for p in problems if p['id'] == 6][0].endswith('total_hm=None')
+
+
+def test_hm_problems_without_logins_in_range():
+    assert batch_validate.hm_problems('DT101', history(), datetime(2025, 1, 1), datetime(2025, 2, 1)) == (0, [])
+
+
+def test_truncation_problem():
+    assert batch_validate.truncation_problem('DT101', history(), START) is None
+    assert batch_validate.truncation_problem('DT101', [], START) is None
+    problem = batch_validate.truncation_problem('DT101', history()[3:], START)
+    assert problem['problem'] == 'history truncated'
+    assert problem['reporttime'] == '2024-01-02T06:00:00'
+
+
+def test_trip_problems():
+    trips = [
+        {'id': '1', 'reportTime': '2024-01-01T07:00:00', 'operatorId': 'N1', 'loaderId': 'L1'},
+        {'id': '2', 'reportTime': '2024-01-01T07:00:00', 'operatorId': '', 'loaderId': 'L1'},
+        {'id': '3', 'reportTime': '2024-01-01T08:00:00', 'operatorId': 'N1', 'loaderId': ''},
+        {'id': '4', 'reportTime': '2024-01-01T09:00:00', 'operatorId': '', 'note': 'deleted'},
+        {'id': '5', 'reportTime': '2024-01-01T09:00:00', 'operatorId': '', 'recordType': 'standby'},
+    ]
+    problems = batch_validate.trip_problems('DT101', '2024-01-01', 'S01', trips)
+    assert [(p['id'], p['problem']) for p in problems] == [
+        ('2', 'no operator'), ('2', 'duplicate report time'), ('3', 'no loader')]
+    assert problems[0]['shift'] == 'S01' and problems[0]['date'] == '2024-01-01'
+
+
+def test_load_checkpoint_skips_failed_and_torn_records(tmp_path):
+    path = tmp_path / 'checkpoint.jsonl'
+    path.write_text(json.dumps({'unit': 'DT101', 'ok': True}) + '\n'
+                    + json.dumps({'unit': 'DT102', 'ok': False}) + '\n'
+                    + '{"unit": "DT103", "ok": tr', encoding='utf-8')
+    assert list(batch_validate.load_checkpoint(str(path))) == ['DT101']
+    # The next record starts on its own line, after the torn one
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'unit': 'DT103', 'ok': True}) + '\n')
+    assert sorted(batch_validate.load_checkpoint(str(path))) == ['DT101', 'DT103']
+    assert batch_validate.load_checkpoint(str(tmp_path / 'missing.jsonl')) == {}
+
+
+class InlinePool:
+    def __init__(self, processes, initializer=None, initargs=()):
+        self.initargs = initargs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def imap_unordered(self, func, tasks):
+        return map(func, tasks)
+
+
+def test_main_resumes_from_the_checkpoint(tmp_path, monkeypatch):
+    pytest.importorskip('pyodbc', exc_type=ImportError)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('HM_LOGIN_RANGE_PROCEDURE', raising=False)
+    monkeypatch.setattr(batch_validate.multiprocessing, 'Pool', InlinePool)
+    validated = []
+
+    def validate_unit(task):
+        unit = task[0]
+        validated.append(task)
+        if unit == 'DT103' and len(validated) == 2:
+            return {'unit': unit, 'ok': False, 'error': 'timeout'}
+        return {'unit': unit, 'ok': True, 'logins': 1, 'trips': 2, 'problems': [], 'seconds': 0.1}
+
+    monkeypatch.setattr(batch_validate, 'validate_unit', validate_unit)
+    argv = ['batch_validate.py', '--start', '2024-01-01', '--end', '2024-01-02', '--shifts', 'S01',
+            '--units', 'DT101,DT103', '--out', 'audit']
+    monkeypatch.setattr(sys, 'argv', argv)
+    assert batch_validate.main() == 1
+    assert [task[0] for task in validated] == ['DT101', 'DT103']
+    assert validated[0][1:] == ('2024-01-01', '2024-01-02', ['S01'], False)
+
+    # A second run only retries the unit that failed
+    assert batch_validate.main() == 0
+    assert [task[0] for task in validated] == ['DT101', 'DT103', 'DT103']
+    summary = json.loads((tmp_path / 'audit' / 'summary.json').read_text(encoding='utf-8'))
+    assert summary['units_validated'] == 2 and summary['logins_checked'] == 2
+
+    # The checkpoint belongs to this run's settings
+    monkeypatch.setattr(sys, 'argv', argv + ['--login-procedure', 'dbo.login_range'])
+    with pytest.raises(SystemExit):
+        batch_validate.main()
+
+
+def test_validate_unit_reads_the_range_with_a_margin(monkeypatch):
+    pytest.importorskip('pyodbc', exc_type=ImportError)
+    from timesheet import queries
+    calls = []
+    monkeypatch.setattr(queries, 'fetch_login_range',
+                        lambda unit, start, end, conn=None: calls.append((start, end)) or history())
+    monkeypatch.setattr(queries, 'fetch_latest_login', lambda unit, conn=None: history()[3:])
+    monkeypatch.setattr(queries, 'fetch_trips', lambda *args, **kwargs: [])
+
+    result = batch_validate.validate_unit(('DT101', '2024-01-01', '2024-01-02', ['S01'], True))
+    assert calls == [(datetime(2023, 12, 31), datetime(2024, 1, 4))]
+    assert result['ok'] and result['logins'] == 2 and result['trips'] == 0
+    assert 'history truncated' not in [p['problem'] for p in result['problems']]
+
+    result = batch_validate.validate_unit(('DT101', '2024-01-01', '2024-01-02', ['S01'], False))
+    assert result['problems'][0]['problem'] == 'history truncated'
@@ -0,0 +1,133 @@
+"""Tests for the database circuit breaker."""
+import contextvars
+import time
+
+import pytest
+
+pytest.importorskip('pyodbc', exc_type=ImportError)
+
+import pyodbc
+
+from config.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from config.database import TimedCursor
+
+
+class SlowStatementCursor:
+    def execute(self, sql, *params):
+        time.sleep(0.02)
+        return self
+
+    def fetchall(self):
+        return [(1,)]
+
+    def nextset(self):
+        return False
+
+
+def half_open_breaker(**kwargs):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=0, **kwargs)
+    breaker.record(1, pyodbc.OperationalError('08001', 'down'))
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+def test_fetches_do_not_dilute_the_slow_rate():
+    breaker = CircuitBreaker(slow_rate=0.8, slow_ms=10, min_calls=5)
+    cursor = TimedCursor(SlowStatementCursor(), breaker)
+    for _ in range(5):
+        cursor.execute('EXEC dbo.slow')
+        cursor.fetchall()
+        cursor.nextset()
+    assert breaker.stats()['state'] == OPEN
+
+
+def test_failed_fetch_counts_as_a_failure():
+    class FailingFetch(SlowStatementCursor):
+        def fetchall(self):
+            raise pyodbc.OperationalError('08S01', 'link failure')
+
+    breaker = CircuitBreaker(min_calls=2, failure_rate=0.5)
+    cursor = TimedCursor(FailingFetch(), breaker)
+    cursor.execute('EXEC dbo.proc')
+    with pytest.raises(pyodbc.OperationalError):
+        cursor.fetchall()
+    assert breaker.stats()['state'] == OPEN
+
+
+def test_cancelled_probe_lets_the_next_call_through():
+    breaker = half_open_breaker()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.cancel_call()
+    breaker.before_call()
+
+
+def test_probe_that_never_reports_expires():
+    breaker = half_open_breaker(slow_ms=20)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.03)
+    breaker.before_call()
+    assert breaker.stats()['probes_expired'] == 1
+
+
+def test_pool_timeout_releases_the_probe(monkeypatch):
+    from config import database
+
+    monkeypatch.setattr(database, '_sites', None)
+    site = database.get_sites().get(None)
+    monkeypatch.setattr(site, 'breaker', half_open_breaker())
+
+    def timeout():
+        raise database.PoolTimeout('default', 1.0)
+
+    monkeypatch.setattr(site.pool, 'acquire', timeout)
+    for _ in range(2):
+        with pytest.raises(database.PoolTimeout):
+            database.get_db_connection()
+    assert site.breaker.state == HALF_OPEN
+
+
+def test_only_the_probe_closes_the_circuit():
+    breaker = half_open_breaker()
+    # A statement that was running when the circuit opened reports late
+    breaker.record(1)
+    assert breaker.state == HALF_OPEN
+    assert breaker.stats()['ignored_half_open'] == 1
+    assert breaker.before_call() is not None
+    breaker.record(1)
+    assert breaker.state == CLOSED
+
+
+def test_late_failure_does_not_reopen_while_probing():
+    breaker = half_open_breaker()
+    breaker.record(1, pyodbc.OperationalError('08S01', 'link failure'))
+    assert breaker.stats()['opened'] == 1 and breaker.state == HALF_OPEN
+    breaker.before_call()
+    breaker.record(1, pyodbc.OperationalError('08S01', 'link failure'))
+    assert breaker.stats()['opened'] == 2
+
+
+def test_probe_outcome_belongs_to_its_context():
+    breaker = half_open_breaker()
+    contextvars.Context().run(breaker.before_call)
+    # Another request finishing a statement is not the probe
+    breaker.record(1)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_expired_probe_reporting_late_is_ignored():
+    breaker = half_open_breaker(slow_ms=20)
+    context = contextvars.Context()
+    probe = context.run(breaker.before_call)
+    assert probe is not None
+    time.sleep(0.03)
+    assert breaker.before_call() != probe
+    context.run(breaker.record, 1)
+    assert breaker.state == HALF_OPEN
+    breaker.record(1)
+    assert breaker.state == CLOSED
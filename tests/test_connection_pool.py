@@ -0,0 +1,63 @@
+"""Tests for the per-site connection pool."""
+import threading
+
+import pytest
+
+pytest.importorskip('pyodbc', exc_type=ImportError)
+
+from config.database import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_closed_connections_are_reused():
+    pool = ConnectionPool(FakeConnection, max_connections=1, wait_seconds=0.01)
+    first = pool.acquire()
+    raw = first._conn
+    first.close()
+    second = pool.acquire()
+    assert second._conn is raw and not raw.closed
+    second.close()
+    assert pool.stats()['in_use'] == 0
+
+
+def test_discarded_connection_is_closed_and_frees_its_slot():
+    pool = ConnectionPool(FakeConnection, max_connections=1, wait_seconds=0.01)
+    conn = pool.acquire()
+    raw = conn._conn
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    conn.discard()
+    conn.close()
+    assert raw.closed
+    replacement = pool.acquire()
+    assert replacement._conn is not raw
+    stats = pool.stats()
+    assert stats['closed_discarded'] == 1 and stats['opened'] == 2 and stats['in_use'] == 1
+
+
+def test_time_waiting_for_a_slot_is_counted():
+    pool = ConnectionPool(FakeConnection, max_connections=1, wait_seconds=0.05)
+    first = pool.acquire()
+    first.close()
+    held = pool.acquire()
+    assert 'waits' not in pool.stats()
+
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    threading.Timer(0.02, held.close).start()
+    pool.acquire().close()
+
+    stats = pool.stats()
+    assert stats['waits'] == 2 and stats['timeouts'] == 1
+    assert stats['max_wait_ms'] >= 45
+    assert stats['wait_ms'] >= stats['max_wait_ms'] + 15
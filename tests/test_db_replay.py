@@ -0,0 +1,63 @@
+"""Tests for database traffic record and replay."""
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip('pyodbc', exc_type=ImportError)
+
+from config.db_replay import (Recorder, RecordingConnection, load_recording, recording_files,
+                              recording_path, redactor_from_env)
+
+
+class FakeCursor:
+    description = [('id',), ('username',), ('fullname',)]
+    rowcount = -1
+
+    def execute(self, sql, *params):
+        return self
+
+    def fetchall(self):
+        return [(1, 'jdoe', 'JOHN DOE')]
+
+    def nextset(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+
+def test_recording_path_is_per_process():
+    assert recording_path('/x/capture.jsonl.gz', 42) == '/x/capture.jsonl.42.gz'
+    assert recording_path('/x/capture.jsonl', 42) == '/x/capture.jsonl.42.gz'
+
+
+def test_load_recording_merges_process_files_in_time_order(tmp_path):
+    base = str(tmp_path / 'capture.jsonl.gz')
+    for pid, stamps in ((101, (1, 4)), (202, (2, 3))):
+        with gzip.open(recording_path(base, pid), 'wt', encoding='utf-8') as f:
+            for ts in stamps:
+                f.write(json.dumps({'t': 'call', 'ts': ts, 'pid': pid}) + '\n')
+    (tmp_path / 'capture.jsonl.notes.gz').write_bytes(b'')
+    assert len(recording_files(base)) == 2
+    assert [(e['ts'], e['pid']) for e in load_recording(base)] == [(1, 101), (2, 202), (3, 202), (4, 101)]
+
+
+def test_recordings_are_redacted_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv('DB_RECORD_REDACT', raising=False)
+    recorder = Recorder(str(tmp_path / 'capture.jsonl.gz'), redactor_from_env())
+    cursor = RecordingConnection(FakeConnection(), recorder).cursor()
+    cursor.execute("SELECT id, username, fullname FROM miosphere_users WHERE username = ? AND password = ?",
+                   ('jdoe', 'a' * 64))
+    cursor.fetchall()
+    cursor.nextset()
+    recorder.close()
+    text = gzip.open(recorder.path, 'rt', encoding='utf-8').read()
+    assert 'jdoe' not in text and 'a' * 64 not in text and 'JOHN DOE' not in text
+    call = load_recording(str(tmp_path / 'capture.jsonl.gz'))[0]
+    assert call['sets'][0]['rows'][0][0] == 1
@@ -0,0 +1,164 @@
+"""Tests for the local HM store and its background writer."""
+import threading
+import time
+from datetime import date, datetime
+
+from timesheet.hm_store import HmStore, HmWriter, SiteHmStores
+
+
+def readings(start, end, hm=100.0, unit='DT101'):
+    return [{'row_id': i, 'ts': 1700000000000 + i * 60000, 'hm': hm + i, 'unit': unit,
+             'operator': 'NRP1', 'shift': '1', 'status': 'login'} for i in range(start, end)]
+
+
+def test_append_writes_only_new_or_changed_versions(tmp_path):
+    store = HmStore(str(tmp_path), compact_threshold=10 ** 6)
+    assert store.append(readings(0, 10)) == 10
+    assert store.append(readings(0, 10)) == 0
+    store.compact()
+    assert store.append(readings(5, 15)) == 5
+    assert store.append(readings(8, 12, hm=200.0)) == 4
+    rows = store.range('DT101')
+    assert [row['id'] for row in rows] == list(range(15))
+    assert rows[9]['hm'] == 209.0 and rows[12]['hm'] == 112.0
+
+
+def test_correction_is_the_latest_version(tmp_path):
+    store = HmStore(str(tmp_path))
+    store.append(readings(0, 3))
+    assert store.correct_hm(1, 555.5)
+    assert not store.correct_hm(99, 1.0)
+    assert store.latest('DT101', status=None)['hm'] == 102.0
+    assert [row['hm'] for row in store.range('DT101')] == [100.0, 555.5, 102.0]
+    store.compact()
+    assert store.stats()['base_rows'] == 3
+
+
+def test_writer_applies_updates_in_order(tmp_path):
+    writer = HmWriter(HmStore(str(tmp_path)))
+    assert writer.append(lambda rows: rows, readings(0, 3))
+    assert writer.correct_hm(2, 42.0)
+    writer.flush()
+    assert [row['hm'] for row in writer.store.range('DT101')] == [100.0, 101.0, 42.0]
+    writer.close()
+
+
+def test_writer_drops_updates_when_the_queue_is_full(tmp_path):
+    writer = HmWriter(HmStore(str(tmp_path)), max_pending=1)
+    release = threading.Event()
+    assert writer.append(lambda rows: release.wait(5) and rows, readings(0, 1))
+    # The first update may still be queued or already running; either way one more fits at most
+    results = [writer.correct_hm(0, 1.0) for _ in range(3)]
+    assert results.count(False) >= 2
+    release.set()
+    writer.flush()
+    writer.close()
+
+
+def test_readers_run_while_another_thread_appends(tmp_path):
+    store = HmStore(str(tmp_path), compact_threshold=200)
+    errors = []
+
+    def read():
+        try:
+            for _ in range(200):
+                rows = store.range('DT101')
+                assert [row['id'] for row in rows] == sorted(row['id'] for row in rows)
+        except Exception as e:
+            errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for start in range(0, 1000, 50):
+        store.append(readings(start, start + 50))
+    reader.join()
+    assert not errors
+    assert len(store.range('DT101')) == 1000
+
+
+def test_each_site_has_its_own_store(tmp_path):
+    stores = SiteHmStores(str(tmp_path))
+    stores.writer('north').append(lambda rows: rows, readings(0, 2, unit='DTN1'))
+    stores.writer('north').flush()
+    assert len(stores.store('north').range('DTN1')) == 2
+    assert stores.store('south').range('DTN1') == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['north', 'south']
+
+
+def test_strings_with_separators_survive_a_reopen(tmp_path):
+    store = HmStore(str(tmp_path))
+    odd = ['tab\there', 'line\nbreak', 'back\\slash\\t', 'cr\rlf', 'sep arator']
+    store.append([dict(r, operator=name) for r, name in zip(readings(0, 5), odd)])
+    reopened = HmStore(str(tmp_path))
+    assert [row['opr_nrp'] for row in reopened.range('DT101')] == odd
+    assert reopened.stats()['operators'] == 5
+    # Known strings keep their codes instead of being added again
+    assert reopened.append([dict(r, operator=name) for r, name in zip(readings(0, 5), odd)]) == 0
+
+
+def login_rows(start, end, unit='DT101'):
+    return [{'id': i, 'mobileid': unit, 'status': 'Login' if i % 2 else 'Logout', 'opr_nrp': 'NRP1',
+             'opr_username': 'Budi', 'opr_shift': '1', 'lgn_hourmeter': 100.0 + i, 'pos_name': 'PIT 2',
+             'tanggal': date(2024, 3, 4), 'jam': '06', 'reporttime': datetime(2024, 3, 4, 6, i),
+             'created_at': datetime(2024, 3, 4, 6, i, 30)}
+            for i in range(end - 1, start - 1, -1)]
+
+
+def test_login_history_is_served_only_while_fresh_and_unwritten(tmp_path, monkeypatch):
+    writer = HmWriter(HmStore(str(tmp_path)))
+    store = writer.store
+    now = [1_700_000_000.0]
+    monkeypatch.setattr('timesheet.hm_store.time.time', lambda: now[0])
+    assert store.login_history('DT101', 30) is None
+
+    writer.append_history('DT101', login_rows(0, 3), fetched_at=now[0])
+    writer.flush()
+    rows = store.login_history('DT101', 30)
+    assert [row['id'] for row in rows] == [2, 1, 0]
+    assert rows[0] == {'id': 2, 'opr_nrp': 'NRP1', 'opr_username': 'Budi', 'status': 'Logout',
+                       'tanggal': 'Mon, 04 Mar 2024 00:00:00 GMT', 'opr_shift': '1', 'jam': '06',
+                       'mobileid': 'DT101', 'lgn_hourmeter': 102.0, 'pos_name': 'PIT 2',
+                       'reporttime': datetime(2024, 3, 4, 6, 2), 'created_at': datetime(2024, 3, 4, 6, 2, 30)}
+
+    # Step 3 readings of the same rows lack the panel columns and keep the stored ones
+    store.append([{'row_id': 1, 'ts': 1709532060000, 'hm': 101.0, 'unit': 'DT101', 'operator': 'NRP1',
+                   'shift': '1', 'status': 'login'}])
+    assert store.login_history('DT101', 30)[1]['opr_username'] == 'Budi'
+    assert store.login_history('DT101', 30)[1]['status'] == 'Login'
+    assert store.latest('DT101')['id'] == 1
+
+    now[0] += 31
+    assert store.login_history('DT101', 30) is None
+    writer.append_history('DT101', login_rows(0, 3), fetched_at=now[0])
+    writer.flush()
+    assert store.login_history('DT101', 30) is not None
+    store.clear_history(now[0] + 1)
+    assert store.login_history('DT101', 30) is None
+    assert HmStore(str(tmp_path)).login_history('DT101', 30) is None
+    writer.close()
+
+
+def test_login_history_with_unstorable_rows_is_not_served(tmp_path):
+    writer = HmWriter(HmStore(str(tmp_path)))
+    rows = login_rows(0, 3)
+    rows[1]['lgn_hourmeter'] = None
+    writer.append_history('DT101', rows, fetched_at=time.time())
+    writer.flush()
+    assert writer.store.login_history('DT101', 30) is None
+    assert len(writer.store.range('DT101')) == 2
+    writer.close()
+
+
+def test_stores_written_before_the_panel_columns_are_upgraded(tmp_path):
+    store = HmStore(str(tmp_path))
+    store.append(readings(0, 3))
+    store.compact()
+    store.append(readings(3, 5))
+    gen_dir = tmp_path / f'gen-{store.stats()["generation"]}'
+    for name in ('name', 'pos', 'tanggal', 'jam', 'created'):
+        (gen_dir / f'base.{name}').unlink()
+        (gen_dir / f'tail.{name}').unlink()
+    upgraded = HmStore(str(tmp_path))
+    assert [row['hm'] for row in upgraded.range('DT101')] == [100.0, 101.0, 102.0, 103.0, 104.0]
+    assert upgraded.stats()['tail_rows'] == 0
+    assert upgraded.append(readings(0, 5)) == 0
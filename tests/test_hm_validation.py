@@ -0,0 +1,135 @@
+"""
+Tests for timesheet.hm_validation.
+
+test_matches_procedure_output is the parity check: it recomputes the flags of
+every fixture in tests/fixtures and compares them with the ones stored there.
+step3_reference.json holds reference rows for each problem the step 3 table
+shows; output captured from dbo.miosphere_dtv_get_realtime_hm_validation with
+scripts/capture_hm_fixture.py is checked the same way.
+"""
+import glob
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from timesheet.hm_validation import (FLAG_BELUM_LOGOUT, FLAG_COLUMNS, FLAG_HM_LONCAT, FLAG_HM_SAMA,
+                                     FLAG_SALAH_SHIFT, FLAG_TIDAK_FTW, PASSTHROUGH_FLAG_COLUMNS, HmBatch, annotate_rows, parse_shift_windows,
+                                     rows_from_login_history, validate_batch, validate_row)
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WINDOWS = parse_shift_windows('1=05:00-14:00,3=21:00-06:00')
+
+
+def row(**values):
+    base = {'MOBILEID': 'DT101', 'opr_shift': '1', 'prev_hm': 100.0, 'hm': 100.0, 'next_hm': 108.0,
+            'reporttime': datetime(2024, 1, 1, 6, 0), 'next_reporttime': datetime(2024, 1, 1, 14, 0)}
+    base.update(values)
+    return base
+
+
+def test_parse_shift_windows():
+    assert parse_shift_windows('1=05:00-14:00, 3=21:00-06:00,9=00:00-00:00') == {
+        '1': (300, 540), '3': (1260, 540), '9': (0, 1440)}
+    assert parse_shift_windows('') == {}
+    with pytest.raises(ValueError):
+        parse_shift_windows('1=5-14')
+
+
+def test_clean_row_has_no_flags():
+    result = annotate_rows([row()], WINDOWS)[0]
+    assert result['TOTAL_HM'] == 8.0
+    assert result['HM_LONCAT'] == 0.0
+    assert all(result[col] is None for col in FLAG_COLUMNS)
+
+
+@pytest.mark.parametrize('values, column, flag', [
+    ({'next_hm': None, 'next_reporttime': None}, 'is_logout', FLAG_BELUM_LOGOUT),
+    ({'hm': 101.5, 'next_hm': 109.0}, 'is_loncat', FLAG_HM_LONCAT),
+    ({'next_hm': 100.0}, 'is_sama', FLAG_HM_SAMA),
+    ({'reporttime': datetime(2024, 1, 1, 15, 0)}, 'is_salah_shift', FLAG_SALAH_SHIFT),
+    ({'opr_shift': '3', 'reporttime': datetime(2024, 1, 1, 12, 0)}, 'is_salah_shift', FLAG_SALAH_SHIFT),
+    ({'is_ftw': 'Tidak FTW '}, 'is_ftw', FLAG_TIDAK_FTW),
+])
+def test_flags(values, column, flag):
+    result = annotate_rows([row(**values)], WINDOWS)[0]
+    assert result[column] == flag
+    assert all(result[col] is None for col in FLAG_COLUMNS if col != column)
+
+
+def test_salah_shift_windows_wrap_midnight():
+    rows = [row(opr_shift='3', reporttime=datetime(2024, 1, 1, 23, 30)),
+            row(opr_shift='3', reporttime=datetime(2024, 1, 2, 5, 59))]
+    assert [r['is_salah_shift'] for r in annotate_rows(rows, WINDOWS)] == [None, None]
+
+
+def test_shift_codes_without_a_window_are_not_checked():
+    assert annotate_rows([row(opr_shift='7', reporttime=datetime(2024, 1, 1, 3, 0))], WINDOWS)[0][
+        'is_salah_shift'] is None
+    assert annotate_rows([row(reporttime=datetime(2024, 1, 1, 3, 0))], {})[0]['is_salah_shift'] is None
+
+
+def test_batch_agrees_with_row_at_a_time():
+    rows = [row(), row(next_hm=None), row(prev_hm=None), row(hm='100.2'),
+            row(reporttime='2024-01-01T20:00:00'), row(opr_shift='3', reporttime=None),
+            row(is_ftw=FLAG_TIDAK_FTW)]
+    result = validate_batch(HmBatch.from_rows(rows), WINDOWS)
+    for idx, r in enumerate(rows):
+        expected = validate_row(r, WINDOWS)
+        for col in FLAG_COLUMNS + ('pattern_ok', 'total_bad', 'loncat_warn'):
+            assert result[col][idx] == expected[col], (idx, col)
+
+
+def login(id_, time, hm, status='login'):
+    return {'id': id_, 'status': status, 'reporttime': datetime(2024, 1, 1, *time), 'lgn_hourmeter': hm,
+            'mobileid': 'DT101', 'opr_shift': '1'}
+
+
+def test_rows_from_login_history_pairs_adjacent_records():
+    history = [
+        login(1, (5, 0), 99.0, 'logout'),
+        login(2, (6, 0), 100.0),
+        login(3, (10, 0), 104.0, 'logout'),
+        login(4, (11, 0), 104.0),
+        # Login 4 was never logged out: another login follows it
+        login(5, (12, 0), 105.0),
+        login(6, (13, 0), 106.0, 'logout'),
+    ]
+    rows = rows_from_login_history(reversed(history))
+    assert [(r['id'], r['prev_id'], r['next_id']) for r in rows] == [(2, 1, 3), (4, 3, None), (5, None, 6)]
+    assert (rows[1]['prev_hm'], rows[1]['next_hm']) == (104.0, None)
+    assert (rows[2]['prev_hm'], rows[2]['next_hm']) == (None, 106.0)
+
+
+def _fixtures():
+    return sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.json')))
+
+
+def _flag(value):
+    value = str(value or '').strip().lower()
+    return value or None
+
+
+@pytest.mark.parametrize('path', _fixtures())
+def test_matches_procedure_output(path):
+    with open(path, encoding='utf-8') as f:
+        fixture = json.load(f)
+    windows = parse_shift_windows(fixture.get('shift_windows', ''))
+    expected = fixture['rows']
+    computed = tuple(col for col in FLAG_COLUMNS if col not in PASSTHROUGH_FLAG_COLUMNS)
+    inputs = [{k: v for k, v in r.items() if k not in computed + ('TOTAL_HM', 'HM_LONCAT')}
+              for r in expected]
+    assert inputs
+    mismatches = []
+    for got, want in zip(annotate_rows(inputs, windows), expected):
+        for col in FLAG_COLUMNS:
+            if col == 'is_salah_shift' and not windows:
+                continue
+            if _flag(got[col]) != _flag(want[col]):
+                mismatches.append((want['MOBILEID'], want['reporttime'], col, got[col], want[col]))
+        for col in ('TOTAL_HM', 'HM_LONCAT'):
+            if want[col] is not None and (got[col] is None or abs(got[col] - float(want[col])) > 1e-6):
+                mismatches.append((want['MOBILEID'], want['reporttime'], col, got[col], want[col]))
+    assert not mismatches, f'{len(mismatches)} differences, first: {mismatches[:5]}'
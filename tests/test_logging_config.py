@@ -0,0 +1,113 @@
+"""Tests for the structured logging handler, formatter and filters."""
+import json
+import logging
+import queue
+
+import pytest
+
+pytest.importorskip('pyodbc', exc_type=ImportError)
+
+from config import logging_config
+from config.database import start_db_timing, stop_db_timing
+from config.logging_config import ErrorRateLimitFilter, JsonFormatter, JsonQueueHandler, RequestContextFilter
+
+
+def record(msg='message %s', args=('x',), level=logging.ERROR, name='app', exc_info=None, **extra):
+    rec = logging.LogRecord(name, level, __file__, 1, msg, args, exc_info)
+    rec.__dict__.update(extra)
+    return rec
+
+
+def handler(maxsize, report_interval=60.0):
+    h = JsonQueueHandler(queue.Queue(maxsize=maxsize), report_interval=report_interval)
+    h.setFormatter(JsonFormatter())
+    return h
+
+
+def lines(h):
+    out = []
+    while not h.queue.empty():
+        out.append(json.loads(h.queue.get_nowait().msg))
+    return out
+
+
+def test_formatter_writes_one_json_object_with_extras():
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        import sys
+        rec = record(exc_info=sys.exc_info(), request_id='abc', status=500)
+    line = JsonFormatter().format(rec)
+    assert '\n' not in line
+    payload = json.loads(line)
+    assert payload['message'] == 'message x'
+    assert (payload['level'], payload['logger'], payload['request_id'], payload['status']) == ('ERROR', 'app', 'abc', 500)
+    assert 'ValueError: boom' in payload['exc']
+    assert 'args' not in payload and 'msecs' not in payload
+
+
+def test_queue_handler_enqueues_the_formatted_line():
+    h = handler(10)
+    h.handle(record())
+    assert [l['message'] for l in lines(h)] == ['message x']
+
+
+def test_queue_handler_counts_and_reports_dropped_records():
+    h = handler(2, report_interval=0)
+    for _ in range(5):
+        h.handle(record())
+    assert h.dropped == 3
+    assert len(lines(h)) == 2
+    h.handle(record(msg='after', args=()))
+    got = lines(h)
+    assert got[0]['message'] == 'after'
+    assert got[1]['level'] == 'WARNING' and 'dropped 3 records' in got[1]['message']
+    h.handle(record(msg='again', args=()))
+    assert [l['message'] for l in lines(h)] == ['again']
+
+
+def test_dropped_records_are_reported_at_most_once_per_interval():
+    h = handler(2, report_interval=3600)
+    for _ in range(3):
+        h.handle(record())
+    lines(h)
+    h.handle(record())
+    assert len(lines(h)) == 2
+    for _ in range(3):
+        h.handle(record())
+    lines(h)
+    h.handle(record())
+    assert len(lines(h)) == 1
+    assert (h.dropped, h._reported) == (2, 1)
+
+
+def test_request_context_filter_adds_request_fields_and_db_timing():
+    rec = record()
+    token = logging_config._request_context.set({'request_id': 'req-1', 'user': 'budi',
+                                                 'endpoint': 'step3', 'method': 'GET'})
+    start_db_timing()
+    try:
+        assert RequestContextFilter().filter(rec)
+    finally:
+        stop_db_timing()
+        logging_config._request_context.reset(token)
+    assert (rec.request_id, rec.user, rec.endpoint, rec.method) == ('req-1', 'budi', 'step3', 'GET')
+    assert (rec.db_ms, rec.db_calls) == (0, 0)
+    assert logging_config.get_request_id() is None
+
+    outside = record()
+    assert RequestContextFilter().filter(outside)
+    assert not hasattr(outside, 'request_id')
+
+
+def test_rate_limit_filter_suppresses_repeats_and_reports_them(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(logging_config.time, 'monotonic', lambda: now[0])
+    f = ErrorRateLimitFilter(burst=2, window=60)
+    assert [f.filter(record()) for _ in range(5)] == [True, True, False, False, False]
+    assert f.filter(record(msg='other %s'))
+    assert f.filter(record(level=logging.INFO))
+    now[0] += 60
+    rec = record()
+    assert f.filter(rec)
+    assert rec.suppressed == 3
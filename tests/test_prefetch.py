@@ -0,0 +1,108 @@
+"""Tests for the wizard prefetcher."""
+import threading
+
+import pytest
+
+pytest.importorskip('pyodbc', exc_type=ImportError)
+
+from config.database import current_site, get_db_timing, start_db_timing, stop_db_timing, use_site
+from config.tracing import current_trace, tracer
+from timesheet.prefetch import Prefetcher
+
+
+def test_prefetch_runs_outside_the_request_trace_and_timing(monkeypatch):
+    monkeypatch.setenv('DB_SITES', 'north,south')
+    monkeypatch.setattr('config.database._sites', None)
+    prefetcher = Prefetcher(max_inflight=1)
+    seen = {}
+
+    def job():
+        seen.update(site=current_site(), trace=current_trace(), timing=get_db_timing())
+        return 'done'
+
+    use_site('south')
+    tracer.start_trace('request')
+    start_db_timing()
+    try:
+        assert prefetcher.schedule('session', 'query', job)
+        assert prefetcher.get_or_run('session', 'query', job) == 'done'
+    finally:
+        stop_db_timing()
+        tracer.finish_trace()
+        use_site(None)
+    assert seen == {'site': 'south', 'trace': None, 'timing': None}
+
+
+def test_peek_returns_finished_results_without_consuming_them():
+    prefetcher = Prefetcher(max_inflight=1)
+    release = threading.Event()
+    calls = []
+
+    def job():
+        calls.append(1)
+        release.wait(5)
+        return 'rows'
+
+    assert prefetcher.peek('session', 'step3') is None
+    prefetcher.schedule('session', 'step3', job)
+    assert prefetcher.peek('session', 'step3') is None
+    release.set()
+    finish(prefetcher)
+    result, age = prefetcher.peek('session', 'step3')
+    assert result == 'rows' and 0 <= age < 5
+    assert prefetcher.get_or_run('session', 'step3', job) == 'rows'
+    assert len(calls) == 1
+
+
+def test_results_are_kept_per_site(monkeypatch):
+    monkeypatch.setenv('DB_SITES', 'north,south')
+    monkeypatch.setattr('config.database._sites', None)
+    prefetcher = Prefetcher(max_inflight=1)
+    use_site('south')
+    try:
+        prefetcher.schedule('session', 'step3', lambda: 'south rows')
+        assert prefetcher.get_or_run('session', 'step3', lambda: 'fresh') == 'south rows'
+        prefetcher.schedule('session', 'step3', lambda: 'south rows')
+        use_site('north')
+        assert prefetcher.peek('session', 'step3') is None
+        assert prefetcher.get_or_run('session', 'step3', lambda: 'north rows') == 'north rows'
+    finally:
+        use_site(None)
+
+
+def finish(prefetcher):
+    for future, *_ in list(prefetcher._entries.values()):
+        future.result(timeout=5)
+
+
+def test_invalidate_drops_every_session():
+    prefetcher = Prefetcher(max_inflight=2)
+    prefetcher.schedule('writer', 'step3', lambda: 'old')
+    prefetcher.schedule('reader', 'step3', lambda: 'old')
+    finish(prefetcher)
+    prefetcher.invalidate()
+    assert prefetcher.peek('reader', 'step3') is None
+    assert prefetcher.get_or_run('reader', 'step3', lambda: 'new') == 'new'
+    stats = prefetcher.stats()
+    assert (stats['invalidated'], stats['wasted'], stats['hits']) == (2, 0, 0)
+
+
+def test_writes_in_other_workers_discard_prefetches():
+    generation = [0]
+    prefetcher = Prefetcher(max_inflight=1, shared_generation=lambda: generation[0])
+    prefetcher.schedule('reader', 'step3', lambda: 'old')
+    finish(prefetcher)
+    generation[0] += 1
+    assert prefetcher.peek('reader', 'step3') is None
+    assert prefetcher.get_or_run('reader', 'step3', lambda: 'new') == 'new'
+    assert prefetcher.stats()['invalidated'] == 1
+
+
+def test_a_peeked_result_is_not_wasted():
+    prefetcher = Prefetcher(max_inflight=1, ttl=60)
+    prefetcher.schedule('session', 'step3', lambda: 'rows')
+    finish(prefetcher)
+    assert prefetcher.peek('session', 'step3')[0] == 'rows'
+    prefetcher.ttl = 0
+    stats = prefetcher.stats()
+    assert (stats['hits'], stats['wasted'], stats['cached']) == (1, 0, 0)
@@ -0,0 +1,100 @@
+"""Tests for the timesheet request schemas."""
+from datetime import datetime
+
+import pytest
+
+from timesheet import schemas
+from timesheet.schemas import SchemaError, parse_datetime
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-01-15T10:30:00', datetime(2024, 1, 15, 10, 30)),
+    ('2024-01-15 10:30:00', datetime(2024, 1, 15, 10, 30)),
+    ('2024-01-15T10:30:00.123456', datetime(2024, 1, 15, 10, 30)),
+    (datetime(2024, 1, 15, 10, 30, 0, 5000), datetime(2024, 1, 15, 10, 30)),
+])
+def test_parse_datetime(value, expected):
+    assert parse_datetime(value) == expected
+
+
+@pytest.mark.parametrize('value', [
+    '2024-01-15',                     # no time: used to be stored as midnight
+    '2024-01-15T10:30',
+    '2024-01-15T10:30:00Z',
+    '2024-01-15T10:30:00.000Z',
+    '2024-01-15T10:30:00+07:00',
+    '2024-01-15T10:30+07:00',
+    '2024-01-15T10:30:00 junk',
+    20240115,
+])
+def test_parse_datetime_rejects(value):
+    with pytest.raises(ValueError):
+        parse_datetime(value)
+
+
+def add_trip(**values):
+    payload = {'reportTime': '2024-01-15T10:30:00', 'equipmentNo': 'DT101', 'operatorId': '12345'}
+    payload.update(values)
+    return schemas.ADD_TRIP.decode(payload)
+
+
+def test_add_trip_rejects_date_only_report_time():
+    with pytest.raises(SchemaError) as e:
+        add_trip(reportTime='2024-01-15')
+    assert 'reportTime' in e.value.errors
+
+
+@pytest.mark.parametrize('field, value', [
+    ('equipmentNo', {'$ne': ''}),
+    ('operatorId', ['12345']),
+    ('loaderId', {'a': 1}),
+])
+def test_non_scalar_values_are_rejected(field, value):
+    with pytest.raises(SchemaError) as e:
+        add_trip(**{field: value})
+    assert field in e.value.errors
+
+
+def test_str_fields_reject_non_scalars():
+    with pytest.raises(SchemaError) as e:
+        schemas.STEP2.decode({'equipmentNumber': {'unit': 'DT101'}})
+    assert 'equipmentNumber' in e.value.errors
+    assert schemas.STEP2.decode({'equipmentNumber': ' DT101 '})['equipmentNumber'] == 'DT101'
+
+
+def test_update_hm_coerces_new_hm():
+    values = schemas.UPDATE_HM.decode({'id': 1, 'opr_nrp': '7', 'new_hm': '1200.7'})
+    assert values['new_hm'] == 1200.7
+    with pytest.raises(SchemaError):
+        schemas.UPDATE_HM.decode({'id': 1, 'opr_nrp': '7', 'new_hm': True})
+
+
+@pytest.mark.parametrize('shifts', [[1], ['S01', None], [['S01']], [{'code': 'S01'}]])
+def test_selected_shifts_must_be_strings(shifts):
+    with pytest.raises(SchemaError) as e:
+        schemas.STEP1.decode({'selectedShifts': shifts})
+    assert 'selectedShifts' in e.value.errors
+    assert schemas.STEP1.decode({'selectedShifts': [' S01', 'S02']})['selectedShifts'] == ['S01', 'S02']
+
+
+@pytest.mark.parametrize('schema', [schemas.TRIP_ID, schemas.UPDATE_TRIP])
+@pytest.mark.parametrize('value', [0, False, '   ', {'id': 1}])
+def test_ids_must_be_truthy_scalars(schema, value):
+    with pytest.raises(SchemaError) as e:
+        schema.decode({'id': value})
+    assert 'id' in e.value.errors
+
+
+def test_ids_keep_their_type():
+    assert schemas.TRIP_ID.decode({'id': 42})['id'] == 42
+    assert schemas.TRIP_ID.decode({'id': '42'})['id'] == '42'
+    with pytest.raises(SchemaError):
+        schemas.UPDATE_PREV_HM.decode({'prev_id': 0, 'opr_nrp': '7', 'new_hm': 1})
+
+
+def test_update_shift_sends_unparseable_times_as_null():
+    values = schemas.UPDATE_SHIFT.decode({'id': 1, 'new_shift': '1', 'reporttime': 'yesterday',
+                                          'next_reporttime': '2024-01-15T18:00:00+07:00'})
+    assert values['reporttime'] is None and values['next_reporttime'] is None
+    values = schemas.UPDATE_SHIFT.decode({'id': 1, 'new_shift': '1', 'reporttime': '2024-01-15T06:00:00.5'})
+    assert values['reporttime'] == datetime(2024, 1, 15, 6, 0)
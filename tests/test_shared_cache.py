@@ -0,0 +1,79 @@
+"""Tests for the cross-worker read cache."""
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from timesheet.shared_cache import LastGoodStore, SharedCache, _private_directory, deserialize, serialize
+
+posix_only = pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX ownership checks')
+
+
+def test_values_round_trip_as_json():
+    value = {'rows': [{'id': 1, 'reporttime': datetime(2024, 1, 1, 6, 30), 'tanggal': date(2024, 1, 1),
+                       'lgn_hourmeter': Decimal('1200.5'), 'note': None}] * 200}
+    blob = serialize(value)
+    assert b'pickle' not in blob and blob[:1] in (b'\x00', b'\x01')
+    assert deserialize(blob) == value
+
+
+def test_objects_are_not_cached(tmp_path):
+    cache = SharedCache(str(tmp_path / 'cache.bin'), size_bytes=1 << 20, nslots=64)
+    assert not cache.set('key', object())
+    assert cache.get('key') is None
+    assert cache.set('key', {'a': [1, 2]}) and cache.get('key') == {'a': [1, 2]}
+    cache.close()
+
+
+def test_peek_reports_the_time_left(tmp_path):
+    cache = SharedCache(str(tmp_path / 'cache.bin'), size_bytes=1 << 20, nslots=64)
+    assert cache.peek('step3') is None
+    cache.set('step3', [1, 2], ttl=30)
+    value, expires_in = cache.peek('step3')
+    assert value == [1, 2] and 29 < expires_in <= 30
+    cache.set('forever', 'x')
+    assert cache.peek('forever') == ('x', None)
+    cache.close()
+
+
+@posix_only
+def test_refuses_a_file_others_can_write(tmp_path):
+    path = tmp_path / 'cache.bin'
+    path.write_bytes(b'')
+    os.chmod(path, 0o666)
+    with pytest.raises(PermissionError):
+        SharedCache(str(path), size_bytes=1 << 20, nslots=64)
+
+
+@posix_only
+def test_refuses_a_symlink(tmp_path):
+    target = tmp_path / 'target.bin'
+    target.write_bytes(b'')
+    os.chmod(target, 0o600)
+    (tmp_path / 'cache.bin').symlink_to(target)
+    with pytest.raises(OSError):
+        SharedCache(str(tmp_path / 'cache.bin'), size_bytes=1 << 20, nslots=64)
+
+
+@posix_only
+def test_private_directory(tmp_path):
+    path = str(tmp_path / 'miosphere')
+    _private_directory(path)
+    assert os.stat(path).st_mode & 0o777 == 0o700
+    os.chmod(path, 0o755)
+    with pytest.raises(PermissionError):
+        _private_directory(path)
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('SHARED_CACHE_ENABLED', raising=False)
+    assert SharedCache.from_env() is None
+
+
+def test_last_good_store_is_bounded():
+    store = LastGoodStore(max_entries=2)
+    for key in 'abc':
+        store.put(key, key.upper())
+    assert store.get('a') is None
+    assert store.get('c')[1] == 'C'
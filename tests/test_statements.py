@@ -0,0 +1,123 @@
+"""Tests for the registry of prepared statements."""
+import pytest
+
+pyodbc = pytest.importorskip('pyodbc', exc_type=ImportError)
+
+from config import statements
+
+
+class Cursor:
+    def __init__(self, conn, sets=1):
+        self.conn = conn
+        self.sets = sets
+        self.executed = []
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        if self.conn.fail_execute:
+            raise pyodbc.Error('42000', 'deadlock')
+        self.executed.append((sql, params))
+        self.remaining = self.sets - 1
+        return self
+
+    def fetchall(self):
+        return [('row',)]
+
+    def nextset(self):
+        if self.conn.fail_nextset:
+            raise pyodbc.Error('HY000', 'connection is busy')
+        if self.remaining:
+            self.remaining -= 1
+            return True
+        return False
+
+    def close(self):
+        self.closed = True
+
+
+class Connection:
+    def __init__(self, sets=1):
+        self.statements = {}
+        self.cursors = []
+        self.sets = sets
+        self.fail_execute = False
+        self.fail_nextset = False
+
+    def cursor(self):
+        cursor = Cursor(self, self.sets)
+        self.cursors.append(cursor)
+        return cursor
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats():
+    statements.reset_stats()
+    yield
+    statements.reset_stats()
+
+
+def test_registered_procedure_text():
+    statement = statements.STATEMENTS['trips_by_unit']
+    assert statement.sql == 'EXEC dbo.miosphere_dtv_get_trip_by_unit @date = ?, @shift_code = ?, @mobileid = ?'
+    assert statement.param_names == ['date', 'shift_code', 'mobileid']
+    assert statements.STATEMENTS['realtime_hm_validation'].sql == \
+        'SET NOCOUNT ON; EXEC [dbo].[miosphere_dtv_get_realtime_hm_validation]'
+
+
+def test_register_checks_names_and_placeholders():
+    with pytest.raises(ValueError):
+        statements.register('trips_by_unit', 'SELECT 1')
+    with pytest.raises(ValueError):
+        statements.register('test_placeholders', 'SELECT ?', ['a', 'b'])
+    assert 'test_placeholders' not in statements.STATEMENTS
+
+
+def test_run_prepares_once_per_connection_and_reuses():
+    first, second = Connection(), Connection()
+    for conn in (first, first, second):
+        with statements.run(conn, 'latest_login', 'DT101') as cursor:
+            assert cursor.fetchall() == [('row',)]
+    assert len(first.cursors) == 1 and len(second.cursors) == 1
+    assert first.cursors[0].executed == [(statements.STATEMENTS['latest_login'].sql, ('DT101',))] * 2
+    assert statements.stats()['latest_login'] == {'prepared': 2, 'reused': 1}
+
+
+def test_statements_without_parameters_execute_bare_text():
+    conn = Connection()
+    with statements.run(conn, 'realtime_hm_validation'):
+        pass
+    assert conn.cursors[0].executed == [(statements.STATEMENTS['realtime_hm_validation'].sql, None)]
+
+
+def test_wrong_parameter_count_is_rejected_before_the_database():
+    conn = Connection()
+    with pytest.raises(TypeError, match='latest_login takes 1 parameters'):
+        statements.call(conn, 'latest_login')
+    assert conn.cursors == [] and statements.stats() == {}
+
+
+def test_call_drains_every_result_set():
+    conn = Connection(sets=3)
+    statements.call(conn, 'delete_trip', '42')
+    statements.call(conn, 'delete_trip', '43')
+    assert conn.cursors[0].remaining == 0
+    assert statements.stats()['delete_trip'] == {'prepared': 1, 'reused': 1}
+
+
+def test_failed_execute_prepares_afresh():
+    conn = Connection()
+    conn.fail_execute = True
+    with pytest.raises(pyodbc.Error):
+        statements.call(conn, 'delete_trip', '42')
+    assert conn.statements == {}
+    conn.fail_execute = False
+    statements.call(conn, 'delete_trip', '42')
+    assert len(conn.cursors) == 2
+    assert statements.stats()['delete_trip'] == {'prepared': 2}
+
+
+def test_undrainable_results_discard_the_cursor():
+    conn = Connection(sets=2)
+    conn.fail_nextset = True
+    statements.call(conn, 'delete_trip', '42')
+    assert conn.statements == {} and conn.cursors[0].closed
@@ -0,0 +1,100 @@
+"""Tests for request tracing and the /admin/traces page."""
+import os
+
+import pytest
+
+from config.tracing import Tracer, current_trace, span, tracer, waterfall
+
+
+@pytest.fixture
+def keep_all():
+    saved = (tracer.sample_rate, tracer.slow_ms, tracer.max_spans)
+    tracer.configure(sample_rate=1.0, slow_ms=1000.0, buffer_size=200)
+    yield tracer
+    tracer.configure(saved[0], saved[1], 200, max_spans=saved[2])
+
+
+def test_spans_nest_under_the_current_span(keep_all):
+    keep_all.start_trace('request', path='/x')
+    with span('outer', a=1) as outer:
+        with span('inner') as inner:
+            inner.set(rows=3)
+        with span('sibling'):
+            pass
+    with pytest.raises(ValueError):
+        with span('failing'):
+            raise ValueError('boom')
+    trace = keep_all.finish_trace()
+    assert current_trace() is None
+    record = trace.to_dict()
+    spans = {s['name']: s for s in record['spans']}
+    assert spans['request']['parent_id'] is None
+    assert spans['outer']['parent_id'] == spans['request']['id']
+    assert spans['inner']['parent_id'] == spans['sibling']['parent_id'] == spans['outer']['id']
+    assert spans['failing']['parent_id'] == spans['request']['id']
+    assert spans['inner']['attrs'] == {'rows': 3}
+    assert 'boom' in spans['failing']['error']
+    assert spans['outer']['offset_ms'] <= spans['inner']['offset_ms'] <= spans['sibling']['offset_ms']
+    assert record['pid'] == os.getpid()
+    assert [r['depth'] for r in waterfall(record)] == [0, 1, 2, 2, 1]
+
+
+def test_span_outside_a_trace_is_a_no_op():
+    with span('orphan') as s:
+        assert s is None
+
+
+def test_spans_beyond_the_limit_are_not_recorded(keep_all):
+    keep_all.max_spans = 3
+    keep_all.start_trace('request')
+    for _ in range(5):
+        with span('query'):
+            pass
+    assert len(keep_all.finish_trace().spans) == 3
+
+
+def test_ring_buffer_keeps_the_latest_traces():
+    local = Tracer(sample_rate=1.0, buffer_size=3)
+    for idx in range(5):
+        local.start_trace('request', n=idx)
+        local.finish_trace()
+    assert [t['attrs']['n'] for t in local.recent()] == [2, 3, 4]
+    local.configure(sample_rate=1.0, slow_ms=1000.0, buffer_size=2)
+    assert [t['attrs']['n'] for t in local.recent()] == [3, 4]
+
+
+def test_unsampled_traces_are_kept_only_if_slow_or_failed():
+    local = Tracer(sample_rate=0.0, slow_ms=60000.0, buffer_size=10)
+    local.start_trace('request', n='fast')
+    local.finish_trace()
+    local.start_trace('request', n='error')
+    local.finish_trace(RuntimeError('down'))
+    local.start_trace('request', n='500').root.set(status=500)
+    local.finish_trace()
+    local.slow_ms = 0.0
+    local.start_trace('request', n='slow')
+    local.finish_trace()
+    assert [t['attrs']['n'] for t in local.recent()] == ['error', '500', 'slow']
+
+
+def test_admin_traces_renders_the_waterfall(app_module, keep_all, monkeypatch):
+    monkeypatch.setenv('TRACE_ADMIN_USERS', 'ops')
+    client = app_module.app.test_client()
+    keep_all.start_trace('request', method='GET', path='/api/timesheet/step3', status=200)
+    with span('db.pool_wait', acquired=True):
+        pass
+    with span('db.execute', sql='SELECT <b>1</b>'):
+        pass
+    keep_all.finish_trace()
+
+    with client.session_transaction() as s:
+        s.update(user_id=1, username='someone')
+    assert client.get('/admin/traces').status_code == 403
+
+    with client.session_transaction() as s:
+        s['username'] = 'ops'
+    page = client.get('/admin/traces?limit=500').get_data(as_text=True)
+    assert 'GET /api/timesheet/step3' in page
+    assert 'db.pool_wait' in page and 'db.execute' in page
+    assert 'SELECT &lt;b&gt;1&lt;/b&gt;' in page
+    assert f'worker {os.getpid()}' in page
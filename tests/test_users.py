@@ -0,0 +1,172 @@
+"""Tests for the account helpers shared by /register and the bulk import."""
+import json
+
+import pytest
+
+pyodbc = pytest.importorskip('pyodbc', exc_type=ImportError)
+
+from config.users import (INSERT_USER, INSERT_USER_WITH_SITE, bulk_create_users, hash_password, insert_user,
+                          user_site, validate_new_user)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, sql, params):
+        self.calls.append((sql, params))
+
+
+@pytest.fixture
+def two_sites(monkeypatch):
+    monkeypatch.setenv('DB_SITES', 'north,south')
+    monkeypatch.setattr('config.database._sites', None)
+    yield
+    monkeypatch.setattr('config.database._sites', None)
+
+
+def test_single_site_accounts_have_no_site(monkeypatch):
+    monkeypatch.delenv('DB_SITES', raising=False)
+    monkeypatch.setattr('config.database._sites', None)
+    assert user_site('north') is None
+    assert validate_new_user('alice', 'secret', 'Alice') is None
+    cursor = RecordingCursor()
+    insert_user(cursor, 'alice', 'hash', 'ALICE')
+    assert cursor.calls == [(INSERT_USER, ('alice', 'hash', 'ALICE'))]
+
+
+def test_every_account_needs_a_known_site(two_sites):
+    assert validate_new_user('alice', 'secret', 'Alice', user_site('')) == 'Site is required'
+    assert validate_new_user('alice', 'secret', 'Alice', user_site('moon')).startswith('Site must be one of')
+    site = user_site(' South ')
+    assert site == 'south' and validate_new_user('alice', 'secret', 'Alice', site) is None
+    cursor = RecordingCursor()
+    insert_user(cursor, 'alice', 'hash', 'ALICE', site)
+    assert cursor.calls == [(INSERT_USER_WITH_SITE, ('alice', 'hash', 'ALICE', 'south'))]
+
+
+class UsersDatabase:
+    """Stands in for the users connection: existing accounts, and usernames whose insert fails."""
+
+    def __init__(self, existing=(), failing=()):
+        self.existing = list(existing)
+        self.failing = set(failing)
+        self.lookups = []
+        self.batches = []
+        self.single_inserts = []
+        self.input_sizes = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fast_executemany = None
+
+    def cursor(self):
+        return UsersCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+class UsersCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def __setattr__(self, name, value):
+        if name == 'fast_executemany':
+            self.db.fast_executemany = value
+        object.__setattr__(self, name, value)
+
+    def setinputsizes(self, sizes):
+        self.db.input_sizes.append(sizes)
+
+    def execute(self, sql, params):
+        if 'OPENJSON' in sql:
+            names = json.loads(params[0])
+            self.db.lookups.append(names)
+            self.rows = [(name,) for name in self.db.existing if name.casefold() in {n.casefold() for n in names}]
+            return self
+        if params[0] in self.db.failing:
+            raise pyodbc.Error(f'duplicate key {params[0]}')
+        self.db.single_inserts.append((sql, params))
+        return self
+
+    def executemany(self, sql, seq):
+        if any(params[0] in self.db.failing for params in seq):
+            raise pyodbc.Error('duplicate key')
+        self.db.batches.append((sql, list(seq)))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def users(*names):
+    return [{'username': name, 'password': 'secret', 'fullname': f'{name} user'} for name in names]
+
+
+@pytest.fixture
+def one_site(monkeypatch):
+    monkeypatch.delenv('DB_SITES', raising=False)
+    monkeypatch.setattr('config.database._sites', None)
+
+
+def connect(monkeypatch, db):
+    monkeypatch.setattr('config.users.get_users_connection', lambda: db)
+
+
+def test_bulk_create_checks_every_username_with_one_query(monkeypatch, one_site):
+    db = UsersDatabase(existing=['BOB'])
+    connect(monkeypatch, db)
+    results = bulk_create_users(users('alice', 'bob', 'Alice', 'x') + [{'username': 'carol', 'line': 9}],
+                                dry_run=True)
+    assert db.lookups == [['alice', 'bob']]
+    assert [(r['line'], r['username'], r['status']) for r in results] == [
+        (1, 'alice', 'ready'), (2, 'bob', 'exists'), (3, 'Alice', 'duplicate'), (4, 'x', 'invalid'),
+        (9, 'carol', 'invalid')]
+    assert db.batches == [] and db.commits == 0
+
+
+def test_bulk_create_inserts_in_chunks(monkeypatch, one_site):
+    db = UsersDatabase()
+    connect(monkeypatch, db)
+    results = bulk_create_users(users('alice', 'bob', 'carol', 'dave', 'erin'), chunk_size=2)
+    assert [r['status'] for r in results] == ['created'] * 5
+    assert db.fast_executemany is True
+    assert [len(rows) for _, rows in db.batches] == [2, 2, 1]
+    assert db.batches[0] == (INSERT_USER, [('alice', hash_password('secret'), 'ALICE USER'),
+                                           ('bob', hash_password('secret'), 'BOB USER')])
+    assert db.commits == 3
+    assert all(sizes[0] == (pyodbc.SQL_WVARCHAR, 50, 0) and len(sizes) == 3 for sizes in db.input_sizes)
+
+
+def test_bulk_create_names_each_site(monkeypatch, two_sites):
+    db = UsersDatabase()
+    connect(monkeypatch, db)
+    rows = users('alice', 'bob')
+    rows[1]['site'] = 'South'
+    results = bulk_create_users(rows, site='north')
+    assert [r['status'] for r in results] == ['created', 'created']
+    sql, params = db.batches[0]
+    assert sql == INSERT_USER_WITH_SITE and [p[3] for p in params] == ['north', 'south']
+    assert len(db.input_sizes[0]) == 4
+
+
+def test_bulk_create_retries_a_failed_chunk_row_by_row(monkeypatch, one_site):
+    db = UsersDatabase(failing=['bob'])
+    connect(monkeypatch, db)
+    results = bulk_create_users(users('alice', 'bob', 'carol', 'dave'), chunk_size=3)
+    assert [(r['username'], r['status']) for r in results] == [
+        ('alice', 'created'), ('bob', 'failed'), ('carol', 'created'), ('dave', 'created')]
+    assert results[1]['message'] == 'duplicate key bob'
+    assert [params[0] for _, params in db.single_inserts] == ['alice', 'carol']
+    assert [[params[0] for params in rows] for _, rows in db.batches] == [['dave']]
+    # The failed chunk and the failed row are rolled back; every other row is committed
+    assert db.rollbacks == 2 and db.commits == 3
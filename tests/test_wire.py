@@ -0,0 +1,70 @@
+"""Tests for the compact wire format of read results."""
+import json
+
+import pytest
+
+from timesheet.wire import COMPACT_MEDIA_TYPE, decode_table, encode_table, requested_orient
+
+
+ROWS = [
+    {'MOBILEID': 'DT101', 'opr_shift': '1', 'hm': 100.5, 'is_logout': None, 'pattern_ok': True, 'id': 7},
+    {'MOBILEID': 'DT101', 'opr_shift': '3', 'hm': None, 'is_logout': 'belum logout', 'pattern_ok': False,
+     'id': 'A-8'},
+    {'MOBILEID': 'DT102', 'opr_shift': '1', 'hm': 0, 'is_logout': None, 'pattern_ok': None, 'id': None},
+    {'MOBILEID': 'DT101', 'opr_shift': None, 'hm': -1.25, 'is_logout': 'belum logout', 'pattern_ok': True,
+     'id': 9},
+]
+
+
+def round_trip(rows, columns=None, orient='rows'):
+    # Through JSON, as the client receives it
+    return decode_table(json.loads(json.dumps(encode_table(rows, columns, orient))))
+
+
+@pytest.mark.parametrize('orient', ['rows', 'columns'])
+def test_round_trip_keeps_nulls_and_mixed_types(orient):
+    assert round_trip(ROWS, orient=orient) == ROWS
+
+
+@pytest.mark.parametrize('orient', ['rows', 'columns'])
+def test_repeated_strings_are_dictionary_encoded(orient):
+    table = encode_table(ROWS, orient=orient)
+    assert table['dictionaries']['MOBILEID'] == ['DT101', 'DT102']
+    assert table['dictionaries']['is_logout'] == ['belum logout']
+    # Mixed strings and numbers are sent as they are
+    assert 'id' not in table['dictionaries'] and 'hm' not in table['dictionaries']
+
+
+def test_column_order_follows_the_given_columns():
+    columns = ['hm', 'MOBILEID', 'missing']
+    table = encode_table(ROWS, columns)
+    assert table['columns'] == columns
+    decoded = round_trip(ROWS, columns)
+    assert [list(row) for row in decoded] == [columns] * len(ROWS)
+    assert [row['missing'] for row in decoded] == [None] * len(ROWS)
+    assert [row['hm'] for row in decoded] == [row['hm'] for row in ROWS]
+
+
+def test_column_order_defaults_to_first_seen():
+    rows = [{'b': 1, 'a': 2}, {'c': 3, 'a': 4}]
+    assert encode_table(rows)['columns'] == ['b', 'a', 'c']
+    assert round_trip(rows) == [{'b': 1, 'a': 2, 'c': None}, {'b': None, 'a': 4, 'c': 3}]
+
+
+@pytest.mark.parametrize('orient', ['rows', 'columns'])
+def test_empty_tables(orient):
+    assert round_trip([], orient=orient) == []
+    assert round_trip([], ['a', 'b'], orient) == []
+    assert encode_table([], ['a', 'b'], orient)['data'] == ([[], []] if orient == 'columns' else [])
+
+
+def test_plain_lists_decode_as_is():
+    assert decode_table(ROWS) is ROWS
+
+
+def test_requested_orient():
+    assert requested_orient({}, '') is None
+    assert requested_orient({'format': 'compact'}, '') == 'rows'
+    assert requested_orient({'format': 'compact', 'orient': 'columns'}, '') == 'columns'
+    assert requested_orient({}, f'application/json, {COMPACT_MEDIA_TYPE}; orient=columns') == 'columns'
+    assert requested_orient({}, f'{COMPACT_MEDIA_TYPE}; q=0') is None
@@ -0,0 +1 @@
+# Timesheet package
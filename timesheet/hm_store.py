@@ -0,0 +1,727 @@
+"""
+Local append-only columnar store of hour-meter readings per unit.
+Each column is a flat binary file mapped with numpy. A compacted base segment is
+sorted by unit and time and has a per-unit index; newer readings are appended to a
+tail segment until the next compaction. Strings (unit, operator, shift, status
+and the other historical login panel columns) are dictionary-encoded. Corrections
+append a new version of the same row id and the latest version wins.
+
+The store answers /api/timesheet/historical-login for a unit only while the
+login history it last fetched from SQL Server for that unit is younger than a
+maximum age and no timesheet write has happened since; history.json records
+those fetches.
+
+Every database site has its own store in a subdirectory of HM_STORE_DIR named
+after the site, so readings of one site are never served for another.
+
+Layout of a site's store directory:
+    CURRENT          name of the live generation directory
+    strings.tsv      append-only dictionary: kind<TAB>value per line, with backslash,
+                     tab, CR and newline in values escaped C style
+    history.json     login history fetches per unit, and when a write last made them stale
+    lock             cross-process lock file (history.lock for history.json)
+    gen-N/base.<col> compacted columns, sorted by (unit, ts)
+    gen-N/base.index start/end row of every unit code in the base segment
+    gen-N/base.order base rows ordered by row_id, for version lookups
+    gen-N/tail.<col> readings appended since the last compaction
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from werkzeug.http import http_date
+
+from timesheet.shared_cache import FileLock
+
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = {
+    'row_id': np.int64,
+    'ts': np.int64,          # report time, milliseconds since 1970 (naive local time)
+    'hm': np.float64,
+    'unit': np.int32,
+    'operator': np.int32,
+    'shift': np.int16,
+    'status': np.int16,
+    # Shown by the historical login panel; only login history rows carry them
+    'name': np.int32,
+    'pos': np.int32,
+    'tanggal': np.int32,
+    'jam': np.int32,
+    'created': np.int64,     # created_at in milliseconds, MISSING_MS if unknown
+}
+STRING_COLUMNS = ('unit', 'operator', 'shift', 'status', 'name', 'pos', 'tanggal', 'jam')
+# A reading without these keeps the values of the version already stored
+OPTIONAL_COLUMNS = ('name', 'pos', 'tanggal', 'jam', 'created')
+MISSING_MS = np.iinfo(np.int64).min
+
+_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\r': '\\r', '\n': '\\n'})
+_UNESCAPES = {'t': '\t', 'r': '\r', 'n': '\n'}
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def store_root() -> str:
+    """Directory holding one HM store per database site (HM_STORE_DIR)."""
+    default_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'hm_store')
+    return os.getenv('HM_STORE_DIR', default_dir)
+
+
+def to_millis(value) -> Optional[int]:
+    """Convert a datetime or ISO string to milliseconds since 1970."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    delta = value.replace(tzinfo=None) - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def from_millis(ms: int) -> datetime:
+    return _EPOCH + timedelta(milliseconds=int(ms))
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\(.)', lambda m: _UNESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _wire_text(value) -> Optional[str]:
+    """A panel value as the JSON response carries it; Flask sends dates as HTTP dates."""
+    if value is None:
+        return None
+    if isinstance(value, date):
+        return http_date(value)
+    return str(value)
+
+
+def _reading(row_id, reporttime, hm, mobileid, operator, shift, status, **panel) -> Optional[Dict]:
+    ts = to_millis(reporttime)
+    if row_id in (None, '') or ts is None or hm in (None, '') or not mobileid:
+        return None
+    try:
+        return {'row_id': int(row_id), 'ts': ts, 'hm': float(hm), 'unit': str(mobileid),
+                'operator': str(operator or ''), 'shift': str(shift or ''), 'status': status, **panel}
+    except (TypeError, ValueError):
+        return None
+
+
+def readings_from_step3(rows: Iterable[Dict]) -> List[Dict]:
+    """Login and logout readings contained in miosphere_dtv_get_realtime_hm_validation rows."""
+    readings = []
+    for row in rows:
+        mobileid = row.get('MOBILEID') or row.get('mobileid')
+        operator, shift = row.get('opr_nrp'), row.get('opr_shift')
+        for reading in (
+            _reading(row.get('id'), row.get('reporttime'), row.get('hm'), mobileid, operator, shift, 'login'),
+            _reading(row.get('next_id'), row.get('next_reporttime'), row.get('next_hm'),
+                     mobileid, operator, shift, 'logout'),
+        ):
+            if reading is not None:
+                readings.append(reading)
+    return readings
+
+
+def readings_from_logins(rows: Iterable[Dict]) -> List[Dict]:
+    """Readings contained in miosphere_dtv_get_latest_login_data rows."""
+    readings = []
+    for row in rows:
+        reading = _reading(row.get('id'), row.get('reporttime'), row.get('lgn_hourmeter'),
+                           row.get('mobileid') or row.get('MOBILEID'), row.get('opr_nrp'),
+                           row.get('opr_shift'), str(row.get('status') or '') or 'login',
+                           name=row.get('opr_username'), pos=row.get('pos_name'),
+                           tanggal=_wire_text(row.get('tanggal')), jam=_wire_text(row.get('jam')),
+                           created=to_millis(row.get('created_at')))
+        if reading is not None:
+            readings.append(reading)
+    return readings
+
+
+class HmStore:
+    """Memory-mapped HM history, shared by every worker process that opens the same directory.
+
+    _lock serialises writers across processes; _state_lock keeps the threads of this
+    process from reading mapped segments while another thread swaps them in _refresh.
+    """
+
+    def __init__(self, root: str, compact_threshold: int = 100000):
+        self.root = root
+        self.compact_threshold = compact_threshold
+        os.makedirs(root, exist_ok=True)
+        self._lock = FileLock(os.path.join(root, 'lock'))
+        self._state_lock = threading.RLock()
+        self._current_path = os.path.join(root, 'CURRENT')
+        self._strings_path = os.path.join(root, 'strings.tsv')
+        self._history_path = os.path.join(root, 'history.json')
+        self._history_lock = FileLock(os.path.join(root, 'history.lock'))
+        self._gen = None
+        self._sorted_ids = None
+        self._current_stamp = None
+        self._tail_size = -1
+        self._strings_stamp = None
+        self._strings = {kind: [] for kind in STRING_COLUMNS}
+        self._codes = {kind: {} for kind in STRING_COLUMNS}
+        with self._lock:
+            if not os.path.exists(self._current_path):
+                self._write_generation(1, {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()})
+            else:
+                self._add_missing_columns_locked()
+        with self._state_lock:
+            self._refresh()
+
+    @classmethod
+    def from_env(cls, site: str = 'default') -> Optional['HmStore']:
+        """Open a site's store as configured by HM_STORE_* variables, or None if it is disabled."""
+        if os.getenv('HM_STORE_ENABLED', 'yes').lower() != 'yes':
+            return None
+        return cls(os.path.join(store_root(), site),
+                   compact_threshold=int(os.getenv('HM_STORE_COMPACT_ROWS', '100000')))
+
+    # -- files -------------------------------------------------------------
+
+    def _gen_dir(self, gen: int) -> str:
+        return os.path.join(self.root, f'gen-{gen}')
+
+    @staticmethod
+    def _map(path: str, dtype, rows: Optional[int] = None) -> np.ndarray:
+        itemsize = np.dtype(dtype).itemsize
+        available = os.path.getsize(path) // itemsize if os.path.exists(path) else 0
+        rows = available if rows is None else min(rows, available)
+        if rows == 0:
+            return np.empty(0, dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+
+    def _tail_rows_on_disk(self, gen_dir: str) -> int:
+        """Rows fully written to every tail column; a torn append leaves some columns longer."""
+        return min(os.path.getsize(os.path.join(gen_dir, f'tail.{name}')) // np.dtype(dtype).itemsize
+                   for name, dtype in COLUMNS.items())
+
+    def _write_generation(self, gen: int, base: Dict[str, np.ndarray]) -> None:
+        """Write a sorted base segment and an empty tail, then make it the live generation."""
+        gen_dir = self._gen_dir(gen)
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        os.makedirs(gen_dir)
+        order = np.lexsort((base['ts'], base['unit']))
+        base = {name: np.ascontiguousarray(base[name][order]) for name in COLUMNS}
+        units = len(self._strings['unit']) if self._gen is not None else 0
+        units = max(units, int(base['unit'].max()) + 1 if len(base['unit']) else 0)
+        codes = np.arange(units)
+        index = np.stack([np.searchsorted(base['unit'], codes, 'left'),
+                          np.searchsorted(base['unit'], codes, 'right')], axis=1).astype(np.int64)
+        for name, dtype in COLUMNS.items():
+            base[name].astype(dtype).tofile(os.path.join(gen_dir, f'base.{name}'))
+            open(os.path.join(gen_dir, f'tail.{name}'), 'wb').close()
+        index.tofile(os.path.join(gen_dir, 'base.index'))
+        np.argsort(base['row_id'], kind='stable').astype(np.int64).tofile(os.path.join(gen_dir, 'base.order'))
+        tmp = self._current_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(str(gen))
+        os.replace(tmp, self._current_path)
+        # The previous generation stays for readers that have not noticed the switch yet
+        shutil.rmtree(self._gen_dir(gen - 2), ignore_errors=True)
+
+    def _add_missing_columns_locked(self) -> None:
+        """Upgrade a store written before columns were added: fill them with empty values."""
+        with open(self._current_path, encoding='utf-8') as f:
+            gen = int(f.read().strip())
+        gen_dir = self._gen_dir(gen)
+        present = [name for name in COLUMNS if os.path.exists(os.path.join(gen_dir, f'base.{name}'))]
+        if len(present) == len(COLUMNS):
+            return
+
+        def load(part):
+            paths = {name: os.path.join(gen_dir, f'{part}.{name}') for name in present}
+            rows = min(os.path.getsize(path) // np.dtype(COLUMNS[name]).itemsize for name, path in paths.items())
+            return {name: np.fromfile(path, COLUMNS[name], count=rows) for name, path in paths.items()}
+
+        base, tail = load('base'), load('tail')
+        rows = {name: np.concatenate([base[name], tail[name]]) for name in present}
+        _, last = np.unique(rows['row_id'][::-1], return_index=True)
+        keep = np.sort(len(rows['row_id']) - 1 - last)
+        self._load_strings()
+        new_lines = []
+        for name in COLUMNS:
+            if name not in present:
+                fill = self._encode(name, '', new_lines) if name in STRING_COLUMNS else MISSING_MS
+                rows[name] = np.full(len(rows['row_id']), fill, COLUMNS[name])
+        self._write_strings(new_lines)
+        self._gen = gen
+        self._write_generation(gen + 1, {name: rows[name][keep] for name in COLUMNS})
+        self._gen = None
+        logger.info("Added %s to the HM store in %s", ', '.join(n for n in COLUMNS if n not in present), self.root)
+
+    def _refresh(self) -> None:
+        """Pick up compactions, appends and new strings made by any process."""
+        stat = os.stat(self._current_path)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp != self._current_stamp:
+            with open(self._current_path, encoding='utf-8') as f:
+                gen = int(f.read().strip())
+            gen_dir = self._gen_dir(gen)
+            self._base = {name: self._map(os.path.join(gen_dir, f'base.{name}'), dtype)
+                          for name, dtype in COLUMNS.items()}
+            self._index = self._map(os.path.join(gen_dir, 'base.index'), np.int64).reshape(-1, 2)
+            self._order = self._map(os.path.join(gen_dir, 'base.order'), np.int64)
+            self._sorted_ids = None
+            self._gen, self._current_stamp, self._tail_size = gen, stamp, -1
+        gen_dir = self._gen_dir(self._gen)
+        tail_size = os.path.getsize(os.path.join(gen_dir, 'tail.ts'))
+        if tail_size != self._tail_size:
+            rows = self._tail_rows_on_disk(gen_dir)
+            self._tail = {name: self._map(os.path.join(gen_dir, f'tail.{name}'), dtype, rows)
+                          for name, dtype in COLUMNS.items()}
+            self._tail_size = tail_size
+        self._load_strings()
+
+    def _load_strings(self) -> None:
+        if not os.path.exists(self._strings_path):
+            return
+        stat = os.stat(self._strings_path)
+        if self._strings_stamp == (stat.st_ino, stat.st_size):
+            return
+        offset = self._strings_stamp[1] if self._strings_stamp and self._strings_stamp[0] == stat.st_ino else 0
+        if offset == 0:
+            self._strings = {kind: [] for kind in STRING_COLUMNS}
+            self._codes = {kind: {} for kind in STRING_COLUMNS}
+        with open(self._strings_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(stat.st_size - offset)
+        # Only whole lines count; a line still being written is read next time
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.decode('utf-8').split('\n')[:-1]:
+            kind, value = line.split('\t', 1)
+            value = _unescape(value)
+            self._codes[kind][value] = len(self._strings[kind])
+            self._strings[kind].append(value)
+        self._strings_stamp = (stat.st_ino, offset + len(complete))
+
+    def _write_strings(self, new_lines: List[str]) -> None:
+        """Persist strings added by _encode; they are already in memory, so skip re-reading them."""
+        if not new_lines:
+            return
+        with open(self._strings_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(new_lines))
+        stat = os.stat(self._strings_path)
+        self._strings_stamp = (stat.st_ino, stat.st_size)
+
+    def _encode(self, kind: str, value: str, new_lines: List[str]) -> int:
+        """Code of a string, adding it to the dictionary (caller holds the lock)."""
+        code = self._codes[kind].get(value)
+        if code is None:
+            code = len(self._strings[kind])
+            self._codes[kind][value] = code
+            self._strings[kind].append(value)
+            new_lines.append(f'{kind}\t{value.translate(_ESCAPES)}\n')
+        return code
+
+    def _encode_reading(self, reading: Dict, current: Optional[Dict], new_lines: List[str]) -> Dict:
+        """Column values of a reading; optional columns it leaves out keep current's values."""
+        encoded = {}
+        for name in COLUMNS:
+            value = reading.get(name)
+            if value is None and name in OPTIONAL_COLUMNS:
+                if current is not None:
+                    encoded[name] = current[name]
+                    continue
+                value = '' if name in STRING_COLUMNS else MISSING_MS
+            if name == 'status' and current is not None \
+                    and self._strings['status'][current['status']].lower() == str(value).lower():
+                # Keep the history's spelling of the status over step 3's lower case one
+                encoded[name] = current[name]
+                continue
+            encoded[name] = self._encode(name, str(value), new_lines) if name in STRING_COLUMNS else value
+        return encoded
+
+    # -- reads -------------------------------------------------------------
+
+    def _latest_versions(self, row_ids: Iterable[int]) -> Dict[int, Dict]:
+        """Latest stored version of each row id, found with one pass over base and tail."""
+        ids = np.fromiter(set(row_ids), np.int64)
+        found = {}
+        if not len(ids):
+            return found
+        if self._sorted_ids is None:
+            self._sorted_ids = self._base['row_id'][self._order]
+        if len(self._sorted_ids):
+            pos = np.minimum(np.searchsorted(self._sorted_ids, ids), len(self._sorted_ids) - 1)
+            hit = self._sorted_ids[pos] == ids
+            for row_id, p in zip(ids[hit].tolist(), pos[hit].tolist()):
+                row = self._order[p]
+                found[row_id] = {name: self._base[name][row] for name in COLUMNS}
+        tail_ids = self._tail['row_id']
+        if len(tail_ids):
+            # Tail rows are in append order, so a later version overwrites an earlier one
+            for i in np.flatnonzero(np.isin(tail_ids, ids)).tolist():
+                found[int(tail_ids[i])] = {name: self._tail[name][i] for name in COLUMNS}
+        return found
+
+    def _unit_rows(self, mobileid: str) -> Dict[str, np.ndarray]:
+        """All current readings of a unit, sorted by time."""
+        self._refresh()
+        code = self._codes['unit'].get(mobileid)
+        if code is None:
+            return {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()}
+        start, end = self._index[code] if code < len(self._index) else (0, 0)
+        base = {name: self._base[name][start:end] for name in COLUMNS}
+        in_tail = np.flatnonzero(self._tail['unit'] == code) if len(self._tail['unit']) else []
+        if not len(in_tail):
+            return base
+        rows = {name: np.concatenate([base[name], self._tail[name][in_tail]]) for name in COLUMNS}
+        # Keep the last appended version of every row id
+        _, last = np.unique(rows['row_id'][::-1], return_index=True)
+        keep = len(rows['row_id']) - 1 - last
+        keep = keep[np.argsort(rows['ts'][keep], kind='stable')]
+        return {name: rows[name][keep] for name in COLUMNS}
+
+    def _to_dicts(self, rows: Dict[str, np.ndarray], positions) -> List[Dict]:
+        strings = self._strings
+        return [{
+            'id': int(rows['row_id'][i]),
+            'mobileid': strings['unit'][rows['unit'][i]],
+            'reporttime': from_millis(rows['ts'][i]).isoformat(),
+            'hm': float(rows['hm'][i]),
+            'opr_nrp': strings['operator'][rows['operator'][i]],
+            'opr_shift': strings['shift'][rows['shift'][i]],
+            'status': strings['status'][rows['status'][i]],
+        } for i in positions]
+
+    def latest(self, mobileid: str, status: Optional[str] = 'login') -> Optional[Dict]:
+        """Most recent reading of a unit, by default its latest login."""
+        with self._state_lock:
+            rows = self._unit_rows(mobileid)
+            positions = np.arange(len(rows['ts']))
+            if status is not None:
+                # Step 3 readings say 'login', the login history may say 'Login'
+                codes = [code for text, code in self._codes['status'].items() if text.lower() == status.lower()]
+                positions = positions[np.isin(rows['status'], codes)]
+            if not len(positions):
+                return None
+            return self._to_dicts(rows, positions[-1:])[0]
+
+    def range(self, mobileid: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              limit: Optional[int] = None) -> List[Dict]:
+        """Readings of a unit with start <= reporttime < end, oldest first."""
+        with self._state_lock:
+            rows = self._unit_rows(mobileid)
+            lo = np.searchsorted(rows['ts'], to_millis(start), 'left') if start else 0
+            hi = np.searchsorted(rows['ts'], to_millis(end), 'left') if end else len(rows['ts'])
+            if limit is not None:
+                lo = max(lo, hi - limit)
+            return self._to_dicts(rows, range(lo, hi))
+
+    def trend(self, mobileid: str, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> List[Dict]:
+        """Per-day HM summary of a unit: first/last reading and hours added."""
+        with self._state_lock:
+            rows = self._unit_rows(mobileid)
+        lo = np.searchsorted(rows['ts'], to_millis(start), 'left') if start else 0
+        hi = np.searchsorted(rows['ts'], to_millis(end), 'left') if end else len(rows['ts'])
+        ts, hm = rows['ts'][lo:hi], rows['hm'][lo:hi]
+        if not len(ts):
+            return []
+        days = ts // 86400000
+        bounds = np.flatnonzero(np.diff(days)) + 1
+        firsts = np.concatenate([[0], bounds])
+        lasts = np.concatenate([bounds, [len(ts)]]) - 1
+        maxima = np.maximum.reduceat(hm, firsts)
+        minima = np.minimum.reduceat(hm, firsts)
+        return [{
+            'date': from_millis(days[f] * 86400000).date().isoformat(),
+            'readings': int(l - f + 1),
+            'first_hm': float(hm[f]),
+            'last_hm': float(hm[l]),
+            'hm_added': round(float(maxima[i] - minima[i]), 3),
+        } for i, (f, l) in enumerate(zip(firsts, lasts))]
+
+    def login_history(self, mobileid: str, max_age: float) -> Optional[List[Dict]]:
+        """
+        The unit's login history as miosphere_dtv_get_latest_login_data last returned it,
+        with any later readings, or None unless that was fetched in the last max_age
+        seconds and no write has happened since.
+        """
+        history = self._read_history()
+        mark = history['units'].get(mobileid)
+        if mark is None or mark[0] <= history['cleared'] or time.time() * 1000 - mark[0] > max_age * 1000:
+            return None
+        _, count, newest_first = mark
+        with self._state_lock:
+            rows = self._unit_rows(mobileid)
+            positions = list(range(max(len(rows['ts']) - count, 0), len(rows['ts'])))
+            strings = self._strings
+
+            def text(kind, i):
+                return strings[kind][rows[kind][i]] or None
+
+            result = [{
+                'id': int(rows['row_id'][i]),
+                'opr_nrp': text('operator', i),
+                'opr_username': text('name', i),
+                'status': text('status', i),
+                'tanggal': text('tanggal', i),
+                'opr_shift': text('shift', i),
+                'jam': text('jam', i),
+                'mobileid': strings['unit'][rows['unit'][i]],
+                'lgn_hourmeter': float(rows['hm'][i]),
+                'pos_name': text('pos', i),
+                'reporttime': from_millis(rows['ts'][i]),
+                'created_at': None if rows['created'][i] == MISSING_MS else from_millis(rows['created'][i]),
+            } for i in positions]
+        return result[::-1] if newest_first else result
+
+    def _read_history(self) -> Dict:
+        try:
+            with open(self._history_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'cleared': 0, 'units': {}}
+
+    def _update_history(self, update: Callable[[Dict], None]) -> None:
+        with self._history_lock:
+            history = self._read_history()
+            update(history)
+            # Fetches from before the last write can never be served again
+            history['units'] = {unit: mark for unit, mark in history['units'].items()
+                                if mark[0] > history['cleared']}
+            tmp = f'{self._history_path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(history, f)
+            os.replace(tmp, self._history_path)
+
+    def mark_history(self, mobileid: str, fetched_at: float, count: int, newest_first: bool) -> None:
+        """Record that the unit's full login history, fetched at fetched_at, is in the store."""
+        fetched_ms = int(fetched_at * 1000)
+
+        def update(history):
+            mark = history['units'].get(mobileid)
+            if mark is None or mark[0] < fetched_ms:
+                history['units'][mobileid] = [fetched_ms, count, newest_first]
+        self._update_history(update)
+
+    def clear_history(self, written_at: float) -> None:
+        """Stop serving login histories fetched before a write made at written_at."""
+        written_ms = int(written_at * 1000)
+
+        def update(history):
+            history['cleared'] = max(history['cleared'], written_ms)
+        self._update_history(update)
+
+    def stats(self) -> Dict:
+        with self._state_lock:
+            self._refresh()
+            return {
+                'generation': self._gen,
+                'base_rows': int(len(self._base['ts'])),
+                'tail_rows': int(len(self._tail['ts'])),
+                'units': len(self._strings['unit']),
+                'operators': len(self._strings['operator']),
+            }
+
+    # -- writes ------------------------------------------------------------
+
+    def append(self, readings: Iterable[Dict]) -> int:
+        """Append readings that are new or changed; returns how many were written."""
+        readings = list(readings)
+        if not readings:
+            return 0
+        with self._lock, self._state_lock:
+            self._refresh()
+            stored = self._latest_versions(reading['row_id'] for reading in readings)
+            new_lines = []
+            columns = {name: [] for name in COLUMNS}
+            pending = {}
+            for reading in readings:
+                row_id = reading['row_id']
+                current = pending.get(row_id) or stored.get(row_id)
+                encoded = self._encode_reading(reading, current, new_lines)
+                if current is not None and all(current[name] == encoded[name] for name in COLUMNS):
+                    continue
+                pending[row_id] = encoded
+                for name in COLUMNS:
+                    columns[name].append(encoded[name])
+            self._write_strings(new_lines)
+            written = len(columns['row_id'])
+            if written:
+                self._write_tail(columns)
+                self._refresh()
+                if len(self._tail['ts']) >= self.compact_threshold:
+                    self._compact_locked()
+        return written
+
+    def _write_tail(self, columns: Dict[str, list]) -> None:
+        gen_dir = self._gen_dir(self._gen)
+        rows = self._tail_rows_on_disk(gen_dir)
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(gen_dir, f'tail.{name}')
+            with open(path, 'r+b') as f:
+                f.truncate(rows * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.asarray(columns[name], dtype=dtype).tobytes())
+
+    def correct_hm(self, row_id, new_hm: float) -> bool:
+        """Record an HM correction made through the timesheet; False if the row is not stored."""
+        try:
+            row_id = int(row_id)
+        except (TypeError, ValueError):
+            return False
+        with self._lock, self._state_lock:
+            self._refresh()
+            current = self._latest_versions([row_id]).get(row_id)
+            if current is None:
+                return False
+            self._write_tail({name: [float(new_hm) if name == 'hm' else current[name]] for name in COLUMNS})
+        return True
+
+    def _compact_locked(self) -> None:
+        rows = {name: np.concatenate([self._base[name], self._tail[name]]) for name in COLUMNS}
+        _, last = np.unique(rows['row_id'][::-1], return_index=True)
+        keep = np.sort(len(rows['row_id']) - 1 - last)
+        self._write_generation(self._gen + 1, {name: rows[name][keep] for name in COLUMNS})
+        logger.info("Compacted HM store: %d rows -> %d", len(rows['row_id']), len(keep))
+        self._refresh()
+
+    def compact(self) -> Dict:
+        """Fold the tail into a new sorted base segment, dropping superseded versions."""
+        with self._lock, self._state_lock:
+            self._refresh()
+            self._compact_locked()
+        return self.stats()
+
+    def rebuild(self, readings: Iterable[Dict]) -> Dict:
+        """Replace all stored history with readings fetched fresh from the source procedures."""
+        readings = list(readings)
+        with self._lock, self._state_lock:
+            self._refresh()
+            new_lines = []
+            latest = {}
+            for reading in readings:
+                encoded = self._encode_reading(reading, latest.get(reading['row_id']), new_lines)
+                latest[encoded['row_id']] = encoded
+            self._write_strings(new_lines)
+            base = {name: np.asarray([r[name] for r in latest.values()], dtype=dtype)
+                    for name, dtype in COLUMNS.items()}
+            self._write_generation(self._gen + 1, base)
+            self._refresh()
+        return self.stats()
+
+
+class HmWriter:
+    """Applies updates to an HmStore from a background thread, so requests never wait on its lock.
+
+    Updates are applied in the order they were submitted. A full queue drops the update;
+    the store is a convenience copy and `scripts/hm_store.py rebuild` restores it.
+    """
+
+    def __init__(self, store: HmStore, max_pending: int = 1000):
+        self.store = store
+        self.max_pending = max_pending
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def _ensure_thread(self) -> queue.Queue:
+        # Threads do not survive a fork, so every worker process starts its own
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_pending)
+                self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                name='hm-store-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _submit(self, fn: Callable, *args) -> bool:
+        try:
+            self._ensure_thread().put_nowait((fn, args))
+            return True
+        except queue.Full:
+            logger.warning("HM store queue full, dropping update")
+            return False
+
+    def append(self, convert: Callable[[Iterable[Dict]], List[Dict]], rows) -> bool:
+        """Queue rows fetched from SQL Server; convert turns them into readings on the writer thread."""
+        return self._submit(lambda: self.store.append(convert(rows)))
+
+    def correct_hm(self, row_id, new_hm: float) -> bool:
+        """Queue an HM correction made through the timesheet."""
+        return self._submit(self.store.correct_hm, row_id, new_hm)
+
+    def append_history(self, mobileid: str, rows: List[Dict], fetched_at: float) -> bool:
+        """
+        Queue a unit's login history fetched at fetched_at. Once it is stored the store
+        answers for the unit, unless some row could not be stored as a reading.
+        """
+        def apply():
+            readings = readings_from_logins(rows)
+            self.store.append(readings)
+            if rows and len(readings) == len(rows):
+                newest_first = to_millis(rows[0]['reporttime']) >= to_millis(rows[-1]['reporttime'])
+                self.store.mark_history(mobileid, fetched_at, len({r['row_id'] for r in readings}),
+                                        newest_first)
+        return self._submit(apply)
+
+    def flush(self) -> None:
+        """Wait until every queued update has been applied."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self) -> None:
+        """Apply what is queued, waiting at most a few seconds, and stop the writer thread."""
+        if self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def _run(self, updates: queue.Queue) -> None:
+        while True:
+            item = updates.get()
+            try:
+                if item is None:
+                    return
+                fn, args = item
+                fn(*args)
+            except Exception as e:
+                logger.warning("Could not update HM store: %s", e, exc_info=True)
+            finally:
+                updates.task_done()
+
+
+class SiteHmStores:
+    """The HM store of every database site, each in its own directory, opened on first use."""
+
+    def __init__(self, root: str, compact_threshold: int = 100000, max_pending: int = 1000):
+        self.root = root
+        self.compact_threshold = compact_threshold
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._writers: Dict[str, HmWriter] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional['SiteHmStores']:
+        """The stores configured by HM_STORE_* variables, or None if they are disabled."""
+        if os.getenv('HM_STORE_ENABLED', 'yes').lower() != 'yes':
+            return None
+        return cls(store_root(),
+                   compact_threshold=int(os.getenv('HM_STORE_COMPACT_ROWS', '100000')),
+                   max_pending=int(os.getenv('HM_STORE_QUEUE_SIZE', '1000')))
+
+    def writer(self, site: str) -> HmWriter:
+        """Background writer of a site's store."""
+        with self._lock:
+            writer = self._writers.get(site)
+            if writer is None:
+                store = HmStore(os.path.join(self.root, site), compact_threshold=self.compact_threshold)
+                writer = self._writers[site] = HmWriter(store, max_pending=self.max_pending)
+        return writer
+
+    def store(self, site: str) -> HmStore:
+        return self.writer(site).store
@@ -0,0 +1,322 @@
+"""
+Vectorized hour-meter (HM) continuity validation for login/logout records.
+Mirrors the checks done by dbo.miosphere_dtv_get_realtime_hm_validation so the
+step 3 flags can be computed in-process for the whole fleet at once.
+"""
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+# Thresholds used by the step 3 validation table (see timesheet_step_003.js)
+TOTAL_HM_MAX = 12.0
+LONCAT_WARN_MAX = 0.4
+HM_EPSILON = 1e-9
+
+# Login windows per operator shift code as (start minute of day, length in minutes),
+# from HM_SHIFT_WINDOWS. Shift codes without a window are not checked for salah shift.
+ShiftWindows = Dict[str, Tuple[int, int]]
+
+EXPECTED_PATTERN = 'logout-login-logout'
+
+# Text values the procedure writes into each problem column
+FLAG_BELUM_LOGOUT = 'belum logout'
+FLAG_SALAH_SHIFT = 'salah shift'
+FLAG_HM_LONCAT = 'hm loncat'
+FLAG_HM_SAMA = 'hm logout = login'
+FLAG_TIDAK_FTW = 'tidak ftw'
+
+# In the order the step 3 problem column lists them
+FLAG_COLUMNS = ('is_logout', 'is_salah_shift', 'is_ftw', 'is_loncat', 'is_sama')
+# The procedure decides these from fit-to-work records the rows do not carry,
+# so the engine keeps whatever value the input row already has.
+PASSTHROUGH_FLAG_COLUMNS = ('is_ftw',)
+
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+_NAT = np.iinfo(np.int64).min
+
+
+def _float_array(values: List) -> np.ndarray:
+    """Convert HM values (float, Decimal, numeric string or None) to float64 with NaN for missing."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    out = np.full(len(values), np.nan, dtype=np.float64)
+    for idx, val in enumerate(values):
+        if val is None or val == '':
+            continue
+        try:
+            out[idx] = float(val)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def _datetime_array(values: List) -> np.ndarray:
+    """Convert datetimes or ISO strings to datetime64[s] with NaT for missing."""
+    # Going through integer seconds is an order of magnitude faster than letting
+    # NumPy convert a list of datetime objects.
+    seconds = np.empty(len(values), dtype=np.int64)
+    for idx, val in enumerate(values):
+        if isinstance(val, str):
+            try:
+                val = datetime.fromisoformat(val) if val else None
+            except ValueError:
+                val = None
+        if val is None:
+            seconds[idx] = _NAT
+        else:
+            seconds[idx] = ((val.toordinal() - _EPOCH_ORDINAL) * 86400
+                            + val.hour * 3600 + val.minute * 60 + val.second)
+    return seconds.view('datetime64[s]')
+
+
+class HmBatch:
+    """Column-oriented batch of login/logout HM records."""
+
+    def __init__(self, mobileid: np.ndarray, hm: np.ndarray, next_hm: np.ndarray,
+                 prev_hm: np.ndarray, reporttime: np.ndarray, next_reporttime: np.ndarray,
+                 opr_shift: np.ndarray, lgn_pattern: Optional[np.ndarray] = None,
+                 tidak_ftw: Optional[np.ndarray] = None):
+        self.mobileid = mobileid
+        self.hm = hm
+        self.next_hm = next_hm
+        self.prev_hm = prev_hm
+        self.reporttime = reporttime
+        self.next_reporttime = next_reporttime
+        self.opr_shift = opr_shift
+        self.lgn_pattern = lgn_pattern
+        self.tidak_ftw = tidak_ftw
+
+    def __len__(self) -> int:
+        return len(self.hm)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict]) -> 'HmBatch':
+        """Build a batch from row dicts as returned by the step 3 procedures."""
+        rows = list(rows)
+        has_pattern = any('lgn_pattern' in r for r in rows)
+        has_ftw = any('is_ftw' in r for r in rows)
+        return cls(
+            mobileid=np.array([str(r.get('MOBILEID') or '') for r in rows], dtype=object),
+            hm=_float_array([r.get('hm') for r in rows]),
+            next_hm=_float_array([r.get('next_hm') for r in rows]),
+            prev_hm=_float_array([r.get('prev_hm') for r in rows]),
+            reporttime=_datetime_array([r.get('reporttime') for r in rows]),
+            next_reporttime=_datetime_array([r.get('next_reporttime') for r in rows]),
+            opr_shift=np.array([str(r.get('opr_shift') or '').strip() for r in rows], dtype=object),
+            lgn_pattern=np.array([str(r.get('lgn_pattern') or '') for r in rows], dtype=object)
+            if has_pattern else None,
+            tidak_ftw=np.array([_is_flag(r.get('is_ftw'), FLAG_TIDAK_FTW) for r in rows], dtype=bool)
+            if has_ftw else None,
+        )
+
+
+def _is_flag(value, flag: str) -> bool:
+    """Whether a procedure flag column holds flag (same test as flagEq in timesheet_step_003.js)."""
+    return str(value or '').strip().lower() == flag
+
+
+def parse_shift_windows(spec: str) -> ShiftWindows:
+    """
+    Parse `code=HH:MM-HH:MM,...`, the login window of each opr_shift code as
+    defined in the shift table. A window whose end is not after its start
+    wraps past midnight; start equal to end means the whole day.
+    """
+    windows = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        try:
+            code, window = item.split('=', 1)
+            start, end = (_minute_of_day(part) for part in window.split('-', 1))
+        except ValueError:
+            raise ValueError(f'Invalid shift window {item.strip()!r}, expected code=HH:MM-HH:MM') from None
+        windows[code.strip()] = (start, (end - start) % 1440 or 1440)
+    return windows
+
+
+def _minute_of_day(value: str) -> int:
+    hours, minutes = value.strip().split(':')
+    minute = int(hours) * 60 + int(minutes)
+    if not 0 <= minute <= 1440:
+        raise ValueError(value)
+    return minute % 1440
+
+
+_shift_windows: Optional[ShiftWindows] = None
+_shift_windows_lock = threading.Lock()
+
+
+def get_shift_windows() -> ShiftWindows:
+    """Return the shift login windows configured in HM_SHIFT_WINDOWS, parsed on first use."""
+    global _shift_windows
+    with _shift_windows_lock:
+        if _shift_windows is None:
+            _shift_windows = parse_shift_windows(os.getenv('HM_SHIFT_WINDOWS', ''))
+    return _shift_windows
+
+
+def _shift_mismatch(reporttime: np.ndarray, opr_shift: np.ndarray, windows: ShiftWindows) -> np.ndarray:
+    """Flag logins whose time of day falls outside the window of their shift code."""
+    mismatch = np.zeros(len(reporttime), dtype=bool)
+    valid_time = ~np.isnat(reporttime)
+    minute_of_day = np.zeros(len(reporttime), dtype=np.int64)
+    if valid_time.any():
+        times = reporttime[valid_time]
+        minute_of_day[valid_time] = (
+            (times - times.astype('datetime64[D]')).astype('timedelta64[m]').astype(np.int64)
+        )
+    for code, (start, length) in windows.items():
+        mask = valid_time & (opr_shift == code)
+        if not mask.any():
+            continue
+        mismatch[mask] = (minute_of_day[mask] - start) % 1440 >= length
+    return mismatch
+
+
+def validate_batch(batch: HmBatch, windows: Optional[ShiftWindows] = None) -> Dict[str, np.ndarray]:
+    """
+    Run every continuity check over the batch and return one array per result column.
+    windows defaults to the configured shift login windows (HM_SHIFT_WINDOWS).
+    """
+    total_hm = batch.next_hm - batch.hm
+    hm_loncat = batch.hm - batch.prev_hm
+    has_total = ~np.isnan(total_hm)
+    has_loncat = ~np.isnan(hm_loncat)
+
+    belum_logout = np.isnan(batch.next_hm) | np.isnat(batch.next_reporttime)
+    salah_shift = _shift_mismatch(batch.reporttime, batch.opr_shift,
+                                  get_shift_windows() if windows is None else windows)
+    loncat = has_loncat & (np.abs(np.where(has_loncat, hm_loncat, 0.0)) > HM_EPSILON)
+    sama = has_total & (np.abs(np.where(has_total, total_hm, 0.0)) <= HM_EPSILON)
+
+    tidak_ftw = batch.tidak_ftw if batch.tidak_ftw is not None else np.zeros(len(batch), dtype=bool)
+
+    if batch.lgn_pattern is not None:
+        pattern_ok = np.char.lower(batch.lgn_pattern.astype(str)) == EXPECTED_PATTERN
+    else:
+        pattern_ok = ~np.isnan(batch.prev_hm) & ~belum_logout
+
+    with np.errstate(invalid='ignore'):
+        total_bad = has_total & ((total_hm > TOTAL_HM_MAX) | (total_hm <= 0))
+        loncat_warn = has_loncat & (hm_loncat > 0) & (hm_loncat < LONCAT_WARN_MAX)
+
+    return {
+        'TOTAL_HM': total_hm,
+        'HM_LONCAT': hm_loncat,
+        'is_logout': np.where(belum_logout, FLAG_BELUM_LOGOUT, None),
+        'is_salah_shift': np.where(salah_shift, FLAG_SALAH_SHIFT, None),
+        'is_ftw': np.where(tidak_ftw, FLAG_TIDAK_FTW, None),
+        'is_loncat': np.where(loncat, FLAG_HM_LONCAT, None),
+        'is_sama': np.where(sama, FLAG_HM_SAMA, None),
+        'pattern_ok': pattern_ok,
+        'total_bad': total_bad,
+        'loncat_warn': loncat_warn,
+    }
+
+
+def annotate_rows(rows: List[Dict], windows: Optional[ShiftWindows] = None) -> List[Dict]:
+    """Validate row dicts in place, adding TOTAL_HM, HM_LONCAT and the problem flag columns."""
+    if not rows:
+        return rows
+    result = validate_batch(HmBatch.from_rows(rows), windows)
+    total_hm = result['TOTAL_HM'].tolist()
+    hm_loncat = result['HM_LONCAT'].tolist()
+    flags = {col: result[col].tolist() for col in FLAG_COLUMNS}
+    for idx, row in enumerate(rows):
+        row['TOTAL_HM'] = None if total_hm[idx] != total_hm[idx] else total_hm[idx]
+        row['HM_LONCAT'] = None if hm_loncat[idx] != hm_loncat[idx] else hm_loncat[idx]
+        for col in FLAG_COLUMNS:
+            row[col] = flags[col][idx]
+    return rows
+
+
+def rows_from_login_history(history: Iterable[Dict]) -> List[Dict]:
+    """
+    Pair the login/logout records of one unit (miosphere_dtv_get_latest_login_data
+    rows) into step 3 shaped rows: each login with the logout before and after it.
+    """
+    records = sorted((r for r in history if r.get('reporttime') is not None),
+                     key=lambda r: _datetime_array([r['reporttime']])[0])
+    def is_logout(record):
+        return str(record.get('status') or '').strip().lower() == 'logout'
+
+    rows = []
+    prev_logout = None
+    for idx, record in enumerate(records):
+        if is_logout(record):
+            prev_logout = record
+            continue
+        # Only a logout right after the login closes it; a second login means it never logged out
+        following = records[idx + 1] if idx + 1 < len(records) else None
+        next_logout = following if following is not None and is_logout(following) else None
+        rows.append({
+            'id': record.get('id'),
+            'next_id': next_logout.get('id') if next_logout else None,
+            'prev_id': prev_logout.get('id') if prev_logout else None,
+            'MOBILEID': record.get('mobileid') or record.get('MOBILEID'),
+            'opr_nrp': record.get('opr_nrp'),
+            'opr_username': record.get('opr_username'),
+            'opr_shift': record.get('opr_shift'),
+            'reporttime': record.get('reporttime'),
+            'next_reporttime': next_logout.get('reporttime') if next_logout else None,
+            'prev_hm': prev_logout.get('lgn_hourmeter') if prev_logout else None,
+            'hm': record.get('lgn_hourmeter'),
+            'next_hm': next_logout.get('lgn_hourmeter') if next_logout else None,
+        })
+        # A logout only precedes the login right after it
+        prev_logout = None
+    return rows
+
+
+def validate_row(row: Dict, windows: Optional[ShiftWindows] = None) -> Dict:
+    """
+    Row-at-a-time implementation of validate_batch, to time the vectorized path
+    against. It shares the flag definitions, so agreeing with it proves nothing
+    about the procedure; tests/test_hm_validation.py checks that.
+    """
+    def num(val):
+        if val is None or val == '':
+            return None
+        try:
+            return float(val)
+        except (TypeError, ValueError):
+            return None
+
+    hm, next_hm, prev_hm = num(row.get('hm')), num(row.get('next_hm')), num(row.get('prev_hm'))
+    total_hm = next_hm - hm if hm is not None and next_hm is not None else None
+    hm_loncat = hm - prev_hm if hm is not None and prev_hm is not None else None
+
+    reporttime = _datetime_array([row.get('reporttime')])[0]
+    next_reporttime = _datetime_array([row.get('next_reporttime')])[0]
+    belum_logout = next_hm is None or np.isnat(next_reporttime)
+
+    salah_shift = False
+    windows = get_shift_windows() if windows is None else windows
+    window = windows.get(str(row.get('opr_shift') or '').strip())
+    if window and not np.isnat(reporttime):
+        moment = reporttime.item()
+        start, length = window
+        salah_shift = (moment.hour * 60 + moment.minute - start) % 1440 >= length
+
+    if 'lgn_pattern' in row:
+        pattern_ok = str(row.get('lgn_pattern') or '').lower() == EXPECTED_PATTERN
+    else:
+        pattern_ok = prev_hm is not None and not belum_logout
+
+    return {
+        'TOTAL_HM': total_hm,
+        'HM_LONCAT': hm_loncat,
+        'is_logout': FLAG_BELUM_LOGOUT if belum_logout else None,
+        'is_salah_shift': FLAG_SALAH_SHIFT if salah_shift else None,
+        'is_ftw': FLAG_TIDAK_FTW if _is_flag(row.get('is_ftw'), FLAG_TIDAK_FTW) else None,
+        'is_loncat': FLAG_HM_LONCAT if hm_loncat is not None and abs(hm_loncat) > HM_EPSILON else None,
+        'is_sama': FLAG_HM_SAMA if total_hm is not None and abs(total_hm) <= HM_EPSILON else None,
+        'pattern_ok': pattern_ok,
+        'total_bad': total_hm is not None and (total_hm > TOTAL_HM_MAX or total_hm <= 0),
+        'loncat_warn': hm_loncat is not None and 0 < hm_loncat < LONCAT_WARN_MAX,
+    }
@@ -0,0 +1,185 @@
+"""
+Speculative prefetch for the timesheet wizard.
+When a wizard step is saved, the queries the next step will issue are started in
+the background and their results parked in a short-lived per-session cache.
+Entries are keyed by the database site too, so a result is only ever served
+to requests routed to the site it was read from. A write drops every session's
+entries; with a shared generation counter (SharedCache.generation), writes in
+other workers discard them too.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from config.database import current_site, site_context
+from config.tracing import span
+
+
+class Prefetcher:
+    """Runs likely-next queries ahead of time, bounded by a global in-flight budget."""
+
+    def __init__(self, max_inflight: int = 2, ttl: float = 30.0, max_entries: int = 256,
+                 wait_timeout: float = 30.0, enabled: bool = True,
+                 shared_generation: Optional[Callable[[], int]] = None):
+        self.max_inflight = max_inflight
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.enabled = enabled
+        self.shared_generation = shared_generation
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_inflight),
+                                            thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        # (session_key, site, query_key) -> (future, created_at, shared generation)
+        self._entries: Dict[Tuple[str, Hashable], tuple] = {}
+        # Keys whose result a peek() has already served
+        self._served = set()
+        self._inflight = 0
+        self._stats = {
+            'scheduled': 0,
+            'dropped_budget': 0,
+            'completed': 0,
+            'failed': 0,
+            'hits': 0,
+            'misses': 0,
+            'wasted': 0,
+            'invalidated': 0,
+        }
+
+    @classmethod
+    def from_env(cls, shared_generation: Optional[Callable[[], int]] = None) -> 'Prefetcher':
+        """Build a prefetcher configured from PREFETCH_* environment variables."""
+        return cls(
+            max_inflight=int(os.getenv('PREFETCH_MAX_INFLIGHT', '2')),
+            ttl=float(os.getenv('PREFETCH_TTL_SECONDS', '30')),
+            enabled=os.getenv('PREFETCH_ENABLED', 'yes').lower() == 'yes',
+            shared_generation=shared_generation,
+        )
+
+    def _generation(self) -> Optional[int]:
+        return self.shared_generation() if self.shared_generation is not None else None
+
+    def schedule(self, session_key: str, query_key: Hashable, fn: Callable, *args) -> bool:
+        """Start fn(*args) in the background unless it is already cached or the budget is spent."""
+        if not self.enabled:
+            return False
+        key = (session_key, current_site(), query_key)
+        generation = self._generation()
+        with self._lock:
+            self._expire_locked()
+            if key in self._entries:
+                return False
+            if self._inflight >= self.max_inflight:
+                self._stats['dropped_budget'] += 1
+                return False
+            if len(self._entries) >= self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                self._discard_locked(oldest)
+            self._inflight += 1
+            self._stats['scheduled'] += 1
+            # Same database site as the caller, but outside its trace and DB timing
+            future = self._executor.submit(site_context().run, self._run, fn, args)
+            self._entries[key] = (future, time.monotonic(), generation)
+        return True
+
+    def _run(self, fn: Callable, args: tuple) -> Any:
+        try:
+            result = fn(*args)
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            raise
+        else:
+            with self._lock:
+                self._stats['completed'] += 1
+            return result
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def get_or_run(self, session_key: str, query_key: Hashable, fn: Callable, *args) -> Any:
+        """Return the prefetched result for this query, or run fn(*args) now on a miss."""
+        key = (session_key, current_site(), query_key)
+        generation = self._generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._usable_locked(key, entry, generation):
+                entry = None
+            self._entries.pop(key, None)
+            self._served.discard(key)
+        if entry is not None:
+            try:
+                with span('prefetch.wait', ready=entry[0].done()):
+                    result = entry[0].result(timeout=self.wait_timeout)
+            except Exception:
+                result = None
+            else:
+                with self._lock:
+                    self._stats['hits'] += 1
+                return result
+        with self._lock:
+            self._stats['misses'] += 1
+        return fn(*args)
+
+    def peek(self, session_key: str, query_key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        Return (result, seconds since it was scheduled) of a prefetch that has already
+        finished, or None. Never waits, and leaves the result for get_or_run().
+        """
+        key = (session_key, current_site(), query_key)
+        generation = self._generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._usable_locked(key, entry, generation):
+                return None
+            future, created_at, _ = entry
+            if not future.done() or future.exception() is not None:
+                return None
+            # Served, so not wasted if nothing consumes it before it expires
+            self._served.add(key)
+            self._stats['hits'] += 1
+        return future.result(), time.monotonic() - created_at
+
+    def invalidate(self) -> None:
+        """Drop everything prefetched, for every session, e.g. after a write to the database."""
+        with self._lock:
+            self._stats['invalidated'] += len(self._entries)
+            self._entries.clear()
+            self._served.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire_locked()
+            stats = dict(self._stats)
+            stats['inflight'] = self._inflight
+            stats['cached'] = len(self._entries)
+        used = stats['hits'] + stats['wasted']
+        stats['hit_rate'] = round(stats['hits'] / (stats['hits'] + stats['misses']), 3) \
+            if stats['hits'] + stats['misses'] else 0.0
+        stats['waste_rate'] = round(stats['wasted'] / used, 3) if used else 0.0
+        return stats
+
+    def _usable_locked(self, key, entry: tuple, generation: Optional[int]) -> bool:
+        """Whether an entry is still fresh; drops it if it expired or another worker wrote since."""
+        if entry[2] != generation:
+            self._entries.pop(key, None)
+            self._served.discard(key)
+            self._stats['invalidated'] += 1
+            return False
+        if time.monotonic() - entry[1] > self.ttl:
+            self._discard_locked(key)
+            return False
+        return True
+
+    def _expire_locked(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if now - e[1] > self.ttl]:
+            self._discard_locked(key)
+
+    def _discard_locked(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None and key not in self._served:
+            self._stats['wasted'] += 1
+        self._served.discard(key)
+
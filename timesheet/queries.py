@@ -0,0 +1,133 @@
+"""
+Read queries used by the timesheet wizard.
+Kept apart from the Flask routes so they can also be run outside a request,
+for example by the prefetcher.
+"""
+import contextlib
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import statements
+from config.database import get_db_connection
+from config.tracing import span
+
+
+VALID_SHIFT_CODES = ['S01', 'S02', 'S03', 'S08', 'S09']
+
+
+def normalize_shifts(shifts: List[str]) -> List[str]:
+    """Upper-case shift codes and drop any that the trip procedures do not accept."""
+    normalized = []
+    for shift_code in shifts:
+        shift_code_upper = shift_code.upper().strip()
+        if shift_code_upper in VALID_SHIFT_CODES and shift_code_upper not in normalized:
+            normalized.append(shift_code_upper)
+    return normalized
+
+
+@contextlib.contextmanager
+def _connection(conn=None):
+    """Yield `conn`, or a new connection that is closed afterwards."""
+    if conn is not None:
+        yield conn
+        return
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def trip_from_row(row) -> Dict:
+    """Convert a miosphere_dtv_get_trip_by_unit* row to the trip dict used by step 2."""
+    return {
+        'id': str(row[0]) if row[0] else None,
+        'reportTime': row[1].isoformat() if row[1] else None,
+        'equipmentNo': row[2] if row[2] else '',
+        'operatorId': row[3] if row[3] else '',
+        'operatorName': row[4] if row[4] else '',
+        'oprShift': row[5] if (len(row) > 5 and row[5] is not None) else '',
+        'loaderId': row[6] if (len(row) > 6 and row[6]) else '',
+        'posName': row[7] if (len(row) > 7 and row[7]) else '',
+        'distance': row[8] if (len(row) > 8 and row[8] is not None) else '',
+        'note': 'deleted' if (len(row) > 9 and row[9] == 1 and (len(row) > 10 and row[10] == 'trip')) else '',
+        'recordType': row[10] if len(row) > 10 else 'trip'
+    }
+
+
+def fetch_trips(equipment: str, operator: str, date: str, shifts: List[str], conn=None) -> List[Dict]:
+    """Fetch the trips of one unit (and optionally one operator) for a date and set of shifts."""
+    with _connection(conn) as conn:
+        all_trips = []
+        seen_ids = set()
+
+        for shift_code in normalize_shifts(shifts):
+            if operator:
+                with statements.run(conn, 'trips_by_unit_nrp', date, shift_code, equipment, operator) as cursor:
+                    rows = cursor.fetchall()
+            else:
+                with statements.run(conn, 'trips_by_unit', date, shift_code, equipment) as cursor:
+                    rows = cursor.fetchall()
+            with span('trips.convert_rows', shift=shift_code, rows=len(rows)):
+                for row in rows:
+                    trip = trip_from_row(row)
+                    trip_id = trip.get('id')
+                    if trip_id:
+                        if trip_id in seen_ids:
+                            continue
+                        seen_ids.add(trip_id)
+                    all_trips.append(trip)
+
+    all_trips.sort(key=lambda x: x['reportTime'] if x['reportTime'] else '')
+    return all_trips
+
+
+def fetch_realtime_hm_validation(conn=None) -> Optional[Dict]:
+    """Run the realtime HM validation procedure; returns None if it produced no result set."""
+    with _connection(conn) as conn, statements.run(conn, 'realtime_hm_validation') as cursor:
+        max_sets = 10
+        sets_checked = 0
+        with span('step3.nextset_loop') as current:
+            while cursor.description is None and sets_checked < max_sets:
+                if not cursor.nextset():
+                    break
+                sets_checked += 1
+            if current is not None:
+                current.set(sets_skipped=sets_checked)
+
+        if cursor.description is None:
+            return None
+
+        col_names = [col[0] for col in cursor.description]
+        rows = cursor.fetchall()
+
+    result = []
+    with span('step3.convert_rows', rows=len(rows), columns=len(col_names)):
+        for row in rows:
+            item = {}
+            for idx, col in enumerate(col_names):
+                val = row[idx] if idx < len(row) else None
+                try:
+                    if hasattr(val, 'isoformat'):
+                        val = val.isoformat()
+                except Exception:
+                    pass
+                item[col] = val
+            result.append(item)
+    return {'columns': col_names, 'rows': result}
+
+
+def fetch_latest_login(mobileid: str, conn=None) -> List[Dict]:
+    """Fetch the latest login history of a unit."""
+    with _connection(conn) as conn, statements.run(conn, 'latest_login', mobileid) as cursor:
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def fetch_login_range(mobileid: str, start: datetime, end: datetime, conn=None) -> List[Dict]:
+    """
+    Fetch the login history of a unit with report times in [start, end).
+    The procedure must first be registered with statements.register_login_range.
+    """
+    with _connection(conn) as conn, statements.run(conn, 'login_range', mobileid, start, end) as cursor:
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,236 @@
+"""
+Declarative request schemas for the timesheet POST endpoints.
+Each payload is described once as a list of fields and compiled into a single
+decoder, so validation happens before any database connection is opened.
+"""
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+VALID_SHIFTS = ('6', '7', '1', '2', '3')
+
+_MISSING = object()
+
+
+class SchemaError(Exception):
+    """Raised when a request payload does not match its schema."""
+
+    def __init__(self, message: str, errors: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or {}
+
+    def to_dict(self) -> Dict:
+        return {'success': False, 'message': self.message, 'errors': self.errors}
+
+
+def parse_datetime(value: Any) -> datetime:
+    """
+    Parse 'YYYY-MM-DDTHH:MM:SS' or 'YYYY-MM-DD HH:MM:SS', optionally with
+    fractional seconds, which are dropped. Report times are the site's local
+    time, so values with a timezone offset (or Z) are rejected rather than
+    having the offset silently ignored.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            raise ValueError('timezone offsets are not supported, send the local time')
+        return value.replace(microsecond=0)
+    if not isinstance(value, str):
+        raise ValueError('expected a datetime string')
+    if len(value) < 19 or value[10] not in 'T ':
+        raise ValueError('expected YYYY-MM-DDTHH:MM:SS')
+    fraction = value[19:]
+    if fraction and not (fraction[0] == '.' and fraction[1:].isdigit()):
+        if fraction[0] in 'Zz+-' or fraction[-1] in 'Zz':
+            raise ValueError('timezone offsets are not supported, send the local time')
+        raise ValueError('expected YYYY-MM-DDTHH:MM:SS')
+    parsed = datetime.fromisoformat(value[:19])
+    if parsed.tzinfo is not None:
+        raise ValueError('timezone offsets are not supported, send the local time')
+    return parsed
+
+
+def _scalar(name: str, value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        raise ValueError(f'Invalid {name} value')
+    return value
+
+
+class Field:
+    """
+    One payload field: where it comes from, how it is coerced and whether it is required.
+    item is the kind every element of a list field must have; invalid_as_none
+    turns a value that fails to decode into None instead of an error.
+    """
+
+    def __init__(self, name: str, kind: str = 'any', required: bool = False, default: Any = None,
+                 choices: Optional[Tuple] = None, empty_as_none: bool = False, item: Optional[str] = None,
+                 invalid_as_none: bool = False):
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.choices = choices
+        self.empty_as_none = empty_as_none
+        self.item = item
+        self.invalid_as_none = invalid_as_none
+
+    def compile(self) -> Callable[[Any], Any]:
+        """Return a function that coerces a present, non-empty raw value or raises ValueError."""
+        if self.kind == 'str':
+            choices = self.choices
+
+            def decode(value):
+                value = str(_scalar(self.name, value)).strip()
+                if choices is not None and value not in choices:
+                    raise ValueError(f'Invalid {self.name} value')
+                return value
+            return decode
+        if self.kind == 'id':
+            def decode(value):
+                # Record ids are numbers or strings; 0, False and blank strings are not ids
+                if isinstance(value, (bool, dict, list)) or not (value.strip() if isinstance(value, str) else value):
+                    raise ValueError(f'Invalid {self.name} value')
+                return value
+            return decode
+        if self.kind == 'float':
+            def decode(value):
+                if isinstance(value, bool):
+                    raise ValueError(f'Invalid {self.name} value')
+                try:
+                    return float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'Invalid {self.name} value')
+            return decode
+        if self.kind == 'datetime':
+            def decode(value):
+                try:
+                    return parse_datetime(value)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f'Invalid date format: {e}')
+            return decode
+        if self.kind == 'list':
+            item = self.item
+
+            def decode(value):
+                if not isinstance(value, list):
+                    raise ValueError(f'{self.name} must be a list')
+                if item == 'str':
+                    if not all(isinstance(element, str) for element in value):
+                        raise ValueError(f'{self.name} must be a list of strings')
+                    return [element.strip() for element in value]
+                return value
+            return decode
+        return lambda value: _scalar(self.name, value)
+
+
+class Schema:
+    """A compiled payload decoder for one endpoint."""
+
+    def __init__(self, name: str, fields: List[Field]):
+        self.name = name
+        self.fields = fields
+        self._plan = tuple(
+            (f.name, f.compile(), f.required, f.default, f.empty_as_none, f.invalid_as_none) for f in fields
+        )
+
+    def decode(self, payload: Any) -> Dict[str, Any]:
+        """Validate and coerce a JSON payload, raising SchemaError with every failing field."""
+        if not isinstance(payload, dict):
+            raise SchemaError('Invalid JSON body')
+        values = {}
+        errors = {}
+        missing = []
+        for name, decode, required, default, empty_as_none, invalid_as_none in self._plan:
+            raw = payload.get(name, _MISSING)
+            if raw is _MISSING or raw is None or raw == '':
+                if required:
+                    missing.append(name)
+                elif raw is _MISSING or raw is None or empty_as_none:
+                    values[name] = list(default) if isinstance(default, list) else default
+                else:
+                    values[name] = raw
+                continue
+            try:
+                values[name] = decode(raw)
+            except ValueError as e:
+                if invalid_as_none:
+                    values[name] = None
+                else:
+                    errors[name] = str(e)
+        if missing:
+            for name in missing:
+                errors[name] = 'Missing required field'
+            raise SchemaError(f"Missing required fields: {', '.join(missing)}", errors)
+        if errors:
+            raise SchemaError(next(iter(errors.values())), errors)
+        return values
+
+
+STEP1 = Schema('step1', [
+    Field('selectedDate', 'str', default=''),
+    Field('selectedShifts', 'list', default=[], item='str'),
+    Field('unitType', 'str', default='3 Shift'),
+])
+
+STEP2 = Schema('step2', [
+    Field('equipmentNumber', 'str', default=''),
+    Field('operatorId', 'str', default=''),
+    Field('trips', 'list', default=[]),
+])
+
+SORT_TRIPS = Schema('sort_trips', [
+    Field('trips', 'list', default=[]),
+])
+
+ADD_TRIP = Schema('add_trip', [
+    Field('reportTime', 'datetime', required=True),
+    Field('equipmentNo', 'id', required=True),
+    Field('operatorId', 'id', required=True),
+    Field('oprShift', empty_as_none=True),
+    Field('loaderId', empty_as_none=True),
+    Field('posName', empty_as_none=True),
+    Field('distance', empty_as_none=True),
+])
+
+TRIP_ID = Schema('trip_id', [
+    Field('id', 'id', required=True),
+])
+
+UPDATE_TRIP = Schema('update_trip', [
+    Field('id', 'id', required=True),
+    Field('reportTime', 'datetime', empty_as_none=True),
+    Field('loaderId', empty_as_none=True),
+    Field('posName', empty_as_none=True),
+    Field('distance', empty_as_none=True),
+])
+
+UPDATE_SHIFT = Schema('update_shift', [
+    Field('id', 'id', required=True),
+    Field('next_id'),
+    # Unparseable times are sent to the procedure as NULL, as they always were
+    Field('reporttime', 'datetime', empty_as_none=True, invalid_as_none=True),
+    Field('next_reporttime', 'datetime', empty_as_none=True, invalid_as_none=True),
+    Field('mobileid'),
+    Field('opr_nrp'),
+    Field('hm'),
+    Field('next_hm'),
+    Field('opr_shift'),
+    Field('new_shift', 'str', required=True, choices=VALID_SHIFTS),
+])
+
+
+def _login_update(id_field: str, hm_field: str) -> Schema:
+    """Schema shared by the endpoints that call miosphere_dtv_insert_login_update."""
+    return Schema(f'login_update_{id_field}', [
+        Field(id_field, 'id', required=True),
+        Field('opr_nrp', 'id', required=True),
+        Field(hm_field),
+        Field('new_hm', 'float', required=True),
+        Field('opr_shift'),
+    ])
+
+
+UPDATE_HM = _login_update('id', 'hm')
+UPDATE_NEXT_HM = _login_update('next_id', 'next_hm')
+UPDATE_PREV_HM = _login_update('prev_id', 'prev_hm')
@@ -0,0 +1,515 @@
+"""
+Read-result cache shared by all worker processes on the host.
+Entries live in one memory-mapped file: a fixed header, an open-addressing index
+of fixed-size slots, and a data arena. A file lock serializes access between
+processes, LRU eviction keeps the arena within its byte budget, and invalidating
+a key or tag in one worker removes it for every worker at once.
+Values are stored as JSON, never pickle, and the file must belong to this user
+and be private to it, so another local user cannot plant entries.
+"""
+import base64
+import getpass
+import hashlib
+import json
+import logging
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, time as dtime
+from decimal import Decimal
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MIOCACH2'
+
+# magic, nslots, arena_size, write_off, live_bytes, occupied slots, hits, misses, evictions,
+# invalidations, write sequence, invalidation generation
+_HEADER = struct.Struct('<8sIQQQQQQQQQQ')
+_HEADER_SIZE = 128
+# key hash, data offset, data length, state, last access, expires at, tag hash, write stamp
+_SLOT = struct.Struct('<16sQIIddQQ')
+
+_EMPTY, _USED, _DELETED = 0, 1, 2
+
+# Values larger than this are zlib-compressed before they are stored
+_COMPRESS_OVER = 2048
+_RAW, _ZLIB = b'\x00', b'\x01'
+
+
+def _key_hash(key: str) -> bytes:
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+def _tag_hash(tag: Optional[str]) -> int:
+    if not tag:
+        return 0
+    return int.from_bytes(hashlib.blake2b(tag.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+
+def _encode(value: Any) -> Any:
+    # The database types found in read results, tagged so they come back with the same type
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'$d': value.isoformat()}
+    if isinstance(value, dtime):
+        return {'$t': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'$dec': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$b': base64.b64encode(bytes(value)).decode('ascii')}
+    raise TypeError(f'{type(value).__name__} values cannot be cached')
+
+
+_DECODERS = {
+    '$dt': datetime.fromisoformat,
+    '$d': date.fromisoformat,
+    '$t': dtime.fromisoformat,
+    '$dec': Decimal,
+    '$b': base64.b64decode,
+}
+
+
+def _decode(obj: dict) -> Any:
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        decoder = _DECODERS.get(key)
+        if decoder is not None and isinstance(value, str):
+            return decoder(value)
+    return obj
+
+
+def serialize(value: Any) -> bytes:
+    """
+    Encode a value as a one-byte format marker plus JSON, compressed when large.
+    Only JSON data and the database scalar types are accepted; tuples come back as lists.
+    """
+    data = json.dumps(value, default=_encode, separators=(',', ':')).encode('utf-8')
+    if len(data) > _COMPRESS_OVER:
+        return _ZLIB + zlib.compress(data, 1)
+    return _RAW + data
+
+
+def deserialize(blob: bytes) -> Any:
+    data = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+    return json.loads(data, object_hook=_decode)
+
+
+def default_cache_path() -> str:
+    """cache.bin in a directory of this user's own under /dev/shm (or the temp directory)."""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    owner = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    return os.path.join(base, f'miosphere-{owner}', 'cache.bin')
+
+
+def _private_directory(path: str) -> None:
+    """Create the cache directory with mode 0700, or check that an existing one is ours and private."""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or (hasattr(os, 'getuid') and (
+            info.st_uid != os.getuid() or info.st_mode & 0o077)):
+        raise PermissionError(f'{path} must be a directory owned by this user with mode 0700')
+
+
+def _check_private(fd: int, path: str) -> None:
+    if not hasattr(os, 'getuid'):
+        return
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f'{path} must be a file owned by this user that no one else can read or write')
+
+
+class FileLock:
+    """Exclusive lock held across processes (flock) and across threads of this process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if self._pid != os.getpid():
+                # flock belongs to the open file, so a forked worker needs its own descriptor
+                self._file = open(self.path, 'a+b')
+                self._pid = os.getpid()
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._thread_lock.release()
+
+
+class SharedCache:
+    """
+    LRU cache in a memory-mapped file, safe to use from several processes and threads.
+    Each worker also keeps its last few decoded values, reused only while the shared
+    entry still carries the same write stamp; callers must not mutate returned values.
+    """
+
+    def __init__(self, path: str, size_bytes: int = 64 * 1024 * 1024, nslots: int = 4096,
+                 local_entries: int = 16):
+        self.path = path
+        self.local_entries = local_entries
+        self._local = OrderedDict()
+        self._local_lock = threading.Lock()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        try:
+            _check_private(fd, self.path)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._file = os.fdopen(fd, 'r+b')
+        self._lock = FileLock(path)
+        with self._lock:
+            header = self._file.read(_HEADER_SIZE)
+            if len(header) < _HEADER_SIZE or header[:8] != MAGIC:
+                nslots = max(64, nslots)
+                total = _HEADER_SIZE + nslots * _SLOT.size + size_bytes
+                self._file.truncate(0)
+                self._file.truncate(total)
+                self._file.seek(0)
+                self._file.write(_HEADER.pack(MAGIC, nslots, size_bytes, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+                self._file.flush()
+            else:
+                # Another worker created the file; its geometry wins
+                _, nslots, size_bytes = _HEADER.unpack_from(header)[:3]
+            self.nslots = nslots
+            self.arena_size = size_bytes
+            self._arena_start = _HEADER_SIZE + nslots * _SLOT.size
+            self._mm = mmap.mmap(self._file.fileno(), self._arena_start + size_bytes)
+
+    @classmethod
+    def from_env(cls) -> Optional['SharedCache']:
+        """Open the cache configured by SHARED_CACHE_* variables, or None if it is disabled."""
+        if os.getenv('SHARED_CACHE_ENABLED', 'no').lower() != 'yes':
+            return None
+        path = os.getenv('SHARED_CACHE_PATH')
+        try:
+            if not path:
+                path = default_cache_path()
+                _private_directory(os.path.dirname(path))
+            return cls(
+                path,
+                size_bytes=int(os.getenv('SHARED_CACHE_BYTES', str(64 * 1024 * 1024))),
+                nslots=int(os.getenv('SHARED_CACHE_SLOTS', '4096')),
+                local_entries=int(os.getenv('SHARED_CACHE_LOCAL_ENTRIES', '16')),
+            )
+        except PermissionError as e:
+            logger.error("Shared cache disabled: %s", e)
+            return None
+
+    # -- header and slot access (caller holds the lock) --------------------
+
+    def _header(self) -> list:
+        return list(_HEADER.unpack_from(self._mm, 0))
+
+    def _set_header(self, header: list) -> None:
+        _HEADER.pack_into(self._mm, 0, *header)
+
+    def _bump(self, index: int, amount: int = 1) -> None:
+        header = self._header()
+        header[index] += amount
+        self._set_header(header)
+
+    def _slot(self, index: int) -> list:
+        return list(_SLOT.unpack_from(self._mm, _HEADER_SIZE + index * _SLOT.size))
+
+    def _set_slot(self, index: int, slot) -> None:
+        _SLOT.pack_into(self._mm, _HEADER_SIZE + index * _SLOT.size, *slot)
+
+    def _find(self, key_hash: bytes) -> int:
+        """Return the slot holding key_hash, or -1."""
+        start = int.from_bytes(key_hash[:8], 'little') % self.nslots
+        for probe in range(self.nslots):
+            index = (start + probe) % self.nslots
+            slot = self._slot(index)
+            if slot[3] == _EMPTY:
+                return -1
+            if slot[3] == _USED and slot[0] == key_hash:
+                return index
+        return -1
+
+    def _free_slot(self, key_hash: bytes) -> int:
+        start = int.from_bytes(key_hash[:8], 'little') % self.nslots
+        for probe in range(self.nslots):
+            index = (start + probe) % self.nslots
+            if self._slot(index)[3] != _USED:
+                return index
+        return -1
+
+    def _delete(self, index: int) -> None:
+        slot = self._slot(index)
+        header = self._header()
+        header[4] -= slot[2]
+        self._set_header(header)
+        slot[3] = _DELETED
+        self._set_slot(index, slot)
+
+    def _used_slots(self) -> list:
+        index = _SLOT.iter_unpack(self._mm[_HEADER_SIZE:self._arena_start])
+        return [(i, list(s)) for i, s in enumerate(index) if s[3] == _USED]
+
+    def _compact(self) -> None:
+        """Move live entries to the front of the arena and rebuild the index without tombstones."""
+        live = sorted(self._used_slots(), key=lambda item: item[1][1])
+        payloads = [(slot, bytes(self._mm[self._arena_start + slot[1]:self._arena_start + slot[1] + slot[2]]))
+                    for _, slot in live]
+        empty = _SLOT.pack(b'\x00' * 16, 0, 0, _EMPTY, 0.0, 0.0, 0, 0)
+        self._mm[_HEADER_SIZE:self._arena_start] = empty * self.nslots
+        offset = 0
+        for slot, data in payloads:
+            self._mm[self._arena_start + offset:self._arena_start + offset + len(data)] = data
+            slot[1] = offset
+            self._set_slot(self._free_slot(slot[0]), slot)
+            offset += len(data)
+        header = self._header()
+        header[3] = offset
+        header[4] = offset
+        header[5] = len(payloads)
+        self._set_header(header)
+
+    def _make_room(self, needed: int) -> None:
+        """Evict least recently used entries until `needed` bytes and a slot are available."""
+        now = time.time()
+        used = []
+        for index, slot in self._used_slots():
+            if slot[5] and slot[5] < now:
+                self._delete(index)
+            else:
+                used.append((index, slot))
+        used.sort(key=lambda item: item[1][4])
+        header = self._header()
+        live_bytes = header[4]
+        evicted = 0
+        # Free a little more than needed so the next writes do not compact again straight away
+        byte_target = self.arena_size * 0.8 - needed
+        slot_target = int(self.nslots * 0.6)
+        while used and (live_bytes > byte_target or len(used) >= slot_target):
+            index, slot = used.pop(0)
+            self._delete(index)
+            live_bytes -= slot[2]
+            evicted += 1
+        if evicted:
+            self._bump(8, evicted)
+        self._compact()
+
+    # -- public API --------------------------------------------------------
+
+    def get(self, key: str, default: Any = None) -> Any:
+        key_hash = _key_hash(key)
+        with self._lock:
+            index = self._find(key_hash)
+            if index < 0:
+                self._bump(7)
+                return default
+            slot = self._slot(index)
+            if slot[5] and slot[5] < time.time():
+                self._delete(index)
+                self._bump(7)
+                return default
+            slot[4] = time.time()
+            self._set_slot(index, slot)
+            self._bump(6)
+            stamp = slot[7]
+            with self._local_lock:
+                local = self._local.get(key)
+                if local is not None and local[0] == stamp:
+                    self._local.move_to_end(key)
+                    return local[1]
+            start = self._arena_start + slot[1]
+            blob = self._mm[start:start + slot[2]]
+        value = deserialize(blob)
+        self._remember(key, stamp, value)
+        return value
+
+    def peek(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """
+        Return (value, seconds until it expires) for a cached key without computing
+        anything, or None if it is not cached; the seconds are None without a TTL.
+        """
+        with self._lock:
+            index = self._find(_key_hash(key))
+            if index < 0:
+                return None
+            expires = self._slot(index)[5]
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            return None
+        return value, (expires - time.time() if expires else None)
+
+    def _remember(self, key: str, stamp: int, value: Any) -> None:
+        if self.local_entries <= 0:
+            return
+        with self._local_lock:
+            self._local[key] = (stamp, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_entries:
+                self._local.popitem(last=False)
+
+    def generation(self) -> int:
+        """Counter bumped by every invalidation, in any worker."""
+        with self._lock:
+            return self._header()[11]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, tag: Optional[str] = None,
+            if_generation: Optional[int] = None) -> bool:
+        """
+        Store a value; returns False if it is too large for the cache or not JSON
+        data, or if `if_generation` is given and an invalidation has happened since.
+        """
+        try:
+            blob = serialize(value)
+        except (TypeError, ValueError) as e:
+            logger.warning("Not caching %s: %s", key, e)
+            return False
+        if len(blob) > self.arena_size // 4:
+            return False
+        key_hash = _key_hash(key)
+        expires = time.time() + ttl if ttl else 0.0
+        with self._lock:
+            if if_generation is not None and self._header()[11] != if_generation:
+                return False
+            index = self._find(key_hash)
+            if index >= 0:
+                self._delete(index)
+            header = self._header()
+            if header[3] + len(blob) > self.arena_size or header[5] >= int(self.nslots * 0.75):
+                self._make_room(len(blob))
+                header = self._header()
+            offset = header[3]
+            start = self._arena_start + offset
+            self._mm[start:start + len(blob)] = blob
+            index = self._free_slot(key_hash)
+            if self._slot(index)[3] == _EMPTY:
+                header[5] += 1
+            header[3] += len(blob)
+            header[4] += len(blob)
+            header[10] += 1
+            stamp = header[10]
+            self._set_header(header)
+            self._set_slot(index, (key_hash, offset, len(blob), _USED, time.time(), expires, _tag_hash(tag), stamp))
+        self._remember(key, stamp, value)
+        return True
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None,
+                       tag: Optional[str] = None) -> Any:
+        """Return the cached value, or compute, store and return it. None results are not cached."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        # A write that lands while we compute may have made the result stale already
+        generation = self.generation()
+        value = compute()
+        if value is not None:
+            self.set(key, value, ttl=ttl, tag=tag, if_generation=generation)
+        return value
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            index = self._find(_key_hash(key))
+            if index >= 0:
+                self._delete(index)
+                self._bump(9)
+            self._bump(11)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Remove every entry stored under any of the tags, in every worker."""
+        hashes = {_tag_hash(t) for t in tags}
+        removed = 0
+        with self._lock:
+            for index, slot in self._used_slots():
+                if slot[6] in hashes:
+                    self._delete(index)
+                    removed += 1
+            if removed:
+                self._bump(9, removed)
+            self._bump(11)
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            for index, _ in self._used_slots():
+                self._delete(index)
+            self._compact()
+
+    def stats(self) -> dict:
+        with self._lock:
+            header = self._header()
+            entries = len(self._used_slots())
+        return {
+            'entries': entries,
+            'slots': header[1],
+            'arena_bytes': header[2],
+            'live_bytes': header[4],
+            'hits': header[6],
+            'misses': header[7],
+            'evictions': header[8],
+            'invalidations': header[9],
+        }
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+
+class LastGoodStore:
+    """
+    The most recent successful result of each read, kept without expiry so it
+    can still be served, marked stale, while the database is unreachable.
+    Kept in this process only: copying every result into the shared cache as
+    well would double its write cost on each miss.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._local: 'OrderedDict[str, tuple]' = OrderedDict()
+
+    def put(self, key: str, value: Any) -> None:
+        entry = (time.time(), value)
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (stored at, value) for the key, or None if nothing was ever stored."""
+        with self._lock:
+            return self._local.get(key)
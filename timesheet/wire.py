@@ -0,0 +1,92 @@
+"""
+Compact wire format for wide read results.
+Instead of a list of dicts that repeats every column name, a compact table
+sends the column names once and the values as arrays, either one array per
+row or one per column. String columns with many repeated values (unit,
+operator, shift, ...) are dictionary-encoded: the distinct strings are sent
+once and the cells hold their index. Clients opt in with
+`Accept: application/vnd.miosphere.compact+json` or `?format=compact`.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+COMPACT_MEDIA_TYPE = 'application/vnd.miosphere.compact+json'
+ORIENTS = ('rows', 'columns')
+
+# A string column is dictionary-encoded when it has at most this share of distinct values
+DICTIONARY_MAX_DISTINCT = 0.5
+
+
+def requested_orient(args, accept_header: str) -> Optional[str]:
+    """
+    Return 'rows' or 'columns' if the request asked for the compact format, else None.
+    `?format=compact&orient=columns` wins over
+    `Accept: application/vnd.miosphere.compact+json; orient=columns`.
+    """
+    if args.get('format') == 'compact':
+        orient = args.get('orient', 'rows')
+        return orient if orient in ORIENTS else 'rows'
+    for part in (accept_header or '').split(','):
+        media_type, *params = [p.strip() for p in part.split(';')]
+        if media_type.lower() != COMPACT_MEDIA_TYPE:
+            continue
+        options = dict(p.split('=', 1) for p in params if '=' in p)
+        if options.get('q', '1').strip() in ('0', '0.0', '0.00', '0.000'):
+            return None
+        orient = options.get('orient', 'rows').strip('"')
+        return orient if orient in ORIENTS else 'rows'
+    return None
+
+
+def _dictionary(values: List[Any]) -> Optional[List[str]]:
+    """Distinct strings of a column worth dictionary-encoding, in first-seen order, or None."""
+    distinct = {}
+    present = 0
+    for value in values:
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            return None
+        present += 1
+        distinct.setdefault(value, len(distinct))
+    if present < 2 or len(distinct) > present * DICTIONARY_MAX_DISTINCT:
+        return None
+    return list(distinct)
+
+
+def encode_table(rows: Sequence[Dict], columns: Optional[Sequence[str]] = None,
+                 orient: str = 'rows') -> Dict:
+    """Encode a list of row dicts as a compact table. Missing keys become null."""
+    if columns is None:
+        columns = []
+        for row in rows:
+            columns.extend(k for k in row if k not in columns)
+    columns = list(columns)
+    by_column = [[row.get(col) for row in rows] for col in columns]
+    dictionaries = {}
+    for col, values in zip(columns, by_column):
+        strings = _dictionary(values)
+        if strings is not None:
+            index = {s: i for i, s in enumerate(strings)}
+            values[:] = [None if v is None else index[v] for v in values]
+            dictionaries[col] = strings
+    return {
+        'format': 'compact',
+        'orient': orient,
+        'columns': columns,
+        'dictionaries': dictionaries,
+        'data': by_column if orient == 'columns' else [list(r) for r in zip(*by_column)],
+    }
+
+
+def decode_table(table) -> List[Dict]:
+    """Turn a compact table back into a list of row dicts; plain lists are returned as-is."""
+    if not isinstance(table, dict) or table.get('format') != 'compact':
+        return table
+    columns = table['columns']
+    by_column = table['data'] if table['orient'] == 'columns' else \
+        [list(c) for c in zip(*table['data'])] or [[] for _ in columns]
+    for idx, col in enumerate(columns):
+        strings = table['dictionaries'].get(col)
+        if strings is not None:
+            by_column[idx] = [None if v is None else strings[v] for v in by_column[idx]]
+    return [dict(zip(columns, values)) for values in zip(*by_column)]